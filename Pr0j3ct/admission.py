@@ -0,0 +1,120 @@
+# admission.py
+# implements admission control of client connections, shedding load with a pre-encoded 503 response
+
+from Pr0j3ct.logging import Logger
+from Pr0j3ct.responsewriter import statusLINE, dateLINE, errorPAGE, SERVER_LINE
+
+import ssl
+import socket
+import threading
+
+
+def clientHOST(connSocketAddress):
+    """
+    Get client host of a "host:port" connection address
+    """
+    return connSocketAddress.rpartition(":")[0]
+
+
+"""
+This class decides at the accept layer whether a new connection is served, so that the server degrades gracefully
+under bursts instead of letting latency collapse for everyone.
+A connection is refused when `maxConnections` connections are already open, when its client host already has
+`maxPerClient` connections open, or when `queued` tasks waiting for a worker reach `shedQueue` (0 disables a limit).
+Refused clients get a pre-encoded 503 with Retry-After and the connection is closed, without parsing their request.
+Connections admitted are counted until `release` is called when they close.
+"""
+class AdmissionController:
+    def __init__(self, maxConnections=0, maxPerClient=0, shedQueue=0, retryAfter=5, metrics=None):
+        self.maxConnections = maxConnections
+        self.maxPerClient = maxPerClient
+        self.shedQueue = shedQueue
+        self.retryAfter = retryAfter
+        self.connections = 0
+        self.clients = {} # client host -> open connections
+        self.counts = {"connections": 0, "client": 0, "queue": 0}
+        self.mutex = threading.Lock() # connections are released by worker threads
+        # response is encoded once, only Date line changes
+        body = errorPAGE(503, "Service Unavailable")
+        self.responseTail = SERVER_LINE + "Retry-After: {}\r\nContent-Length: {}\r\nContent-Type: text/html; charset=utf-8\r\nConnection: close\r\n\r\n".format(
+            int(retryAfter), len(body)).encode("latin-1") + body
+        self.metrics = metrics
+        if metrics is not None:
+            self.shedTotal = metrics.counter("pr0j3ct_shed_total", "Connections and requests refused with 503, by reason (connections, client, queue)", ("reason",))
+            metrics.gauge("pr0j3ct_connections_admitted", "Client connections admitted and not closed yet", lambda: self.connections)
+        self.logger = Logger(self.__class__.__name__)
+
+    def admit(self, connSocketAddress, queued=None):
+        """
+        Admit new connection, given number of `queued` tasks waiting for a worker (`None` to not check queue)\\
+        Return `None` if admitted, the connection must then be released once closed\\
+        Return reason of refusal ("connections", "client" or "queue") if refused
+        """
+        if self.overloaded(queued): return "queue"
+        host = clientHOST(connSocketAddress)
+        with self.mutex:
+            if self.maxConnections and self.connections >= self.maxConnections: return "connections"
+            count = self.clients.get(host, 0)
+            if self.maxPerClient and count >= self.maxPerClient: return "client"
+            self.clients[host] = count + 1
+            self.connections += 1
+        return None
+
+    def release(self, connSocketAddress):
+        """
+        Release admitted connection once closed
+        """
+        host = clientHOST(connSocketAddress)
+        with self.mutex:
+            count = self.clients.get(host, 0)
+            if count <= 0: return
+            if count == 1:
+                del self.clients[host]
+            else:
+                self.clients[host] = count - 1
+            self.connections -= 1
+
+    def overloaded(self, queued):
+        """
+        Check if `queued` tasks waiting for a worker reach the shedding threshold
+        """
+        return bool(self.shedQueue) and queued is not None and queued >= self.shedQueue
+
+    def response(self):
+        """
+        Get 503 response in bytes
+        """
+        return statusLINE(503, "Service Unavailable") + dateLINE() + self.responseTail
+
+    def shed(self, connSocket, connSocketAddress, reason):
+        """
+        Send 503 response without waiting, and close connection\\
+        TLS connections whose handshake is not done are closed without response
+        """
+        self.counts[reason] += 1
+        if self.metrics is not None: self.shedTotal.inc(1, (reason,))
+        self.logger.warn("Client {} refused, {} limit reached", connSocketAddress, reason)
+        try:
+            connSocket.setblocking(False)
+            if not (isinstance(connSocket, ssl.SSLSocket) and connSocket.version() is None):
+                # read request already received, so that closing does not reset connection before response is read
+                try:
+                    connSocket.recv(65536)
+                except (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                    pass
+                connSocket.send(self.response())
+                connSocket.shutdown(socket.SHUT_WR)
+        except (OSError, ssl.SSLError):
+            pass # client is gone or its buffer is full, nothing more is done for it
+        finally:
+            connSocket.close()
+
+    def stats(self):
+        """
+        Get open connections and counts of refusals by reason
+        """
+        with self.mutex:
+            stats = dict(self.counts)
+            stats["open"] = self.connections
+            stats["clients"] = len(self.clients)
+        return stats
@@ -2,24 +2,41 @@
 # implements handler for authentication
 
 from Pr0j3ct.logging import Logger
+from Pr0j3ct.rulematcher import RuleMatcher, RuleSet
+from Pr0j3ct.sessionstore import SessionStore, newToken
+from Pr0j3ct.credentialstore import CredentialStore
+from Pr0j3ct.responsecache import ResponseCache
+from Pr0j3ct.handlerloader import HandlerLoader
 
 import os
-import glob
 import json
+import time
 import ntpath
 import threading
-import subprocess
 
 """
 This class load local rules defines in the website's root directory and provide functions to authenticate user login.
 """
 class AuthHandler:
-    def __init__(self, rootDirectory):
+    def __init__(self, rootDirectory, metrics=None, sessionStore=None):
         self._init_keys()
         self.rootDirectory = rootDirectory
+        self.sessions = sessionStore if sessionStore is not None else SessionStore() # session token -> username
         self.logger = Logger(self.__class__.__name__)
+        self.metrics = metrics
+        if metrics is not None:
+            self.handlerDuration = metrics.histogram("pr0j3ct_handler_duration_seconds", "Time spent in page handler scripts", ("handler",))
+            self.handlerErrors = metrics.counter("pr0j3ct_handler_errors_total", "Page handler scripts which raised an exception", ("handler",))
+            self.authDecisions = metrics.counter("pr0j3ct_auth_decisions_total", "Path authentication results", ("decision",))
+            self.rulesReloads = metrics.counter("pr0j3ct_rules_reloads_total", "Reloads of rules.json")
+            self.sessionEvents = metrics.counter("pr0j3ct_session_events_total", "User sessions started and ended", ("event",))
+            self.cacheLookups = metrics.counter("pr0j3ct_response_cache_total", "Handler response cache lookups, by result (hit, miss, coalesced, timeout)", ("handler", "result"))
+        self.maxDecisionCacheSize = 4096 # max number of cached (user, path) decisions
+        self.rulesCheckInterval = 1.0 # min seconds between two checks of rules.json on disk
+        self.handlerLoader = HandlerLoader(self.rootDirectory)
+        self.credentials = None # CredentialStore of database, None if no database
+        self.reloadMutex = threading.Lock() # only one thread reloads rules, others keep using current snapshot
         self._init_rules()
-        self.mutex = threading.Condition() # mutex for multithreading synchronization
     
     def _init_keys(self):
         """
@@ -32,11 +49,25 @@ class AuthHandler:
         self.KEY_Username = "Username"
         self.KEY_Files = "Files"
         self.KEY_Handler = "Handler"
+        self.KEY_Cache = "Cache"
+        self.KEY_TTL = "TTL"
+        self.KEY_MaxEntries = "MaxEntries"
+        self.KEY_MaxBytes = "MaxBytes"
+        self.KEY_PerUser = "PerUser"
+        self.KEY_Params = "Params"
+        self.KEY_WaitTimeout = "WaitTimeout"
 
     def _init_rules(self):
         """
         Init pre-defined rules in root directory
         """
+        self._load_rules()
+        self._save()
+
+    def _load_rules(self):
+        """
+        Load and validate rules in root directory, then compile them for path matching
+        """
         rules = {}
         # database = {}
         if not os.path.exists(os.path.join(self.rootDirectory, "rules.json")):
@@ -51,124 +82,224 @@ class AuthHandler:
                 # database
                 self.KEY_Database: "",
                 # define specific handlers for web page
-                self.KEY_Handler: {}
+                self.KEY_Handler: {},
+                # response caches of handlers
+                self.KEY_Cache: {}
             }
         else:
             with open(os.path.join(self.rootDirectory, "rules.json")) as inFile:
                 rules = json.load(inFile)
         # validate rules
         if self.KEY_Allow not in rules.keys():
-            self.logger.warn("'{}' not defined in {}, setting to default".format(self.KEY_Allow, os.path.join(self.rootDirectory, "rules.json")))
+            self.logger.warn("'{}' not defined in {}, setting to default", self.KEY_Allow, os.path.join(self.rootDirectory, "rules.json"))
             rules[self.KEY_Allow] = ["*"]
         if self.KEY_Forbidden not in rules.keys():
-            self.logger.warn("'{}' not defined in {}, setting to default".format(self.KEY_Forbidden, os.path.join(self.rootDirectory, "rules.json")))
+            self.logger.warn("'{}' not defined in {}, setting to default", self.KEY_Forbidden, os.path.join(self.rootDirectory, "rules.json"))
             rules[self.KEY_Forbidden] = ["*"]
         if self.KEY_Exception not in rules.keys():
-            self.logger.warn("'{}' not defined in {}, setting to default".format(self.KEY_Exception, os.path.join(self.rootDirectory, "rules.json")))
+            self.logger.warn("'{}' not defined in {}, setting to default", self.KEY_Exception, os.path.join(self.rootDirectory, "rules.json"))
             rules[self.KEY_Exception] = []
         if self.KEY_Database not in rules.keys():
-            self.logger.warn("'{}' not defined in {}, setting to default".format(self.KEY_Database, os.path.join(self.rootDirectory, "rules.json")))
+            self.logger.warn("'{}' not defined in {}, setting to default", self.KEY_Database, os.path.join(self.rootDirectory, "rules.json"))
             rules[self.KEY_Database] = ""
         if self.KEY_Handler not in rules.keys():
-            self.logger.warn("'{}' not defined in {}, setting to default".format(self.KEY_Handler, os.path.join(self.rootDirectory, "rules.json")))
+            self.logger.warn("'{}' not defined in {}, setting to default", self.KEY_Handler, os.path.join(self.rootDirectory, "rules.json"))
             rules[self.KEY_Handler] = {}
+        if self.KEY_Cache not in rules.keys():
+            self.logger.warn("'{}' not defined in {}, setting to default", self.KEY_Cache, os.path.join(self.rootDirectory, "rules.json"))
+            rules[self.KEY_Cache] = {}
         # remove wrong format exceptions
         rulesExceptionToRemove = []
         for item in rules[self.KEY_Exception]:
             if (not self.KEY_Username in item.keys()) or (not self.KEY_Files in item.keys()):
-                self.logger.warn("Item {} has wrong format, removed in {}".format(item, os.path.join(self.rootDirectory, "rules.json")))
+                self.logger.warn("Item {} has wrong format, removed in {}", item, os.path.join(self.rootDirectory, "rules.json"))
                 rulesExceptionToRemove.append(item)
         for item in rulesExceptionToRemove:
             rules[self.KEY_Exception].remove(item)
         # check database
         if not os.path.exists(os.path.join(self.rootDirectory, rules[self.KEY_Database])):
-            self.logger.warn("Database {} not found, removed in {}".format(os.path.join(self.rootDirectory, rules[self.KEY_Database]), os.path.join(self.rootDirectory, "rules.json")))
+            self.logger.warn("Database {} not found, removed in {}", os.path.join(self.rootDirectory, rules[self.KEY_Database]), os.path.join(self.rootDirectory, "rules.json"))
             rules[self.KEY_Database] = ""
-            self.databasePath = None
+            databasePath = None
         else:
-            self.databasePath = os.path.join(self.rootDirectory, rules[self.KEY_Database])
+            databasePath = os.path.join(self.rootDirectory, rules[self.KEY_Database])
         # remove not found handlers
         rulesHandlerToRemove = []
         for key, val in rules[self.KEY_Handler].items():
             if (not os.path.isfile(os.path.join(self.rootDirectory, val))) or (val.split(".")[-1] != "py"):
-                self.logger.warn("Handler {} not found or not Python script, removed in {}".format(os.path.join(self.rootDirectory, val), os.path.join(self.rootDirectory, "rules.json")))
+                self.logger.warn("Handler {} not found or not Python script, removed in {}", os.path.join(self.rootDirectory, val), os.path.join(self.rootDirectory, "rules.json"))
                 rulesHandlerToRemove.append(key)
         for key in rulesHandlerToRemove:
             del rules[self.KEY_Handler][key]
-        self.rules = rules
+        # remove caches of pages without handler, or with wrong format
+        rulesCacheToRemove = []
+        for key, val in rules[self.KEY_Cache].items():
+            if key not in rules[self.KEY_Handler] or not self._valid_cache(val):
+                self.logger.warn("Cache {} has no handler or wrong format, removed in {}", key, os.path.join(self.rootDirectory, "rules.json"))
+                rulesCacheToRemove.append(key)
+        for key in rulesCacheToRemove:
+            del rules[self.KEY_Cache][key]
+        # keep loaded credentials unless database file changed, the store reloads updated users by itself
+        if databasePath is None:
+            self.credentials = None
+        elif self.credentials is None or self.credentials.path != databasePath:
+            self.credentials = CredentialStore(databasePath)
+        self.ruleSet = self._compile_rules(rules, databasePath)
         self.logger.info("Rules initialized")
-        self.authorized_list = {}
-        self.logger.info("Authorization list initialized")
-        self._save()
-        
+
+    def _compile_rules(self, rules, databasePath):
+        """
+        Compile loaded rules into a new rule snapshot
+        """
+        exceptions = {}
+        for item in rules[self.KEY_Exception]:
+            # only first entry of a user is effective
+            exceptions.setdefault(item[self.KEY_Username], item[self.KEY_Files])
+        matcher = RuleMatcher(self.rootDirectory, rules[self.KEY_Allow], rules[self.KEY_Forbidden], exceptions)
+        handlers = {key: os.path.join(self.rootDirectory, val) for key, val in rules[self.KEY_Handler].items()}
+        # caches start empty with each rules version
+        caches = {key: ResponseCache(val[self.KEY_TTL], val.get(self.KEY_MaxEntries, 256), val.get(self.KEY_MaxBytes, 16*1024*1024),
+                                     val.get(self.KEY_PerUser, False), val.get(self.KEY_Params), val.get(self.KEY_WaitTimeout, 10))
+                  for key, val in rules[self.KEY_Cache].items()}
+        return RuleSet(rules, matcher, databasePath, handlers, self.maxDecisionCacheSize, caches)
+
+    def _valid_cache(self, cache):
+        """
+        Check format of a handler cache entry: positive `TTL`, optional positive `MaxEntries` and `MaxBytes`,
+        boolean `PerUser`, list of parameter names `Params` and positive `WaitTimeout`
+        """
+        if not isinstance(cache, dict): return False
+        def positive(value): return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+        if not positive(cache.get(self.KEY_TTL)): return False
+        if self.KEY_WaitTimeout in cache and not positive(cache[self.KEY_WaitTimeout]): return False
+        for key in (self.KEY_MaxEntries, self.KEY_MaxBytes):
+            if key in cache and not (positive(cache[key]) and isinstance(cache[key], int)): return False
+        if not isinstance(cache.get(self.KEY_PerUser, False), bool): return False
+        params = cache.get(self.KEY_Params, [])
+        return isinstance(params, list) and all(isinstance(x, str) for x in params)
+
+    def _rules_signature(self):
+        """
+        Get (mtime, size) of rules.json on disk, `None` if not found
+        """
+        try:
+            stat = os.stat(os.path.join(self.rootDirectory, "rules.json"))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _check_rules(self):
+        """
+        Reload rules if rules.json is changed on disk, checked at most once every `rulesCheckInterval` seconds
+        """
+        now = time.monotonic()
+        if now - self.rulesCheckedAt < self.rulesCheckInterval: return
+        # if another thread is checking, keep using current rules
+        if not self.reloadMutex.acquire(blocking=False): return
+        try:
+            self.rulesCheckedAt = now
+            signature = self._rules_signature()
+            if signature == self.rulesSignature: return
+            self.rulesSignature = signature
+            self._load_rules()
+            if self.metrics is not None: self.rulesReloads.inc()
+            self.logger.info("Rules reloaded")
+        except (OSError, ValueError) as e:
+            self.logger.error("Failed to reload rules: {}", e)
+        finally:
+            self.reloadMutex.release()
+
     def _save(self):
         """
         Save updated rules
         """
-        with open(os.path.join(self.rootDirectory, "rules.json"), "w") as outFile:
-            json.dump(self.rules, outFile, indent=4)
+        # write to a temporary file first, so that other processes never read a partly written file
+        path = os.path.join(self.rootDirectory, "rules.json")
+        temporaryPath = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporaryPath, "w") as outFile:
+            json.dump(self.ruleSet.rules, outFile, indent=4)
+        os.replace(temporaryPath, path)
+        self.rulesSignature = self._rules_signature()
+        self.rulesCheckedAt = time.monotonic()
         self.logger.info("Rules saved")
 
-    def auth(self, path, clientIP):
-        """
-        Authenticate path, given a user
-        """
-        # remove port information
-        clientIP = clientIP.split(":")[0]
-        if clientIP in self.authorized_list.keys():
-            user = self.authorized_list[clientIP]
-            # if user is given and database is not empty, check exception
-            if user and self.databasePath:
-                for item in self.rules[self.KEY_Exception]:
-                    if item[self.KEY_Username] == user:
-                        # check if path is exception
-                        for filename in item[self.KEY_Files]:
-                            # user glob for path matching
-                            if os.path.normpath(path) in glob.glob(os.path.join(self.rootDirectory, filename)):
-                                return True # access is accepted
-                        break
-        # else check in allowed paths
-        for item in self.rules[self.KEY_Allow]:
-            if os.path.normpath(path) in glob.glob(os.path.join(self.rootDirectory, item)):
-                return True
-        # else check forbidden paths
-        for item in self.rules[self.KEY_Forbidden]:
-            if os.path.normpath(path) in glob.glob(os.path.join(self.rootDirectory, item)):
-                return False
-        # by default, return True
-        self.logger.warn("Path {} is authenticated, but not mentioned in rules.json".format(path))
-        return True
-
-    def handle(self, path, params):
-        """
-        Handle parameters using specified handlers, only for html pages
-        """
-        if not params: return []
+    def auth(self, path, token=None):
+        """
+        Authenticate path, given session token of client (`None` for anonymous client)
+        """
+        self._check_rules()
+        ruleSet = self.ruleSet # use one snapshot for whole check
+        user = self.sessions.get(token) if token else None
+        # user exceptions only apply if user is given and database is not empty
+        if not (user and ruleSet.databasePath): user = None
+        decision = ruleSet.decide(os.path.normpath(path), user)
+        if self.metrics is not None:
+            self.authDecisions.inc(1, ("default" if decision is None else "allow" if decision else "deny",))
+        if decision is None:
+            # by default, return True
+            self.logger.warn("Path {} is authenticated, but not mentioned in rules.json", path)
+            return True
+        return decision
+
+    def handle(self, path, params, request=None, token=None):
+        """
+        Handle parameters using specified handlers, only for html pages\
+        `request` is the `HttpRequest` being handled, giving handlers access to headers and raw body\
+        Handlers verify logins with the credential store of database, given in their context\
+        Responses of GET and HEAD requests (no `request`) are cached if handler has a cache in rules\
+        `token` is the session token of client, for caches per user\
+        Return `(header, body)` in bytes from handler\
+        Return `None` if not handled
+        """
+        if not params and (request is None or request.body is None): return None
         pathHead, pathTail = ntpath.split(path)
         filename = pathTail or ntpath.basename(pathHead)
-        for key, val in self.rules[self.KEY_Handler].items():
-            if key == filename:
-                command = "python \"{}\" ".format(glob.glob(os.path.join(self.rootDirectory, val))[0])
-                for pKey, pVal in params.items():
-                    command += "--{} ".format(pKey)
-                    for pValItem in pVal:
-                        command += "\"{}\" ".format(pValItem)
-                proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-                result = proc.communicate()[0]
-                if len(result) <= 0: return []
-                result = result.decode("utf-8").split("\r\n\r\n") # read output from handler file and convert to string
-                result = [x for x in result if x]
-                return result
-        self.logger.warn("Failed to handle {}, unknown handler".format(path))
-        return []
-
-    def updateUserSession(self, clientIP, user):
-        """
-        Update authorized user session
-        """
-        # remove port information
-        clientIP = clientIP.split(":")[0]
-        self.authorized_list[clientIP] = user
+        ruleSet = self.ruleSet
+        scriptPath = ruleSet.handlers.get(filename)
+        if scriptPath:
+            cache = ruleSet.caches.get(filename) if request is None else None
+            if cache is None:
+                return self._call_handler(filename, scriptPath, params, request)
+            user = self.sessions.get(token) if (cache.perUser and token) else None
+            data, result = cache.get(cache.key(params, user), lambda: self._call_handler(filename, scriptPath, params, request))
+            if self.metrics is not None: self.cacheLookups.inc(1, (filename, result))
+            return data
+        self.logger.warn("Failed to handle {}, unknown handler", path)
+        return None
+
+    def _call_handler(self, filename, scriptPath, params, request):
+        """
+        Run handler script of page\
+        Return `(header, body)` in bytes from handler\
+        Return `None` if not handled or handler failed
+        """
+        start = time.perf_counter()
+        try:
+            return self.handlerLoader.call(scriptPath, params, request, self.credentials)
+        except Exception as e:
+            self.logger.error("Handler {} failed: {}", scriptPath, e)
+            if self.metrics is not None: self.handlerErrors.inc(1, (filename,))
+            return None
+        finally:
+            if self.metrics is not None: self.handlerDuration.observe(time.perf_counter() - start, (filename,))
+
+    def login(self, user):
+        """
+        Start session of a logged in user, and build its permission set\\
+        Return new session token
+        """
+        token = newToken()
+        self.sessions.set(token, user)
+        self.ruleSet.permissions(user)
+        if self.metrics is not None: self.sessionEvents.inc(1, ("login",))
+        return token
+
+    def logout(self, token):
+        """
+        End session of token
+        """
+        self.sessions.delete(token)
+        if self.metrics is not None: self.sessionEvents.inc(1, ("logout",))
 
     def shutdown(self):
         """
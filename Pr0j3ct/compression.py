@@ -0,0 +1,65 @@
+# compression.py
+# implements Content-Encoding negotiation and compression of response bodies
+
+import gzip
+import zlib
+
+
+"""
+This class chooses a content encoding from the client's Accept-Encoding header and compresses response bodies.
+Only compressible types (text, scripts, json, xml, svg...) are compressed, already compressed types
+such as images, archives or office documents are always sent as they are.
+"""
+class Compressor:
+    def __init__(self, level=6, minSize=256):
+        self.level = level # compression level, 1 (fast) to 9 (small)
+        self.minSize = minSize # bodies smaller than this are not worth compressing
+        self.encodings = ["gzip", "deflate"] # supported encodings, in order of preference
+        self.compressibleTypes = {
+            "application/javascript", "application/json", "application/xml", "application/xhtml+xml",
+            "application/rss+xml", "application/atom+xml", "application/x-javascript", "image/svg+xml",
+            "image/x-icon", "application/wasm",
+        }
+
+    def compressible(self, contentType):
+        """
+        Check if content type is worth compressing
+        """
+        if not contentType: return False
+        contentType = contentType.split(";")[0].strip().lower()
+        return contentType.startswith("text/") or contentType in self.compressibleTypes
+
+    def negotiate(self, acceptEncoding):
+        """
+        Choose encoding from Accept-Encoding header value\\
+        Return `None` if no supported encoding is accepted
+        """
+        if not acceptEncoding: return None
+        weights = {}
+        for item in acceptEncoding.split(","):
+            name, _, params = item.partition(";")
+            name = name.strip().lower()
+            weight = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    weight = float(params[2:])
+                except ValueError:
+                    weight = 0.0
+            weights[name] = weight
+        best, bestWeight = None, 0.0
+        for encoding in self.encodings:
+            weight = weights.get(encoding, weights.get("*", 0.0))
+            if weight > bestWeight:
+                best, bestWeight = encoding, weight
+        return best
+
+    def compress(self, data, encoding):
+        """
+        Compress bytes with given encoding
+        """
+        if encoding == "gzip":
+            return gzip.compress(data, compresslevel=self.level, mtime=0)
+        if encoding == "deflate":
+            return zlib.compress(data, self.level)
+        raise ValueError("encoding: {} is not supported".format(encoding))
@@ -0,0 +1,153 @@
+# connectionwatcher.py
+# implements watcher of idle connections in thread mode, so that workers only run requests
+
+from Pr0j3ct.logging import Logger
+
+import time
+import socket
+import selectors
+import threading
+import collections
+
+
+"""
+This class watches the connections of thread mode waiting for their next request in one thread.
+A `RequestProcessor` with nothing left to read parks its connection here once no worker is free for other tasks,
+and gives its worker back to the pool, so idle keep-alive connections never keep other clients waiting for a worker.
+Once data arrives, the processor is queued to the scheduler again and run by the next free worker. Parked connections past one of their deadlines (see `RequestProcessor.expired`) are closed,
+and requests of connections which cannot be queued are answered with 503 by `admission`.
+"""
+class ConnectionWatcher:
+    def __init__(self, scheduler, admission=None):
+        """
+        `scheduler` is the `Scheduler` running processors with data to read\
+        `admission` is the `AdmissionController` shedding requests the scheduler refuses, or `None` to close them
+        """
+        self.scheduler = scheduler
+        self.admission = admission
+        self.selector = selectors.DefaultSelector()
+        self.parked = set() # processors watched by selector
+        self.incoming = collections.deque() # processors parked by worker threads, registered by watcher thread
+        self.wakeupReader, self.wakeupWriter = socket.socketpair()
+        self.wakeupReader.setblocking(False)
+        self.wakeupWriter.setblocking(False)
+        self.running = False
+        self.thread = None
+        self.logger = Logger(self.__class__.__name__)
+
+    def start(self):
+        """
+        Start watcher thread
+        """
+        self.selector.register(self.wakeupReader, selectors.EVENT_READ, None)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="ConnectionWatcher", daemon=True)
+        self.thread.start()
+        self.logger.info("Connection watcher started")
+
+    def stop(self):
+        """
+        Stop watcher thread and close all parked connections
+        """
+        if not self.running: return
+        self.running = False
+        self._wake()
+        self.thread.join()
+        for processor in list(self.parked) + list(self.incoming):
+            processor.stop()
+        self.parked.clear()
+        self.incoming.clear()
+        self.selector.close()
+        self.wakeupReader.close()
+        self.wakeupWriter.close()
+        self.logger.info("Connection watcher stopped")
+        self.logger.close()
+
+    def park(self, processor):
+        """
+        Watch connection of processor until it has data to read (called by worker thread, which then returns)
+        """
+        if not self.running:
+            processor.stop()
+            return
+        self.incoming.append(processor)
+        self._wake()
+
+    def _wake(self):
+        """
+        Wake up watcher thread waiting in selector
+        """
+        try:
+            self.wakeupWriter.send(b"\0")
+        except (BlockingIOError, socket.error):
+            pass # watcher is already woken up or stopped
+
+    def _run(self):
+        """
+        Requeue processors of readable connections until `stop` is called
+        """
+        lastSweep = time.monotonic()
+        while self.running:
+            for key, mask in self.selector.select(timeout=1):
+                if key.data is None:
+                    self._drain()
+                else:
+                    self._ready(key.data)
+            self._register()
+            if time.monotonic() - lastSweep >= 1:
+                lastSweep = time.monotonic()
+                self._sweep()
+
+    def _drain(self):
+        """
+        Read all wakeup bytes
+        """
+        try:
+            while self.wakeupReader.recv(4096): pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _register(self):
+        """
+        Watch connections parked by workers
+        """
+        while self.incoming:
+            processor = self.incoming.popleft()
+            try:
+                self.selector.register(processor.connSocket, selectors.EVENT_READ, processor)
+            except (ValueError, KeyError, OSError):
+                # closed while being parked
+                processor.stop()
+                continue
+            self.parked.add(processor)
+
+    def _unregister(self, processor):
+        """
+        Stop watching connection of processor
+        """
+        self.parked.discard(processor)
+        try:
+            self.selector.unregister(processor.connSocket)
+        except (ValueError, KeyError, OSError):
+            pass
+
+    def _ready(self, processor):
+        """
+        Queue processor of readable connection to be run by a worker
+        """
+        self._unregister(processor)
+        if not self.scheduler.add(processor):
+            if self.admission is not None:
+                self.admission.shed(processor.connSocket, processor.connSocketAddress, "queue")
+            processor.stop()
+
+    def _sweep(self):
+        """
+        Close parked connections past one of their deadlines
+        """
+        for processor in list(self.parked):
+            reason = processor.expired()
+            if reason:
+                self._unregister(processor)
+                processor.expire(reason)
+                processor.stop()
@@ -0,0 +1,100 @@
+# contentcache.py
+# implements in-memory LRU cache of small static files
+
+import threading
+import collections
+
+
+"""
+This class is one cached file content, with the stat data it was read with.
+"""
+class _CacheEntry:
+    def __init__(self, data, mtime, size):
+        self.data = data
+        self.mtime = mtime
+        self.size = size
+
+
+"""
+This class keeps content of hot static files in memory as bytes, shared by all request processors.
+Total size of cached content is limited by `maxBytes`, files larger than `maxEntrySize` are never cached,
+and least recently used entries are evicted first. An entry is dropped when file's mtime or size changes.
+"""
+class ContentCache:
+    def __init__(self, maxBytes=64*1024*1024, maxEntrySize=1024*1024):
+        self.maxBytes = maxBytes
+        self.maxEntrySize = maxEntrySize
+        self.entries = collections.OrderedDict() # key -> _CacheEntry, least recently used first
+        self.mutex = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, fileStat):
+        """
+        Get cached content of key, valid only if it is cached with same mtime and size as `fileStat`\\
+        Return `None` if not cached
+        """
+        with self.mutex:
+            entry = self.entries.get(key)
+            if entry is not None and entry.mtime == fileStat.st_mtime_ns and entry.size == fileStat.st_size:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry.data
+            if entry is not None:
+                # file is changed
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, fileStat, data):
+        """
+        Cache content of key, read with stat data `fileStat`\\
+        Return `True` if cached
+        """
+        if len(data) > self.maxEntrySize or len(data) > self.maxBytes: return False
+        with self.mutex:
+            if key in self.entries: self._remove(key)
+            self.entries[key] = _CacheEntry(data, fileStat.st_mtime_ns, fileStat.st_size)
+            self.bytes += len(data)
+            # evict least recently used entries
+            while self.bytes > self.maxBytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return True
+
+    def fetch(self, filePath, fileStat):
+        """
+        Get content of file from cache, read and cache it on miss\\
+        Return `None` if file is too large to be cached
+        """
+        if fileStat.st_size > self.maxEntrySize: return None
+        data = self.get(filePath, fileStat)
+        if data is not None: return data
+        with open(filePath, "rb") as inputFile:
+            data = inputFile.read(self.maxEntrySize + 1)
+        # file is changed after stat, do not cache it
+        if len(data) != fileStat.st_size: return None
+        self.put(filePath, fileStat, data)
+        return data
+
+    def stats(self):
+        """
+        Get counters of cache
+        """
+        with self.mutex:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        """
+        Remove entry, mutex should be held
+        """
+        entry = self.entries.pop(key)
+        self.bytes -= len(entry.data)
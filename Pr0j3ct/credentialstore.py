@@ -0,0 +1,166 @@
+# credentialstore.py
+# implements indexed store of user credentials loaded from the website database file
+
+from Pr0j3ct.logging import Logger
+
+import os
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import threading
+
+
+# password hash format: pbkdf2_sha256$iterations$salt$hash, salt and hash in base64
+HASH_PREFIX = "pbkdf2_sha256$"
+HASH_ITERATIONS = 200000
+
+# bytes read at once when checking loaded part of file
+READ_SIZE = 1024 * 1024
+
+
+def hashPassword(password, iterations=HASH_ITERATIONS, salt=None):
+    """
+    Hash password with a random salt, return hash string to store in database
+    """
+    salt = salt or secrets.token_bytes(16)
+    derived = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return "{}{}${}${}".format(HASH_PREFIX, iterations, base64.b64encode(salt).decode("ascii"), base64.b64encode(derived).decode("ascii"))
+
+
+def isHashed(stored):
+    """
+    Check if stored password is a hash, else it is a legacy plaintext password
+    """
+    return stored.startswith(HASH_PREFIX)
+
+
+def checkPassword(password, stored):
+    """
+    Check password against stored hash (or legacy plaintext password) in constant time
+    """
+    if not isHashed(stored):
+        # legacy entry costs a hash check too, so that timing does not tell which users exist
+        checkPassword(password, _DUMMY_HASH)
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    try:
+        _, iterations, salt, expected = stored.split("$")
+        derived = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), base64.b64decode(salt), int(iterations))
+        return hmac.compare_digest(derived, base64.b64decode(expected))
+    except ValueError:
+        return False
+
+
+# hash checked for unknown users, so that they take as long as known ones
+_DUMMY_HASH = hashPassword(secrets.token_urlsafe(16))
+
+
+"""
+This class loads the users database file (alternating username and password lines) once into a dictionary,
+so that verifying a login is a lookup and one hash check, whatever the number of users.
+The file is checked for changes at most once every `checkInterval` seconds. If it was only appended to (the digest of
+the loaded part is unchanged), only new lines are read, else the whole file is reloaded and swapped in, so a password
+changed or a user removed anywhere in the file is never kept.
+Passwords are salted PBKDF2 hashes (see `hashPassword`), plaintext passwords of older databases are still accepted.
+"""
+class CredentialStore:
+    def __init__(self, path, checkInterval=1.0):
+        self.path = path
+        self.checkInterval = checkInterval
+        self.users = {} # username -> stored password
+        self.offset = 0 # bytes of file loaded
+        self.digest = hashlib.sha256() # digest of loaded part
+        self.signature = None
+        self.checkedAt = 0
+        self.mutex = threading.Lock() # only one thread reloads, others keep using loaded users
+        self.logger = Logger(self.__class__.__name__)
+        self._check(force=True)
+
+    def verify(self, username, password):
+        """
+        Check username and password\\
+        Return `True` if user exists and password is correct
+        """
+        self._check()
+        stored = self.users.get(username)
+        if stored is None:
+            checkPassword(password, _DUMMY_HASH)
+            return False
+        return checkPassword(password, stored)
+
+    def __contains__(self, username):
+        self._check()
+        return username in self.users
+
+    def __len__(self):
+        return len(self.users)
+
+    def _check(self, force=False):
+        """
+        Reload users if file changed on disk
+        """
+        now = time.monotonic()
+        if not force and now - self.checkedAt < self.checkInterval: return
+        if not self.mutex.acquire(blocking=force): return
+        try:
+            self.checkedAt = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                if self.signature is not None:
+                    self.logger.warn("Database {} not found, no user can log in", self.path)
+                self.users, self.offset, self.digest, self.signature = {}, 0, hashlib.sha256(), None
+                return
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self.signature: return
+            self._load()
+            self.signature = signature
+        except OSError as e:
+            self.logger.error("Failed to load database {}: {}", self.path, e)
+        finally:
+            self.mutex.release()
+
+    def _load(self):
+        """
+        Read new lines of file if it was only appended to, else read whole file
+        """
+        with open(self.path, "rb") as inFile:
+            size = os.fstat(inFile.fileno()).st_size
+            # loaded part must be unchanged byte for byte, an edit in place keeps the size of a fixed length hash
+            incremental = 0 < self.offset <= size and self._prefixDIGEST(inFile, self.offset) == self.digest.digest()
+            offset = self.offset if incremental else 0
+            inFile.seek(offset)
+            data = inFile.read()
+        users = self.users if incremental else {}
+        lines = data.split(b"\n")
+        consumed = 0 # bytes of complete username and password pairs
+        position = 0
+        for i in range(0, len(lines) - 1, 2):
+            username = lines[i].decode("utf-8", errors="replace").strip()
+            password = lines[i + 1].decode("utf-8", errors="replace").strip()
+            position += len(lines[i]) + len(lines[i + 1]) + 2
+            # a last password line without line break may still be written to, it is read again next time
+            if i + 2 < len(lines): consumed = position
+            # a username without password (odd number of lines) is rejected rather than given an empty password
+            if username and password: users[username] = password
+        offset += consumed
+        digest = self.digest.copy() if incremental else hashlib.sha256()
+        digest.update(data[:consumed])
+        self.digest = digest
+        self.offset = offset
+        self.users = users
+        self.logger.info("Database {} {}: {} users", self.path, "updated" if incremental else "loaded", len(users))
+
+    def _prefixDIGEST(self, inFile, size):
+        """
+        Get SHA-256 digest of first `size` bytes of file
+        """
+        digest = hashlib.sha256()
+        inFile.seek(0)
+        while size > 0:
+            data = inFile.read(min(READ_SIZE, size))
+            if not data: break
+            digest.update(data)
+            size -= len(data)
+        return digest.digest()
@@ -0,0 +1,301 @@
+# eventloop.py
+# implements single-threaded event loop for serving many connections
+
+from Pr0j3ct.logging import Logger
+from Pr0j3ct.requests import RECV_SIZE
+
+import ssl
+import time
+import socket
+import selectors
+import collections
+
+
+"""
+This class holds the state of one client connection in the event loop.
+"""
+class _Connection:
+    def __init__(self, connSocket, connSocketAddress, processor):
+        self.connSocket = connSocket
+        self.connSocketAddress = connSocketAddress
+        self.processor = processor
+        self.registered = False
+        self.lastActive = time.monotonic()
+        self.handshakeStart = None # time TLS handshake started (`time.perf_counter`), None if not in handshake
+
+
+"""
+This class is a request of one connection, run by a scheduler worker.
+"""
+class _Job:
+    def __init__(self, eventLoop, conn, received=b""):
+        self.eventLoop = eventLoop
+        self.conn = conn
+        self.received = received
+        self.connSocketAddress = conn.connSocketAddress
+        self.queueWait = 0.0 # set by scheduler
+
+    def run(self):
+        self.conn.processor.queueWait = self.queueWait
+        self.eventLoop._process(self.conn, self.received)
+
+    def stop(self):
+        self.conn.processor.stop()
+
+
+"""
+This class multiplexes all client connections in one thread with non-blocking sockets.
+Reading and TLS handshakes are done in the loop without blocking, handshakes not finished within the timeout of `handshaker`
+are dropped, received data is fed to the request parser of the connection until a
+complete request is framed. Handling requests (disk reads, handlers, sending response) is offloaded to the worker threads
+of a `Scheduler`. A connection is not watched by the loop while its requests are being handled, so requests of one
+connection are handled in order. Connections idle for longer than their keep-alive timeout are closed.
+New connections beyond the limits of `admission` are refused, and once too many requests wait for a worker,
+new requests are answered with 503 instead of being queued.
+"""
+class EventLoop:
+    def __init__(self, serverSocket, createProcessor, scheduler, handshaker=None, admission=None):
+        """
+        `createProcessor(connSocket, connSocketAddress)` should return a `RequestProcessor` for a new connection\
+        `handshaker` is the `TLSHandshaker` of connections, or `None` for plain HTTP\
+        `admission` is the `AdmissionController` of new connections and waiting requests, or `None` for no limits
+        """
+        self.serverSocket = serverSocket
+        self.createProcessor = createProcessor
+        self.scheduler = scheduler
+        self.handshaker = handshaker
+        self.admission = admission
+        # max requests handed to scheduler at the same time, so that its queue never overflows
+        self.max_pending = scheduler.max_threads + scheduler.max_queue
+        self.selector = selectors.DefaultSelector()
+        self.connections = set()
+        self.pending = collections.deque() # requests waiting for a free worker
+        self.inflight = 0
+        self.completed = collections.deque() # connections finished by workers, appended by worker threads
+        self.wakeupReader, self.wakeupWriter = socket.socketpair()
+        self.wakeupReader.setblocking(False)
+        self.wakeupWriter.setblocking(False)
+        self.running = False
+        self.logger = Logger(self.__class__.__name__)
+
+    def run(self):
+        """
+        Run event loop until `stop` is called
+        """
+        self.serverSocket.setblocking(False)
+        self.selector.register(self.serverSocket, selectors.EVENT_READ, (self._accept, None))
+        self.selector.register(self.wakeupReader, selectors.EVENT_READ, (self._wakeup, None))
+        self.running = True
+        self.logger.info("Event loop started")
+        lastSweep = time.monotonic()
+        while self.running:
+            for key, mask in self.selector.select(timeout=1):
+                callback, conn = key.data
+                callback(conn)
+            if time.monotonic() - lastSweep >= 1:
+                lastSweep = time.monotonic()
+                self._sweep()
+
+    def stop(self):
+        """
+        Stop event loop and close all connections
+        """
+        self.running = False
+        for conn in list(self.connections):
+            self._close(conn)
+        self.selector.close()
+        self.wakeupReader.close()
+        self.wakeupWriter.close()
+        self.logger.info("Event loop stopped")
+        self.logger.close()
+
+    def _register(self, conn, events, callback):
+        """
+        Watch connection socket for events
+        """
+        if conn.registered:
+            self.selector.modify(conn.connSocket, events, (callback, conn))
+        else:
+            self.selector.register(conn.connSocket, events, (callback, conn))
+            conn.registered = True
+
+    def _unregister(self, conn):
+        """
+        Stop watching connection socket
+        """
+        if conn.registered:
+            self.selector.unregister(conn.connSocket)
+            conn.registered = False
+
+    def _close(self, conn):
+        """
+        Close connection
+        """
+        self._unregister(conn)
+        self.connections.discard(conn)
+        conn.processor.stop()
+
+    def _sweep(self):
+        """
+        Close connections waiting for data past one of their deadlines (see `RequestProcessor.expired`), and unfinished TLS handshakes
+        """
+        for conn in list(self.connections):
+            if conn.handshakeStart is not None:
+                if time.perf_counter() - conn.handshakeStart > self.handshaker.timeout:
+                    self.handshaker.failed(conn.connSocketAddress, conn.handshakeStart, "timeout")
+                    self._close(conn)
+                continue
+            if not conn.registered: continue
+            reason = conn.processor.expired()
+            if reason:
+                conn.processor.expire(reason)
+                self._close(conn)
+
+    def _accept(self, _):
+        """
+        Accept all waiting connections
+        """
+        while True:
+            try:
+                clientsocket, clientaddress = self.serverSocket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except socket.error as e:
+                self.logger.error(e)
+                return
+            clientaddress = "{}:{}".format(clientaddress[0], clientaddress[1])
+            # waiting requests are checked when received, as idle connections cost no worker
+            reason = self.admission.admit(clientaddress) if self.admission else None
+            if reason:
+                self.admission.shed(clientsocket, clientaddress, reason)
+                continue
+            try:
+                if self.handshaker:
+                    clientsocket = self.handshaker.wrap(clientsocket)
+                processor = self.createProcessor(clientsocket, clientaddress)
+            except (ssl.SSLError, socket.error) as e:
+                self.logger.error(e)
+                clientsocket.close()
+                if self.admission: self.admission.release(clientaddress)
+                continue
+            clientsocket.setblocking(False)
+            conn = _Connection(clientsocket, clientaddress, processor)
+            self.connections.add(conn)
+            self.logger.info("Client connected: {}", clientaddress)
+            if self.handshaker:
+                conn.handshakeStart = time.perf_counter()
+                self._handshake(conn)
+            else:
+                self._register(conn, selectors.EVENT_READ, self._read)
+
+    def _handshake(self, conn):
+        """
+        Continue non-blocking TLS handshake
+        """
+        try:
+            conn.connSocket.do_handshake()
+        except ssl.SSLWantReadError:
+            self._register(conn, selectors.EVENT_READ, self._handshake)
+            return
+        except ssl.SSLWantWriteError:
+            self._register(conn, selectors.EVENT_WRITE, self._handshake)
+            return
+        except (ssl.SSLError, socket.error) as e:
+            # ignore HTTP request error in HTTPS mode
+            self.handshaker.failed(conn.connSocketAddress, conn.handshakeStart, "failed", e)
+            self._close(conn)
+            return
+        self.handshaker.done(conn.connSocket, conn.connSocketAddress, conn.handshakeStart)
+        conn.handshakeStart = None
+        conn.lastActive = conn.processor.lastActive = time.monotonic()
+        self._register(conn, selectors.EVENT_READ, self._read)
+
+    def _read(self, conn):
+        """
+        Read data from connection, hand connection to a worker once a complete request is received
+        """
+        conn.lastActive = time.monotonic()
+        try:
+            received = conn.connSocket.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return
+        except socket.error as e:
+            self.logger.error(e)
+            self._close(conn)
+            return
+        # if connection is closed by client, close it
+        if not received:
+            self._close(conn)
+            return
+        if not conn.processor.feed(received):
+            # wait for rest of request
+            return
+        self._unregister(conn)
+        if self.admission and self.admission.overloaded(len(self.pending)):
+            self._shed(conn)
+        elif self.inflight >= self.max_pending:
+            self.pending.append(conn)
+        else:
+            self._dispatch(conn)
+
+    def _dispatch(self, conn):
+        """
+        Submit connection with received requests to scheduler
+        """
+        self.inflight += 1
+        if not self.scheduler.add(_Job(self, conn)):
+            self.inflight -= 1
+            self._shed(conn)
+
+    def _shed(self, conn):
+        """
+        Answer request of connection with 503 and close connection
+        """
+        self.connections.discard(conn)
+        if self.admission:
+            self.admission.shed(conn.connSocket, conn.connSocketAddress, "queue")
+        conn.processor.stop()
+
+    def _process(self, conn, received):
+        """
+        Handle request in worker thread, then give connection back to loop
+        """
+        try:
+            conn.connSocket.settimeout(None)
+            conn.processor.process(received)
+        except Exception as e:
+            self.logger.error("Failed to process request from {}: {}", conn.connSocketAddress, e)
+            conn.processor.keep_alive = False
+        self.completed.append(conn)
+        try:
+            self.wakeupWriter.send(b"\0")
+        except (BlockingIOError, socket.error):
+            pass # loop is already woken up or stopped
+
+    def _wakeup(self, _):
+        """
+        Resume connections finished by workers
+        """
+        try:
+            while self.wakeupReader.recv(4096): pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self.completed:
+            conn = self.completed.popleft()
+            self.inflight -= 1
+            if conn not in self.connections: continue
+            if not conn.processor.keep_alive:
+                self._close(conn)
+                continue
+            conn.lastActive = time.monotonic()
+            try:
+                conn.connSocket.setblocking(False)
+            except socket.error:
+                self._close(conn)
+                continue
+            self._register(conn, selectors.EVENT_READ, self._read)
+            # TLS may already hold decrypted data which will not wake up selector
+            if self.handshaker and conn.connSocket.pending():
+                self._read(conn)
+        while self.pending and self.inflight < self.max_pending:
+            self._dispatch(self.pending.popleft())
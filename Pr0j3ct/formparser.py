@@ -0,0 +1,196 @@
+# formparser.py
+# implements streaming parser for urlencoded and multipart/form-data request bodies
+
+from Pr0j3ct.httpparser import HttpParseError
+
+import re
+import tempfile
+import urllib.parse
+
+# multipart boundary allowed by RFC 2046: 1 to 70 characters of this set, not ending with a space
+BOUNDARY_PATTERN = re.compile(r"[0-9A-Za-z'()+_,\-./:=? ]{0,69}[0-9A-Za-z'()+_,\-./:=?]")
+
+
+"""
+This class is an uploaded file of a multipart/form-data body, passed to handlers instead of its content.
+`file` is a file-like object positioned at the start of the content, kept in memory if small, on disk otherwise.
+"""
+class UploadedFile:
+    def __init__(self, name, filename, contentType, file):
+        self.name = name
+        self.filename = filename
+        self.contentType = contentType
+        self.file = file
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def close(self):
+        self.file.close()
+
+    def __str__(self):
+        return self.filename
+
+
+"""
+This class parses a form body from a stream, reading it in chunks so that memory use does not depend on body size.
+Field values are returned as strings and file parts as `UploadedFile` objects, in a dictionary of name -> list of values
+like `urllib.parse.parse_qs`.
+"""
+class FormParser:
+    def __init__(self, spoolSize=1024*1024, maxFieldSize=1024*1024, chunkSize=64*1024):
+        self.spoolSize = spoolSize # file parts larger than this are moved to disk
+        self.maxFieldSize = maxFieldSize # max size of a field which is not a file
+        self.chunkSize = chunkSize
+
+    def parse(self, headers, body):
+        """
+        Parse form body according to its Content-Type\\
+        Return dictionary of name -> list of values, empty if body is not a form\\
+        Raise `HttpParseError` if body is malformed
+        """
+        if body is None: return {}
+        contentType, params = self._parseHEADERVALUE(headers.get("content-type", "application/x-www-form-urlencoded"))
+        if contentType == "application/x-www-form-urlencoded":
+            return self._parseURLENCODED(body)
+        if contentType == "multipart/form-data":
+            if not BOUNDARY_PATTERN.fullmatch(params.get("boundary", "")):
+                raise HttpParseError(400, "Bad Request")
+            return self._parseMULTIPART(body, params["boundary"].encode("latin-1"))
+        return {}
+
+    def _parseHEADERVALUE(self, value):
+        """
+        Split header value into lower case main value and dictionary of parameters
+        """
+        parts = value.split(";")
+        params = {}
+        for part in parts[1:]:
+            name, sep, paramValue = part.partition("=")
+            if not sep: continue
+            paramValue = paramValue.strip()
+            if len(paramValue) >= 2 and paramValue[0] == paramValue[-1] == "\"":
+                paramValue = paramValue[1:-1]
+            params[name.strip().lower()] = paramValue
+        return parts[0].strip().lower(), params
+
+    def _addPAIRS(self, result, data):
+        """
+        Decode complete `name=value&...` pairs and add them to result
+        """
+        for name, value in urllib.parse.parse_qsl(data.decode("utf-8", errors="replace"), keep_blank_values=True):
+            result.setdefault(name, []).append(value)
+
+    def _parseURLENCODED(self, body):
+        """
+        Parse urlencoded body chunk by chunk, only the last incomplete pair is kept in memory
+        """
+        result = {}
+        rest = b""
+        while True:
+            chunk = body.read(self.chunkSize)
+            if not chunk: break
+            data = rest + chunk
+            end = data.rfind(b"&")
+            if end < 0:
+                rest = data
+            else:
+                self._addPAIRS(result, data[:end])
+                rest = data[end + 1:]
+            if len(rest) > self.maxFieldSize:
+                raise HttpParseError(413, "Payload Too Large")
+        self._addPAIRS(result, rest)
+        return result
+
+    def _parseMULTIPART(self, body, boundary):
+        """
+        Parse multipart/form-data body chunk by chunk, file parts are written to spooled temporary files
+        """
+        result = {}
+        delimiter = b"\r\n--" + boundary
+        # first delimiter has no line break before it
+        buffer = bytearray(b"\r\n")
+        eof = False
+
+        def fill():
+            chunk = body.read(self.chunkSize)
+            buffer.extend(chunk)
+            return bool(chunk)
+
+        # skip preamble until first delimiter
+        while True:
+            index = buffer.find(delimiter)
+            if index >= 0:
+                del buffer[:index + len(delimiter)]
+                break
+            del buffer[:max(0, len(buffer) - len(delimiter))]
+            if not fill(): raise HttpParseError(400, "Bad Request")
+        try:
+            while True:
+                # after delimiter: "--" ends body, line break starts a part
+                while len(buffer) < 2 and not eof:
+                    eof = not fill()
+                if buffer[:2] == b"--": return result
+                if buffer[:2] != b"\r\n": raise HttpParseError(400, "Bad Request")
+                del buffer[:2]
+                # part header fields
+                while True:
+                    index = buffer.find(b"\r\n\r\n")
+                    if index >= 0: break
+                    if len(buffer) > 16 * 1024 or eof: raise HttpParseError(400, "Bad Request")
+                    eof = not fill()
+                partHeaders = {}
+                for line in buffer[:index].decode("utf-8", errors="replace").split("\r\n"):
+                    name, sep, value = line.partition(":")
+                    if sep: partHeaders[name.strip().lower()] = value.strip()
+                del buffer[:index + 4]
+                _, disposition = self._parseHEADERVALUE(partHeaders.get("content-disposition", ""))
+                name = disposition.get("name", "")
+                filename = disposition.get("filename")
+                if filename is None:
+                    output = tempfile.SpooledTemporaryFile(max_size=self.maxFieldSize + 1)
+                else:
+                    output = tempfile.SpooledTemporaryFile(max_size=self.spoolSize)
+                size = 0
+                # part content until next delimiter
+                while True:
+                    index = buffer.find(delimiter)
+                    if index >= 0:
+                        output.write(buffer[:index])
+                        size += index
+                        del buffer[:index + len(delimiter)]
+                        break
+                    # keep a possible partial delimiter at the end
+                    keep = len(delimiter) - 1
+                    if len(buffer) > keep:
+                        output.write(buffer[:len(buffer) - keep])
+                        size += len(buffer) - keep
+                        del buffer[:len(buffer) - keep]
+                    if filename is None and size > self.maxFieldSize:
+                        output.close()
+                        raise HttpParseError(413, "Payload Too Large")
+                    if eof:
+                        output.close()
+                        raise HttpParseError(400, "Bad Request")
+                    eof = not fill()
+                output.seek(0)
+                if filename is None:
+                    if size > self.maxFieldSize:
+                        output.close()
+                        raise HttpParseError(413, "Payload Too Large")
+                    result.setdefault(name, []).append(output.read().decode("utf-8", errors="replace"))
+                    output.close()
+                else:
+                    uploaded = UploadedFile(name, filename, partHeaders.get("content-type", "application/octet-stream"), output)
+                    result.setdefault(name, []).append(uploaded)
+        except HttpParseError:
+            self.close(result)
+            raise
+
+    def close(self, params):
+        """
+        Close all uploaded files in parsed parameters
+        """
+        for values in params.values():
+            for value in values:
+                if isinstance(value, UploadedFile): value.close()
@@ -0,0 +1,144 @@
+# handlerloader.py
+# implements in-process loader for web page handler scripts
+
+import io
+import os
+import re
+import sys
+import threading
+import importlib.util
+
+
+"""
+This class is passed to handler scripts, describing where the handler is called from.
+"""
+class HandlerContext:
+    def __init__(self, rootDirectory, scriptPath, request=None, credentials=None):
+        self.rootDirectory = rootDirectory
+        self.scriptPath = scriptPath
+        self.scriptDirectory = os.path.dirname(scriptPath)
+        self.request = request # HttpRequest being handled, or None
+        self.headers = request.headers if request is not None else {}
+        self.body = request.body if request is not None else None # file-like request body, or None
+        self.credentials = credentials # CredentialStore of users database, or None
+
+
+"""
+This class redirects `print` output of the current thread into a buffer, other threads still print to terminal.
+"""
+class _ThreadLocalStdout:
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, message):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is not None:
+            return buffer.write(message)
+        return self.stream.write(message)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+"""
+This class loads handler scripts once as Python modules and calls them in-process.
+
+A handler script defines:
+
+    def handle(params, context):
+        return header, body
+
+where `params` is the dictionary of parsed parameters (name -> list of values, uploaded files are `UploadedFile`
+objects with a file-like `file`), `context` is a `HandlerContext` (with request headers, file-like raw body and users credentials),
+`header` is the HTTP status line and header fields, and `body` is the response body, both as bytes (or String).
+Return `None` if parameters are not handled.
+
+Scripts without a `handle` function are treated as command line scripts: they are executed in-process as `__main__`
+with parameters passed in `sys.argv` (`--name value ...`), and their printed output is parsed as header and body.
+"""
+class HandlerLoader:
+    def __init__(self, rootDirectory):
+        self.rootDirectory = rootDirectory
+        self.handlers = {} # script path -> (mtime, module or code object)
+        self.mutex = threading.Lock() # lock for loading scripts
+        self.scriptMutex = threading.Lock() # lock for command line scripts, since sys.argv is shared
+        self.stdout = None
+
+    def call(self, scriptPath, params, request=None, credentials=None):
+        """
+        Call handler script with given parameters\\
+        Return `(header, body)` in bytes\\
+        Return `None` if not handled
+        """
+        handler = self._load(scriptPath)
+        context = HandlerContext(self.rootDirectory, scriptPath, request, credentials)
+        if callable(getattr(handler, "handle", None)):
+            result = handler.handle(params, context)
+        else:
+            result = self._callScript(handler, context, params)
+        if not result: return None
+        header, body = result
+        if isinstance(header, str): header = header.encode("utf-8")
+        if isinstance(body, str): body = body.encode("utf-8")
+        # make sure header ends with exactly one empty line
+        header = header.rstrip(b"\r\n") + b"\r\n\r\n"
+        return header, (body or b"")
+
+    def _load(self, scriptPath):
+        """
+        Load handler script, reload it if file is modified since last load
+        """
+        mtime = os.stat(scriptPath).st_mtime_ns
+        cached = self.handlers.get(scriptPath)
+        if cached and cached[0] == mtime: return cached[1]
+        with self.mutex:
+            cached = self.handlers.get(scriptPath)
+            if cached and cached[0] == mtime: return cached[1]
+            moduleName = "Pr0j3ct_handler_" + re.sub(r"\W", "_", os.path.relpath(scriptPath, self.rootDirectory))
+            spec = importlib.util.spec_from_file_location(moduleName, scriptPath)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            if callable(getattr(module, "handle", None)):
+                handler = module
+            else:
+                # command line script, compile it to run as __main__
+                with open(scriptPath, "rb") as inFile:
+                    handler = compile(inFile.read(), scriptPath, "exec")
+            self.handlers[scriptPath] = (mtime, handler)
+            return handler
+
+    def _callScript(self, code, context, params):
+        """
+        Run command line script as __main__, and split printed output into header and body
+        """
+        argv = [context.scriptPath]
+        for key, values in params.items():
+            argv.append("--{}".format(key))
+            # uploaded files are passed by their filename
+            argv.extend(str(x) for x in values)
+        buffer = io.StringIO()
+        with self.scriptMutex:
+            if self.stdout is None:
+                self.stdout = _ThreadLocalStdout(sys.stdout)
+                sys.stdout = self.stdout
+            savedArgv = sys.argv
+            sys.argv = argv
+            self.stdout.local.buffer = buffer
+            try:
+                exec(code, {"__name__": "__main__", "__file__": context.scriptPath, "__builtins__": __builtins__})
+            except SystemExit:
+                pass
+            finally:
+                self.stdout.local.buffer = None
+                sys.argv = savedArgv
+        output = buffer.getvalue()
+        if not output: return None
+        # header ends at the first empty line
+        parts = re.split(r"\r?\n\r?\n", output, maxsplit=1)
+        header = parts[0]
+        body = parts[1] if len(parts) > 1 else ""
+        # remove the line break printed after body
+        if body.endswith("\n"): body = body[:-1]
+        if body.endswith("\r"): body = body[:-1]
+        return header, body
@@ -0,0 +1,280 @@
+# httpparser.py
+# implements incremental HTTP/1.1 request parser
+
+import tempfile
+import collections
+import urllib.parse
+
+
+"""
+This exception is raised for a malformed or unsupported request, `code` and `message` are the HTTP error to send back.
+The connection cannot be used after it, since the end of the bad request is unknown.
+"""
+class HttpParseError(Exception):
+    def __init__(self, code, message):
+        super().__init__("{} {}".format(code, message))
+        self.code = code
+        self.message = message
+
+
+"""
+This class is one parsed HTTP request. The request line is parsed once here, handlers use its fields directly.
+"""
+class HttpRequest:
+    def __init__(self, method, target, version, headers):
+        self.method = method # upper case method name
+        self.target = target # raw request target
+        self.version = version # "HTTP/1.1" or "HTTP/1.0"
+        self.headers = headers # header fields with lower case names
+        self.body = None # file-like object of request body, `None` if request has no body
+        targetParsed = urllib.parse.urlparse(target)
+        self.path = urllib.parse.unquote(targetParsed.path) # decoded path
+        self.query = targetParsed.query
+        self.params = urllib.parse.parse_qs(targetParsed.query) # query parameters, name -> list of values
+
+    @property
+    def keepAlive(self):
+        """
+        Check if client wants to keep connection open after this request
+        """
+        connection = {x.strip().lower() for x in self.headers.get("connection", "").split(",")}
+        if "close" in connection: return False
+        if self.version == "HTTP/1.0": return "keep-alive" in connection
+        return True
+
+    def close(self):
+        """
+        Release request body
+        """
+        if self.body is not None:
+            self.body.close()
+
+
+"""
+This class frames HTTP requests from a stream of received bytes.
+Data is fed as it arrives, complete requests are framed by the empty line after header fields and by
+Content-Length or chunked Transfer-Encoding of the body, so several pipelined requests in one segment
+and requests split over many segments are both handled, in order.
+Bodies are written out as they arrive to a spooled temporary file, kept in memory up to `spoolSize` bytes and moved
+to disk above it, so memory use stays flat for large uploads.
+"""
+class HttpParser:
+    def __init__(self, maxHeaderSize=64*1024, maxBodySize=4*1024*1024*1024, spoolSize=1024*1024):
+        self.maxHeaderSize = maxHeaderSize
+        self.maxBodySize = maxBodySize
+        self.spoolSize = spoolSize
+        self.buffer = bytearray()
+        self.requests = collections.deque() # complete requests, not yet taken by `next`
+        self.error = None
+        self.current = None # request whose header is parsed, waiting for body
+        self.bodyLength = None # remaining bytes of body, or None for chunked body
+        self.bodySize = 0 # received bytes of chunked body
+        self.chunkLength = None # remaining bytes of current chunk, or None when waiting for chunk size line
+        self.chunkEnd = False # waiting for line break after chunk data
+        self.trailer = False # waiting for trailer fields after the last chunk
+        self.expectContinue = False # client waits for "100 Continue" before sending body
+
+    def feed(self, data):
+        """
+        Add received bytes and parse as many complete requests as possible
+        """
+        if self.error: return
+        self.buffer += data
+        try:
+            while self._parse(): pass
+        except HttpParseError as e:
+            self.error = e
+            self.buffer.clear()
+            if self.current is not None:
+                self.current.close()
+                self.current = None
+
+    def ready(self):
+        """
+        Check if a complete request (or an error) is waiting to be taken
+        """
+        return bool(self.requests) or self.error is not None
+
+    def next(self):
+        """
+        Take next complete request\\
+        Return `None` if no complete request is received yet\\
+        Raise `HttpParseError` after all complete requests before a bad one are taken
+        """
+        if self.requests: return self.requests.popleft()
+        if self.error: raise self.error
+        return None
+
+    def close(self):
+        """
+        Release bodies of requests not taken yet
+        """
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        while self.requests:
+            self.requests.popleft().close()
+
+    def pending(self):
+        """
+        Check if a request is partially received
+        """
+        return self.current is not None or bool(self.buffer.strip(b"\r\n"))
+
+    def _parse(self):
+        """
+        Parse one step, return `True` if progress is made
+        """
+        if self.current is None:
+            return self._parseHEADER()
+        if self.bodyLength is not None:
+            return self._parseBODY()
+        return self._parseCHUNK()
+
+    def _parseHEADER(self):
+        """
+        Parse request line and header fields
+        """
+        # ignore empty lines before request line
+        start = 0
+        while self.buffer.startswith(b"\r\n", start) or self.buffer.startswith(b"\n", start):
+            start += 2 if self.buffer.startswith(b"\r\n", start) else 1
+        if start: del self.buffer[:start]
+        end = self.buffer.find(b"\r\n\r\n")
+        if end < 0:
+            if len(self.buffer) > self.maxHeaderSize:
+                raise HttpParseError(431, "Request Header Fields Too Large")
+            return False
+        if end > self.maxHeaderSize:
+            raise HttpParseError(431, "Request Header Fields Too Large")
+        try:
+            lines = self.buffer[:end].decode("utf-8").split("\r\n")
+        except UnicodeDecodeError:
+            raise HttpParseError(400, "Bad Request")
+        del self.buffer[:end + 4]
+        parts = lines[0].split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise HttpParseError(400, "Bad Request")
+        method, target, version = parts
+        if version not in ("HTTP/1.0", "HTTP/1.1"):
+            raise HttpParseError(505, "HTTP Version Not Supported")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            # no white space is allowed around field name
+            if not sep or not name or name != name.strip():
+                raise HttpParseError(400, "Bad Request")
+            name = name.lower()
+            value = value.strip()
+            if name in headers:
+                if name == "content-length" and headers[name] != value:
+                    raise HttpParseError(400, "Bad Request")
+                if name != "content-length":
+                    headers[name] += ", " + value
+            else:
+                headers[name] = value
+        self.current = HttpRequest(method.upper(), target, version, headers)
+        self.expectContinue = headers.get("expect", "").lower() == "100-continue"
+        if "transfer-encoding" in headers:
+            if headers["transfer-encoding"].lower() != "chunked":
+                raise HttpParseError(501, "Not Implemented")
+            self.bodyLength = None
+            self.bodySize = 0
+            self.chunkLength = None
+            self.chunkEnd = False
+            self.trailer = False
+            self.current.body = tempfile.SpooledTemporaryFile(max_size=self.spoolSize)
+            return True
+        length = headers.get("content-length", "0")
+        if not length.isdigit():
+            raise HttpParseError(400, "Bad Request")
+        self.bodyLength = int(length)
+        if self.bodyLength > self.maxBodySize:
+            raise HttpParseError(413, "Payload Too Large")
+        if self.bodyLength > 0:
+            self.current.body = tempfile.SpooledTemporaryFile(max_size=self.spoolSize)
+        return True
+
+    def _write(self, size):
+        """
+        Move `size` bytes from buffer to request body
+        """
+        with memoryview(self.buffer) as view:
+            self.current.body.write(view[:size])
+        del self.buffer[:size]
+
+    def _parseBODY(self):
+        """
+        Parse body with known length, as much as received
+        """
+        if self.bodyLength > 0:
+            size = min(len(self.buffer), self.bodyLength)
+            if size == 0: return False
+            self._write(size)
+            self.bodyLength -= size
+            if self.bodyLength > 0: return False
+        if self.current.body is not None:
+            self.current.body.seek(0)
+        self._complete()
+        return True
+
+    def _parseCHUNK(self):
+        """
+        Parse one chunk size line, chunk data or trailer line of chunked body
+        """
+        if self.trailer:
+            end = self.buffer.find(b"\r\n")
+            if end < 0: return False
+            del self.buffer[:end + 2]
+            # trailer fields end with an empty line
+            if end == 0:
+                self.current.body.seek(0)
+                self._complete()
+            return True
+        if self.chunkEnd:
+            if len(self.buffer) < 2: return False
+            if self.buffer[:2] != b"\r\n":
+                raise HttpParseError(400, "Bad Request")
+            del self.buffer[:2]
+            self.chunkEnd = False
+            return True
+        if self.chunkLength is None:
+            end = self.buffer.find(b"\r\n")
+            if end < 0:
+                if len(self.buffer) > 1024: raise HttpParseError(400, "Bad Request")
+                return False
+            # ignore chunk extensions
+            size = bytes(self.buffer[:end]).split(b";")[0].strip()
+            try:
+                self.chunkLength = int(size, 16)
+            except ValueError:
+                raise HttpParseError(400, "Bad Request")
+            del self.buffer[:end + 2]
+            if self.chunkLength == 0:
+                self.chunkLength = None
+                self.trailer = True
+            elif self.bodySize + self.chunkLength > self.maxBodySize:
+                raise HttpParseError(413, "Payload Too Large")
+            return True
+        size = min(len(self.buffer), self.chunkLength)
+        if size == 0: return False
+        self._write(size)
+        self.bodySize += size
+        self.chunkLength -= size
+        if self.chunkLength == 0:
+            self.chunkLength = None
+            self.chunkEnd = True
+        return True
+
+    def _complete(self):
+        """
+        Move parsed request to complete requests
+        """
+        self.requests.append(self.current)
+        self.current = None
+        self.bodyLength = None
+        self.bodySize = 0
+        self.chunkLength = None
+        self.chunkEnd = False
+        self.trailer = False
+        self.expectContinue = False
@@ -1,69 +1,305 @@
 # logging.py
-# implements Server Logger class
+# implements Server Logger class and the shared asynchronous log backend
 import os
-from datetime import datetime
+import sys
+import gzip
+import time
+import queue
+import atexit
+import shutil
+import threading
+
+
+# log levels, messages below the configured level are dropped before being formatted
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40}
+
+# max size of a datagram of lines forwarded to supervisor process
+FORWARD_DATAGRAM_SIZE = 32 * 1024
+
+# level names colored for terminal
+_COLORED = {
+    "DEBUG": "DEBUG",
+    "INFO": "\033[38;5;46mINFO\033[0m", # green INFO
+    "WARN": "\033[38;5;226m\033[1mWARN\033[0m", # yellow and underscore WARN
+    "ERROR": "\033[38;5;196m\033[5mERROR\033[0m", # red and blinking ERROR
+}
 
 
 """
-This class provide functions to print logging information in terminal and save messages in local log files.
+This class is the process-wide log pipeline shared by all loggers.
+Records are put on a queue without locking and written by one background thread in batches,
+to a single log file which is rotated by size and/or time, rotated files are optionally compressed.
+In a worker process, formatted lines are forwarded to the supervisor process by a datagram socket instead,
+so that all processes share one log file written by one writer.
 """
-class Logger:
-    def __init__(self, caller):
-        self.caller = caller.replace(".", "_").replace(":", "__")
-        self.cache = []
-        self.maxCacheSize = 100
-        self.defaultFolder = ".log_entry"
-        if not os.path.exists(self.defaultFolder):
-            os.makedirs(self.defaultFolder)
+class LogBackend:
+    def __init__(self):
+        self.level = LEVELS["INFO"]
+        self.console = True # echo messages to terminal
+        self.directory = ".log_entry"
+        self.filename = "server.log"
+        self.maxBytes = 10 * 1024 * 1024 # rotate when log file exceeds this size, 0 to disable
+        self.rotateInterval = 0 # rotate after this many seconds, 0 to disable
+        self.backupCount = 5 # number of rotated files kept
+        self.compress = True # compress rotated files with gzip
+        self.name = "" # name of process prefixed to caller, empty in single process mode
+        self.forward = None # socket to send lines to supervisor process instead of writing them
+        self.reset()
         # if on Windows, enable color mode in terminal
         if (os.name == "nt"): os.system("COLOR")
 
-    def info(self, message):
+    def reset(self):
         """
-        Log information level message
+        Drop queue and writer thread state, called in a forked process where the writer thread does not exist
         """
-        logMessage = "[{} {} {}] {}".format("INFO", datetime.now().strftime("%d/%m/%Y %H:%M:%S"), self.caller, message)
-        print(logMessage.replace("INFO", "\033[38;5;46mINFO\033[0m", 1)) # print green INFO
-        self.cache.append(logMessage)
-        self._update()
+        self.queue = queue.SimpleQueue()
+        self.mutex = threading.Lock() # lock for starting and stopping writer thread
+        self.writer = None
+        self.logFile = None
+        self.nextRollover = None
+        self.lastSecond = None
+        self.lastTimestamp = ""
 
-    def warn(self, message):
+    def configure(self, level=None, console=None, directory=None, maxBytes=None, rotateInterval=None, backupCount=None, compress=None,
+                  name=None, forward=None):
         """
-        Log warning level message
+        Change log settings, should be called before logging starts
         """
-        warnMessage = "[{} {} {}] {}".format("WARN", datetime.now().strftime("%d/%m/%Y %H:%M:%S"), self.caller, message)
-        print(warnMessage.replace("WARN", "\033[38;5;226m\033[1mWARN\033[0m", 1)) # print yellow and underscore WARN
-        self.cache.append(warnMessage)
-        self._update()
+        if level is not None:
+            if level.upper() not in LEVELS:
+                raise ValueError("level: {} should be one of {}".format(level, ", ".join(LEVELS)))
+            self.level = LEVELS[level.upper()]
+        if console is not None: self.console = console
+        if directory is not None: self.directory = directory
+        if maxBytes is not None: self.maxBytes = maxBytes
+        if rotateInterval is not None: self.rotateInterval = rotateInterval
+        if backupCount is not None: self.backupCount = backupCount
+        if compress is not None: self.compress = compress
+        if name is not None: self.name = name
+        if forward is not None: self.forward = forward
 
-    def error(self, message):
+    def enabled(self, level):
         """
-        Log error level message
+        Check if messages of level are logged
         """
-        errorMessage = "[{} {} {}] {}".format("ERROR", datetime.now().strftime("%d/%m/%Y %H:%M:%S"), self.caller, message)
-        print(errorMessage.replace("ERROR", "\033[38;5;196m\033[5mERROR\033[0m", 1)) # print red and blinking ERROR
-        self.cache.append(errorMessage)
-        self._update()
+        return LEVELS[level] >= self.level
 
-    def close(self):
+    def put(self, level, caller, message, args):
+        """
+        Queue a record, message is formatted with args by the writer thread
+        """
+        if self.writer is None: self._start()
+        self.queue.put((time.time(), level, caller, message, args))
+
+    def putLINES(self, data):
+        """
+        Queue already formatted lines, forwarded by a worker process
+        """
+        if self.writer is None: self._start()
+        self.queue.put(data)
+
+    def flush(self):
+        """
+        Wait until all queued records are written
+        """
+        if self.writer is None: return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(5)
+
+    def shutdown(self):
+        """
+        Write all queued records and stop writer thread
+        """
+        with self.mutex:
+            if self.writer is None: return
+            self.queue.put(None)
+            self.writer.join(5)
+            self.writer = None
+
+    def _start(self):
+        """
+        Start writer thread on first record
+        """
+        with self.mutex:
+            if self.writer is not None: return
+            self.writer = threading.Thread(target=self._write, name="LogWriter", daemon=True)
+            self.writer.start()
+
+    def _write(self):
+        """
+        Writer thread loop, write queued records in batches until a `None` is received
+        """
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            # take everything already queued
+            while len(batch) < 1024:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            consoleLines = []
+            events = []
+            for record in batch:
+                if record is None:
+                    running = False
+                    continue
+                if isinstance(record, threading.Event):
+                    events.append(record)
+                    continue
+                if isinstance(record, str):
+                    lines.append(record)
+                    if self.console: consoleLines.append(self._colorLINES(record))
+                    continue
+                line, consoleLine = self._format(record)
+                lines.append(line)
+                if consoleLine is not None: consoleLines.append(consoleLine)
+            if lines and self.forward is not None:
+                self._forwardLINES(lines)
+            elif lines:
+                try:
+                    self._writeFILE("".join(lines))
+                except OSError as e:
+                    sys.__stderr__.write("Failed to write log: {}\n".format(e))
+            if consoleLines:
+                try:
+                    sys.stdout.write("".join(consoleLines))
+                    sys.stdout.flush()
+                except (OSError, ValueError):
+                    pass
+            for event in events:
+                event.set()
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+
+    def _format(self, record):
+        """
+        Format one record into file line and terminal line
+        """
+        timestamp, level, caller, message, args = record
+        second = int(timestamp)
+        if second != self.lastSecond:
+            # timestamp only changes once per second
+            self.lastSecond = second
+            self.lastTimestamp = time.strftime("%d/%m/%Y %H:%M:%S", time.localtime(second))
+        if args:
+            try:
+                message = message.format(*args)
+            except (IndexError, KeyError, ValueError):
+                message = "{} {}".format(message, args)
+        if self.name: caller = "{}/{}".format(self.name, caller)
+        line = "[{} {} {}] {}\n".format(level, self.lastTimestamp, caller, message)
+        return line, line.replace(level, _COLORED[level], 1) if self.console and self.forward is None else None
+
+    def _colorLINES(self, data):
         """
-        Close logger by saving cached message to log file
+        Color level names of forwarded lines for terminal
         """
-        self._save()
+        lines = data.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            level = line[1:line.find(" ")]
+            if level in _COLORED: lines[i] = line.replace(level, _COLORED[level], 1)
+        return "".join(lines)
 
-    def _update(self):
+    def _forwardLINES(self, lines):
         """
-        Update cache, check cache if exceeds the default value, if yes save it to local space.
+        Send lines to supervisor process, in datagrams of whole lines
         """
-        if len(self.cache) > self.maxCacheSize:
-            self._save()
-            self.cache = []
+        chunk = []
+        size = 0
+        for line in lines + [None]:
+            data = line.encode("utf-8", errors="replace") if line is not None else b""
+            if chunk and (line is None or size + len(data) > FORWARD_DATAGRAM_SIZE):
+                try:
+                    self.forward.send(b"".join(chunk))
+                except OSError as e:
+                    sys.__stderr__.write("Failed to forward log: {}\n".format(e))
+                chunk = []
+                size = 0
+            if data:
+                chunk.append(data[:FORWARD_DATAGRAM_SIZE])
+                size += len(chunk[-1])
 
-    def _save(self):
+    def _writeFILE(self, data):
+        """
+        Append data to log file, rotate it if needed
+        """
+        if self.logFile is None:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            self.logFile = open(os.path.join(self.directory, self.filename), "a")
+            if self.rotateInterval: self.nextRollover = time.time() + self.rotateInterval
+        self.logFile.write(data)
+        self.logFile.flush()
+        if (self.maxBytes and self.logFile.tell() >= self.maxBytes) or (self.nextRollover and time.time() >= self.nextRollover):
+            self._rotate()
+
+    def _rotate(self):
+        """
+        Rotate log file: server.log -> server.log.1 -> server.log.2 ..., oldest one is removed
+        """
+        self.logFile.close()
+        self.logFile = None
+        path = os.path.join(self.directory, self.filename)
+        suffix = ".gz" if self.compress else ""
+        if self.backupCount <= 0:
+            os.remove(path)
+            return
+        for i in range(self.backupCount - 1, 0, -1):
+            source = "{}.{}{}".format(path, i, suffix)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}{}".format(path, i + 1, suffix))
+        if self.compress:
+            with open(path, "rb") as inFile, gzip.open(path + ".1.gz", "wb") as outFile:
+                shutil.copyfileobj(inFile, outFile)
+            os.remove(path)
+        else:
+            os.replace(path, path + ".1")
+
+
+# backend shared by all loggers of the process
+backend = LogBackend()
+atexit.register(backend.shutdown)
+
+
+"""
+This class provide functions to log messages of one component, messages are printed in terminal and saved in
+the shared log file by the background writer of `LogBackend`.
+Message arguments are formatted lazily: `logger.info("GET {}", path)` costs nothing if INFO messages are suppressed.
+"""
+class Logger:
+    def __init__(self, caller):
+        self.caller = caller.replace(".", "_").replace(":", "__")
+
+    def debug(self, message, *args):
+        """
+        Log debug level message
+        """
+        if LEVELS["DEBUG"] >= backend.level: backend.put("DEBUG", self.caller, message, args)
+
+    def info(self, message, *args):
+        """
+        Log information level message
+        """
+        if LEVELS["INFO"] >= backend.level: backend.put("INFO", self.caller, message, args)
+
+    def warn(self, message, *args):
+        """
+        Log warning level message
+        """
+        if LEVELS["WARN"] >= backend.level: backend.put("WARN", self.caller, message, args)
+
+    def error(self, message, *args):
+        """
+        Log error level message
+        """
+        if LEVELS["ERROR"] >= backend.level: backend.put("ERROR", self.caller, message, args)
+
+    def close(self):
         """
-        Save log message to local space
+        Close logger, messages are kept by the shared backend and written in the background
         """
-        if len(self.cache) <= 0: return
-        with open(os.path.join(self.defaultFolder, "{}.log".format(self.caller)), "a") as logFile:
-            for message in self.cache:
-                print(message, file=logFile)
\ No newline at end of file
+        pass
@@ -0,0 +1,378 @@
+# metrics.py
+# implements metrics registry with Prometheus text exposition
+
+from Pr0j3ct.logging import Logger
+
+import os
+import json
+import bisect
+import threading
+import http.server
+
+
+# default histogram buckets for durations in seconds
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    """
+    Escape label value for Prometheus text format
+    """
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    """
+    Format label set as `{name="value",...}`, empty string if there is no label
+    """
+    items = ["{}=\"{}\"".format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra: items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def _number(value):
+    """
+    Format sample value
+    """
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+"""
+This class keeps one value store per thread, so that updates never take a lock or race with other threads.
+Stores of all threads are summed up when metrics are collected.
+"""
+class _Shards:
+    def __init__(self, factory):
+        self.factory = factory
+        self.local = threading.local()
+        self.shards = []
+        self.mutex = threading.Lock() # lock for shard list, only taken once per thread
+
+    def get(self):
+        """
+        Get value store of current thread
+        """
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = self.factory()
+            with self.mutex:
+                self.shards.append(shard)
+            return shard
+
+    def all(self):
+        """
+        Get copies of value stores of all threads
+        """
+        with self.mutex:
+            shards = list(self.shards)
+        return [shard.copy() for shard in shards]
+
+
+"""
+This class is a monotonically increasing counter, optionally split by labels.
+"""
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.shards = _Shards(dict) # label values -> value
+
+    def inc(self, amount=1, labels=()):
+        """
+        Increase counter of given label values
+        """
+        shard = self.shards.get()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        """
+        Get current total of given label values
+        """
+        return sum(shard.get(labels, 0) for shard in self.shards.all())
+
+    def collect(self):
+        """
+        Get list of (suffix, label text, value) samples
+        """
+        totals = {}
+        for shard in self.shards.all():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return [("", _labels(self.labelNames, labels), value) for labels, value in sorted(totals.items())]
+
+
+"""
+This class counts observed values in fixed buckets, optionally split by labels.
+"""
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelNames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count of each bucket..., count above last bucket, sum]
+        self.shards = _Shards(dict)
+
+    def observe(self, value, labels=()):
+        """
+        Add an observed value of given label values
+        """
+        shard = self.shards.get()
+        entry = shard.get(labels)
+        if entry is None:
+            entry = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def collect(self):
+        """
+        Get list of (suffix, label text, value) samples, buckets are cumulative
+        """
+        totals = {}
+        for shard in self.shards.all():
+            for labels, entry in shard.items():
+                entry = list(entry)
+                total = totals.get(labels)
+                totals[labels] = entry if total is None else [x + y for x, y in zip(total, entry)]
+        samples = []
+        for labels, entry in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                samples.append(("_bucket", _labels(self.labelNames, labels, "le=\"{}\"".format(_number(float(bound)))), cumulative))
+            cumulative += entry[len(self.buckets)]
+            samples.append(("_bucket", _labels(self.labelNames, labels, "le=\"+Inf\""), cumulative))
+            samples.append(("_sum", _labels(self.labelNames, labels), entry[-1]))
+            samples.append(("_count", _labels(self.labelNames, labels), cumulative))
+        return samples
+
+
+"""
+This class reads a value from a function when metrics are collected, for values already kept by a component
+(queue depth, cache size...), so they cost nothing until scraped.
+`function` returns a number, or a dictionary of label values tuple -> number.
+"""
+class Gauge:
+    def __init__(self, name, help, function, labelNames=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.labelNames = tuple(labelNames)
+        self.kind = kind
+
+    def collect(self):
+        """
+        Get list of (suffix, label text, value) samples
+        """
+        value = self.function()
+        if isinstance(value, dict):
+            return [("", _labels(self.labelNames, labels), x) for labels, x in sorted(value.items())]
+        return [("", "", value)]
+
+
+"""
+This class holds all metrics of the server and renders them in Prometheus text format.
+Metrics are created once by name, asking again for the same name returns the existing metric.
+If `peers` is set, samples of other processes are added to the rendered metrics.
+"""
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {} # name -> metric
+        self.mutex = threading.Lock() # lock for creating metrics
+        self.peers = None # function returning snapshots of other processes, or None
+
+    def counter(self, name, help, labelNames=()):
+        """
+        Get or create counter
+        """
+        return self._register(name, lambda: Counter(name, help, labelNames))
+
+    def histogram(self, name, help, labelNames=(), buckets=DURATION_BUCKETS):
+        """
+        Get or create histogram
+        """
+        return self._register(name, lambda: Histogram(name, help, labelNames, buckets))
+
+    def gauge(self, name, help, function, labelNames=(), kind="gauge"):
+        """
+        Register a value read from `function` when collected, `kind` is "gauge" or "counter"
+        """
+        with self.mutex:
+            metric = self.metrics[name] = Gauge(name, help, function, labelNames, kind)
+        return metric
+
+    def snapshot(self):
+        """
+        Get list of (name, help, kind, samples) of all metrics
+        """
+        with self.mutex:
+            metrics = list(self.metrics.values())
+        snapshot = []
+        for metric in metrics:
+            try:
+                samples = metric.collect()
+            except Exception:
+                # a failing source should not break the whole page
+                continue
+            snapshot.append((metric.name, metric.help, metric.kind, samples))
+        return snapshot
+
+    def render(self):
+        """
+        Render all metrics in Prometheus text format, values of same metric and labels in peer processes are summed
+        """
+        snapshots = [self.snapshot()]
+        if self.peers is not None:
+            snapshots += self.peers()
+        merged = {} # name -> (help, kind, {(suffix, labels): value})
+        for snapshot in snapshots:
+            for name, help, kind, samples in snapshot:
+                entry = merged.get(name)
+                if entry is None:
+                    entry = merged[name] = (help, kind, {})
+                values = entry[2]
+                for suffix, labels, value in samples:
+                    values[(suffix, labels)] = values.get((suffix, labels), 0) + value
+        lines = []
+        for name, (help, kind, values) in merged.items():
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for (suffix, labels), value in values.items():
+                lines.append("{}{}{} {}".format(name, suffix, labels, _number(value)))
+        return "\n".join(lines) + "\n"
+
+    def _register(self, name, create):
+        """
+        Get metric by name, create it if not found
+        """
+        metric = self.metrics.get(name)
+        if metric is not None: return metric
+        with self.mutex:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = create()
+            return metric
+
+
+"""
+This class shares metrics of one process with the other processes of the server through snapshot files in a directory.
+Each process writes a snapshot of its registry every `interval` seconds, and its registry renders the sum of its own
+metrics and the latest snapshots of all other processes.
+"""
+class SharedMetrics:
+    def __init__(self, registry, directory, name, interval=1.0):
+        self.registry = registry
+        self.directory = directory
+        self.name = name
+        self.interval = interval
+        self.stopEvent = threading.Event()
+        self.thread = None
+        registry.peers = self.peers
+
+    def start(self):
+        """
+        Start writing snapshots in background thread
+        """
+        self._write()
+        self.thread = threading.Thread(target=self._run, name="SharedMetrics", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop writing snapshots, last snapshot is kept so that totals do not drop
+        """
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join(5)
+            self.thread = None
+        self._write()
+
+    def peers(self):
+        """
+        Get latest snapshots of all other processes
+        """
+        snapshots = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json") or filename == self.name + ".json": continue
+            try:
+                with open(os.path.join(self.directory, filename)) as inFile:
+                    snapshots.append(json.load(inFile))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def _run(self):
+        """
+        Thread loop, write snapshot every interval
+        """
+        while not self.stopEvent.wait(self.interval):
+            self._write()
+
+    def _write(self):
+        """
+        Write snapshot of registry, replacing previous one at once
+        """
+        path = os.path.join(self.directory, self.name + ".json")
+        try:
+            with open(path + ".tmp", "w") as outFile:
+                json.dump(self.registry.snapshot(), outFile)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+
+"""
+This class serves metrics on a separate port in its own thread, so scraping never uses a worker slot
+and is not affected by authentication rules. The port is bound to `host`, only local by default.
+"""
+class MetricsServer:
+    def __init__(self, registry, port, path="/metrics", host="127.0.0.1"):
+        self.registry = registry
+        self.port = port
+        self.path = path
+        self.host = host
+        self.httpServer = None
+        self.thread = None
+        self.logger = Logger(self.__class__.__name__)
+
+    def start(self):
+        """
+        Start serving metrics in background thread
+        """
+        registry, path = self.registry, self.path
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != path:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpServer = http.server.HTTPServer((self.host, self.port), Handler)
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, name="MetricsServer", daemon=True)
+        self.thread.start()
+        self.logger.info("Metrics served at http://{}:{}{}", self.host or "0.0.0.0", self.port, self.path)
+
+    def stop(self):
+        """
+        Stop serving metrics
+        """
+        if self.httpServer is None: return
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+        self.httpServer = None
@@ -2,84 +2,352 @@
 # implements HTTP Request Processer class
 
 from Pr0j3ct.logging import Logger
+from Pr0j3ct.statcache import StatCache
+from Pr0j3ct.httpparser import HttpParser, HttpParseError
+from Pr0j3ct.formparser import FormParser
+from Pr0j3ct.tracing import NO_PHASE
+from Pr0j3ct.responsewriter import ResponseWriter, buildHEADER, errorPAGE
 
 import os
+import ssl
+import stat
+import time
 import socket
-import threading
+import binascii
 import mimetypes
-import urllib.parse
-from email.utils import formatdate
+from email.utils import formatdate, parsedate_to_datetime
+
+# max number of ranges in one Range request, more ranges are ignored and whole file is sent
+MAX_RANGES = 16
+
+# max bytes read from socket at once
+RECV_SIZE = 64 * 1024
+
+# name of cookie holding session token of logged in user
+SESSION_COOKIE = "Pr0j3ctSession"
+
+# seconds of a request after which its minimum receive rate is enforced
+RATE_GRACE = 5
+
+# seconds an idle connection waits on its worker before checking again if workers are needed for other tasks
+IDLE_TICK = 0.1
+
+# methods counted separately in metrics, others are counted as "OTHER"
+METRIC_METHODS = ("GET", "HEAD", "POST", "PUT")
 
 """
 This class receives http requests from client , processes the request and send back any response.
 """
 
-class RequestProcessor(threading.Thread):
-    def __init__(self, rootDirectory, indexFile, connSocket, connSocketAddress, authHandler):
-        threading.Thread.__init__(self)
+class RequestProcessor:
+    def __init__(self, rootDirectory, indexFile, connSocket, connSocketAddress, authHandler, statCache=None, contentCache=None, compressor=None,
+                 keepAliveTimeout=15, maxRequests=100, maxBodySize=4*1024*1024*1024, metrics=None, metricsPath=None, tracer=None,
+                 handshaker=None, admission=None, headerTimeout=10, requestTimeout=300, minRecvRate=500, sendTimeout=30, minSendRate=1024,
+                 watcher=None):
         self.rootDirectory = rootDirectory
         self.indexFile = indexFile
         self.authHandler = authHandler
+        self.statCache = statCache or StatCache()
+        self.contentCache = contentCache # shared ContentCache, or None to always read from disk
+        self.compressor = compressor # Compressor for Content-Encoding, or None to never compress
         self.connSocket = connSocket
         self.connSocket.settimeout(1)
         self.connSocketAddress = connSocketAddress
+        self.writer = ResponseWriter(connSocket, sendTimeout or None, minSendRate) # holds header until body is sent with it
         self.keep_alive = True
+        self.keepAliveTimeout = keepAliveTimeout # seconds an idle connection is kept open
+        self.maxRequests = maxRequests # max requests served on one connection
+        self.headerTimeout = headerTimeout # max seconds to receive header of a request, and first request after connecting
+        self.requestTimeout = requestTimeout # max seconds to receive a whole request, not applied to a body arriving at minRecvRate, 0 for no limit
+        self.minRecvRate = minRecvRate # min bytes per second of a request taking longer than RATE_GRACE, 0 for no limit
+        self.requestStart = None # time first byte of request being received arrived, None between requests
+        self.requestBytes = 0 # bytes received of request being received
+        self.requestCount = 0
+        self.parser = HttpParser(maxBodySize=maxBodySize)
+        self.formParser = FormParser()
+        self.request = None # request being handled
+        self.closing = False # close connection after current response
+        self.lastActive = time.monotonic()
+        self.stopped = False
+        self.responseCode = None # status code of current response
+        self.sentBytes = 0 # bytes sent for current response
+        self.metrics = metrics # MetricsRegistry, or None to not record metrics
+        self.metricsPath = metricsPath # path serving metrics without authorization, or None
+        self.tracer = tracer # RequestTracer timing phases of requests, or None
+        self.handshaker = handshaker # TLSHandshaker doing TLS handshake when run by a worker, or None
+        self.admission = admission # AdmissionController which admitted the connection, released on stop, or None
+        self.watcher = watcher # ConnectionWatcher holding connection between requests instead of worker, or None
+        self.trace = None # RequestTrace of current request, None if not traced
+        self.queueWait = 0.0 # seconds waited in scheduler queue before being run (set by scheduler)
+        self.parseTime = 0.0 # seconds spent parsing received data since last traced request
+        if metrics is not None:
+            self.requestsTotal = metrics.counter("pr0j3ct_requests_total", "Requests handled, by method and status code", ("method", "code"))
+            self.requestDuration = metrics.histogram("pr0j3ct_request_duration_seconds", "Time to handle a request and send its response", ("method",))
+            self.responseBytes = metrics.counter("pr0j3ct_response_bytes_total", "Bytes of responses sent")
+            self.connectionsClosed = metrics.counter("pr0j3ct_connections_closed_total", "Client connections closed")
+            self.connectionsExpired = metrics.counter("pr0j3ct_connections_expired_total",
+                                                      "Client connections closed by a deadline or minimum rate, by reason (idle, header, request, recv_rate, send_rate)", ("reason",))
         self.logger = Logger(self.__class__.__name__+"_{}".format(self.connSocketAddress))
 
     def run(self):
         """
-        Start processing requests (called by thread scheduler)
+        Process requests of connection (called by scheduler worker thread)\
+        With a `watcher`, the worker returns once no request is being received, no data is waiting and no worker
+        is free for other tasks, and the connection is parked until the watcher queues it again
         """
-        while self.keep_alive:
-            # recieve data from client socket
-            try:
-                received = self.connSocket.recv(2048)
-            except socket.timeout: continue
-            except socket.error as e:
-                self.logger.error(e)
+        parked = False
+        try:
+            # TLS handshake is done here rather than in accept loop, so a slow client only holds one worker
+            if self.handshaker is not None:
+                if not self.handshaker.handshake(self.connSocket, self.connSocketAddress):
+                    return
+                # a parked connection is run again without handshake
+                self.handshaker = None
+                self.connSocket.settimeout(1)
+                self.lastActive = time.monotonic()
+            while self.keep_alive:
+                idle = self.watcher is not None and self.requestStart is None
+                # recieve data from client socket
+                try:
+                    if idle:
+                        # waiting here saves handing connection over while workers are free, else it is given back at once
+                        received = self._recvIDLE(0 if self.watcher.scheduler.saturated() else IDLE_TICK)
+                    else:
+                        received = self.connSocket.recv(RECV_SIZE)
+                except socket.timeout:
+                    reason = self.expired()
+                    if reason:
+                        self.expire(reason)
+                        break
+                    continue
+                except socket.error as e:
+                    # socket is closed by scheduler if not keep_alive
+                    if self.keep_alive:
+                        self.logger.error(e)
+                    break
+                if received is None:
+                    # nothing to do until client sends, worker is given back
+                    parked = True
+                    self.watcher.park(self)
+                    return
+                # if connection is closed by client, stop
+                if not received:
+                    break
+                self.process(received)
+                # a client trickling data never lets recv time out, deadlines are checked as data arrives
+                if self.requestStart is not None:
+                    reason = self.expired()
+                    if reason:
+                        self.expire(reason)
+                        break
+        finally:
+            # connection is closed and released even if processing failed, unless watcher holds it
+            if not parked:
                 self.stop()
-                break
-            # decode byte array to string (HTTP request)
+
+    def _recvIDLE(self, timeout):
+        """
+        Receive data of next request within `timeout` seconds, 0 to only take data already waiting\
+        Return `None` if there is none with timeout 0, raise `socket.timeout` otherwise
+        """
+        self.connSocket.settimeout(timeout)
+        try:
+            return self.connSocket.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return None
+        finally:
+            self.connSocket.settimeout(1)
+
+    def feed(self, received):
+        """
+        Add received data to request parser\
+        Return `True` if a complete request is ready to be handled
+        """
+        self.lastActive = time.monotonic()
+        if self.requestStart is None:
+            self.requestStart = self.lastActive
+            self.requestBytes = 0
+        self.requestBytes += len(received)
+        if self.tracer is not None and self.tracer.enabled:
+            start = time.perf_counter()
+            self.parser.feed(received)
+            self.parseTime += time.perf_counter() - start
+        else:
+            self.parser.feed(received)
+        if self.parser.expectContinue:
+            # client waits for permission before sending body, socket mode is kept as the event loop needs it
+            self.parser.expectContinue = False
             try:
-                decodedMessage = received.decode("utf-8")
-            except UnicodeDecodeError as e:
+                self.connSocket.send(b"HTTP/1.1 100 Continue\r\n\r\n")
+            except (socket.error, ssl.SSLError) as e:
                 self.logger.error(e)
-                self.stop()
-                break
-            # handle request
-            self._handle(decodedMessage)
+        return self.parser.ready()
+
+    def ready(self):
+        """
+        Check if a complete request is already received and waiting to be handled
+        """
+        return self.parser.ready()
+
+    def expired(self):
+        """
+        Check deadlines of connection waiting for data\
+        Return reason ("idle", "header", "request" or "recv_rate") if connection should be closed\
+        Return `None` otherwise
+        """
+        now = time.monotonic()
+        if self.requestStart is None:
+            # a new connection must send its first request within header deadline
+            if not self.requestCount and now - self.lastActive > self.headerTimeout: return "header"
+            return "idle" if now - self.lastActive > self.keepAliveTimeout else None
+        elapsed = now - self.requestStart
+        # header is received until parser waits for body
+        if self.parser.current is None and elapsed > self.headerTimeout: return "header"
+        # a body still arriving at minimum rate is bounded by that rate instead, so large uploads are not cut off
+        receivingBody = self.parser.current is not None and self.minRecvRate
+        if self.requestTimeout and elapsed > self.requestTimeout and not receivingBody: return "request"
+        if self.minRecvRate and elapsed > RATE_GRACE and self.requestBytes < self.minRecvRate * elapsed: return "recv_rate"
+        # client stopped sending in the middle of a request
+        if now - self.lastActive > self.keepAliveTimeout: return "idle"
+        return None
+
+    def expire(self, reason):
+        """
+        Record connection closed because of a deadline or minimum rate (see `expired`, "send_rate" when sending)
+        """
+        self.keep_alive = False
+        if self.metrics is not None: self.connectionsExpired.inc(1, (reason,))
+        if reason == "idle":
+            self.logger.info("Idle for {} seconds, connection closed", self.keepAliveTimeout)
+        else:
+            self.logger.warn("Client too slow ({}), connection closed", reason)
+
+    def process(self, received=b""):
+        """
+        Parse received data and handle all complete requests in order (called by thread or event loop)
+        """
+        if received: self.feed(received)
+        while self.keep_alive:
+            try:
+                request = self.parser.next()
+            except HttpParseError as e:
+                self.logger.warn("Bad request: {}", e)
+                self.closing = True
+                start = self._startRESPONSE()
+                self._handleERROR(e.code, e.message)
+                self._flush()
+                self._recordRESPONSE("OTHER", start)
+                self.keep_alive = False
+                return
+            if request is None: return
+            self.requestCount += 1
+            self.request = request
+            self.closing = not request.keepAlive or self.requestCount >= self.maxRequests
+            start = self._startRESPONSE()
+            if self.tracer is not None: self._beginTRACE(request)
+            try:
+                self._handle(request)
+                self._flush()
+            except Exception as e:
+                self.logger.error("{} {} failed: {}", request.method, request.target, e)
+                self._handleFAILURE()
+            finally:
+                request.close()
+                if self.trace is not None:
+                    self.tracer.finish(self.trace)
+                    self.trace = None
+            self._recordRESPONSE(request.method if request.method in METRIC_METHODS else "OTHER", start)
+            self.request = None
+            self.lastActive = time.monotonic()
+            # deadlines of next request start when its first byte is received, or now if already partly received
+            self.requestStart = self.lastActive if self.parser.pending() else None
+            self.requestBytes = 0
+            if self.closing:
+                self.keep_alive = False
 
     def stop(self):
         """
-        Stop processing requests (called by thread scheduler)
+        Stop processing requests and close connection (called by scheduler)
         """
         self.keep_alive = False
-        self.connSocket.detach()
+        if self.stopped: return
+        self.stopped = True
+        self.parser.close()
+        if self.metrics is not None:
+            self.connectionsClosed.inc()
+        if self.admission is not None:
+            self.admission.release(self.connSocketAddress)
+        try:
+            self.connSocket.close()
+        except socket.error as e:
+            self.logger.error(e)
         self.logger.close()
 
     def _handle(self, request):
         """
-        Handle received request message (POST, GET, HEAD)
+        Handle parsed request (POST, PUT, GET, HEAD)
         """
-        # if empty request, just skip
-        if not request.strip():
+        # metrics are served to any client, without checking rules
+        if self.metricsPath and request.path == self.metricsPath and request.method in ("GET", "HEAD"):
+            self._handleMETRICS(request)
             return
-        # recognize message type
-        type = request.split()[0].lower()
-        # handle POST
-        if type == "post" :
+        # handle POST and PUT
+        if request.method in ("POST", "PUT"):
             self._handlePOST(request)
         # handle GET
-        elif type == "get" :
+        elif request.method == "GET":
             self._handleGET(request)
         # handle HEAD
-        elif type == "head" :
+        elif request.method == "HEAD":
             self._handleHEAD(request)
         # handle not implemented
         else:
-            self.logger.warn("{} request type is not implemented")
+            self.logger.warn("{} request type is not implemented", request.method)
             self._handleERROR(501, "Not Implemented")
 
+    def _beginTRACE(self, request):
+        """
+        Start tracing request if tracing is enabled, with time waited in queue and parsing
+        """
+        self.trace = self.tracer.begin(request.method, request.target, self.connSocketAddress)
+        if self.trace is None: return
+        self.trace.add("queue", self.queueWait)
+        self.trace.add("parse", self.parseTime)
+        # queue wait only applies to first request handled after being scheduled
+        self.queueWait = 0.0
+        self.parseTime = 0.0
+
+    def _phase(self, name):
+        """
+        Get context measuring a phase of current request, does nothing if request is not traced
+        """
+        return NO_PHASE if self.trace is None else self.trace.phase(name)
+
+    def _startRESPONSE(self):
+        """
+        Reset response status and counters, return start time
+        """
+        self.responseCode = None
+        self.sentBytes = 0
+        return time.perf_counter()
+
+    def _recordRESPONSE(self, method, start):
+        """
+        Record metrics of finished response
+        """
+        if self.metrics is None: return
+        self.requestDuration.observe(time.perf_counter() - start, (method,))
+        self.requestsTotal.inc(1, (method, str(self.responseCode)))
+        self.responseBytes.inc(self.sentBytes)
+
+    def _connectionHEADER(self):
+        """
+        Get Connection header field for current response, or `None` if not needed
+        """
+        if self.closing: return "close"
+        if self.request is not None and self.request.version == "HTTP/1.0": return "keep-alive"
+        return None
+
     def _send(self, message, binary=False):
         """
         Send response to client after handling\\
@@ -89,243 +357,517 @@ class RequestProcessor(threading.Thread):
         # set timeout to blocking, for all data to be sent
         try:
             self.connSocket.settimeout(None)
-            if binary:
-                self.connSocket.send(message)
-            else:
-                self.connSocket.send(message.encode("utf-8"))
+            if not binary:
+                message = message.encode("utf-8")
+            with self._phase("send"):
+                self.sentBytes += self.writer.send(message)
             # set back timeout
             self.connSocket.settimeout(1)
             return True
+        except socket.timeout:
+            self.expire("send_rate")
+            return False
         except socket.error as e:
             self.logger.error(e)
             return False
 
-    def _sendHEADER(self, responseCode, responseMessage, contentType, length):
-        """
-        send http response header
-        """
-        #create each line of the header
-        header = [
-            "HTTP/1.1 {} {}\r\n".format(responseCode, responseMessage),
-            "Date: {}\r\n".format(formatdate(timeval=None, localtime=False, usegmt=True)),
-            "Server: Pr0j3ct\r\n",
-            "Content-Length: {}\r\n".format(length),
-            "Content-Type: {}\r\n".format(contentType),
-        ]
-        #convert header to a single string
-        header = "".join(header)
-        header += "\r\n"
-        #send header
-        self._send(header)
+    def _sendFILE(self, filePath, offset=0, count=None):
+        """
+        Send file content to client, from `offset` and at most `count` bytes (to end of file if `None`)\
+        Plain sockets use zero-copy `sendfile`, TLS sockets use a large reused buffer (see `ResponseWriter`)\
+        Return `True` if success\
+        Return `False` if error occured
+        """
+        try:
+            self.connSocket.settimeout(None)
+            with open(filePath, "rb") as inputFile, self._phase("send"):
+                self.sentBytes += self.writer.sendFile(inputFile, offset, count)
+            # set back timeout
+            self.connSocket.settimeout(1)
+            return True
+        except socket.timeout:
+            self.expire("send_rate")
+            return False
+        except (socket.error, OSError) as e:
+            self.logger.error(e)
+            return False
+
+    def _sendCONTENT(self, filePath, content, offset, count):
+        """
+        Send `count` bytes from `offset` of file, from cached `content` bytes if given, else from disk
+        """
+        if content is None:
+            return self._sendFILE(filePath, offset, count)
+        return self._send(memoryview(content)[offset:offset + count], binary=True)
+
+    def _flush(self):
+        """
+        Send response parts still held by writer, such as header of a response without body\
+        Return `True` if success\
+        Return `False` if error occured
+        """
+        if not self.writer.pending: return True
+        return self._send(b"", binary=True)
+
+    def _sendHEADER(self, responseCode, responseMessage, contentType, length, extraHeaders=None):
+        """
+        send http response header, `extraHeaders` is a list of (name, value)\
+        `contentType` and `length` are skipped if `None`\
+        header is held by writer and sent with the body, or at end of response
+        """
+        self.responseCode = responseCode
+        extraHeaders = list(extraHeaders) if extraHeaders else []
+        if self.trace is not None and self.tracer.serverTiming:
+            extraHeaders.append(("Server-Timing", self.trace.serverTiming()))
+        connection = self._connectionHEADER()
+        if connection:
+            extraHeaders.append(("Connection", connection))
+        self.writer.write(buildHEADER(responseCode, responseMessage, contentType, length, extraHeaders))
+
+    def _sendHANDLED(self, data, nobody=False, headers=None, extraHeaders=None):
+        """
+        send response returned by page handler, `data` is `(header, body)` in bytes\
+        body is compressed if client accepts it, according to request `headers`\
+        `extraHeaders` is a list of (name, value) added to handler's header
+        """
+        header, body = data
+        if extraHeaders:
+            header = header[:-2] + "".join("{}: {}\r\n".format(name, value) for name, value in extraHeaders).encode("latin-1") + b"\r\n"
+        try:
+            self.responseCode = int(header.split(b" ", 2)[1])
+        except (IndexError, ValueError):
+            pass
+        if body and self.compressor and headers:
+            header, body = self._encodeHANDLED(header, body, headers)
+        # response must be framed for connection to be kept alive, handlers may leave out Content-Length
+        fields = header.lower()
+        if self.responseCode not in (204, 304) and b"\r\ncontent-length:" not in fields and b"\r\ntransfer-encoding:" not in fields:
+            header = header[:-2] + "Content-Length: {}\r\n\r\n".format(len(body)).encode("latin-1")
+        if self.trace is not None and self.tracer.serverTiming:
+            header = header[:-2] + "Server-Timing: {}\r\n\r\n".format(self.trace.serverTiming()).encode("latin-1")
+        connection = self._connectionHEADER()
+        if connection:
+            header = header[:-2] + "Connection: {}\r\n\r\n".format(connection).encode("latin-1")
+        # header is sent with body, or at end of response
+        self.writer.write(header)
+        if body and not nobody:
+            self._send(body, binary=True)
+
+    def _encodeHANDLED(self, header, body, headers):
+        """
+        compress body of handler response and update its header, if possible
+        """
+        encoding = self.compressor.negotiate(headers.get("accept-encoding"))
+        if not encoding or len(body) < self.compressor.minSize: return header, body
+        lines = header.rstrip(b"\r\n").split(b"\r\n")
+        fields = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            fields[name.strip().lower()] = value.strip()
+        if b"content-encoding" in fields: return header, body
+        if not self.compressor.compressible(fields.get(b"content-type", b"").decode("latin-1")): return header, body
+        body = self.compressor.compress(body, encoding)
+        lines = [x for x in lines if not x.lower().startswith(b"content-length:")]
+        lines.append("Content-Length: {}".format(len(body)).encode("latin-1"))
+        lines.append("Content-Encoding: {}".format(encoding).encode("latin-1"))
+        lines.append(b"Vary: Accept-Encoding")
+        return b"\r\n".join(lines) + b"\r\n\r\n", body
+
+    def _findENCODED(self, filePath, fileStat, encoding):
+        """
+        find compressed variant of static file\
+        Return `(path, stat)` of precompressed file next to it (`.gz`), if exists and not older than file\
+        Return `(None, None)` if file is small enough to be compressed and cached in memory\
+        Return `None` if no variant is available
+        """
+        if encoding == "gzip":
+            variantStat = self.statCache.stat(filePath + ".gz")
+            if variantStat is not None and stat.S_ISREG(variantStat.st_mode) and variantStat.st_mtime_ns >= fileStat.st_mtime_ns:
+                return filePath + ".gz", variantStat
+        if self.contentCache and self.compressor.minSize <= fileStat.st_size <= self.contentCache.maxEntrySize:
+            return None, None
+        return None
+
+    def _parseRANGE(self, value, fileSize):
+        """
+        parse Range header value\
+        Return list of (first, last) byte positions, both included\
+        Return empty list if no range is satisfiable\
+        Return `None` if header is invalid or not supported, then whole file should be sent
+        """
+        unit, sep, rangeSet = value.partition("=")
+        if not sep or unit.strip().lower() != "bytes": return None
+        ranges = []
+        for item in rangeSet.split(","):
+            item = item.strip()
+            if not item: continue
+            first, sep, last = item.partition("-")
+            first, last = first.strip(), last.strip()
+            if not sep or not (first.isdigit() or last.isdigit()): return None
+            if first and last and not (first.isdigit() and last.isdigit()): return None
+            if not first:
+                # suffix range, last N bytes
+                length = int(last)
+                if length > 0 and fileSize > 0:
+                    ranges.append((max(0, fileSize - length), fileSize - 1))
+            else:
+                first = int(first)
+                last = int(last) if last else None
+                if last is not None and last < first: return None
+                if first < fileSize:
+                    ranges.append((first, fileSize - 1 if last is None else min(last, fileSize - 1)))
+        if len(ranges) > MAX_RANGES: return None
+        return ranges
+
+    def _checkIFRANGE(self, value, etag, lastModified):
+        """
+        check If-Range header value, return `True` if file is not changed and Range can be used
+        """
+        if value is None: return True
+        # only strong validators can be used
+        if value.startswith("W/"): return False
+        if value.startswith("\""): return value == etag
+        return value == lastModified
+
+    def _checkNOTMODIFIED(self, headers, etag, mtime):
+        """
+        check If-None-Match and If-Modified-Since header values\
+        Return `True` if client's copy is still valid
+        """
+        if "if-none-match" in headers:
+            value = headers["if-none-match"].strip()
+            if value == "*": return True
+            # weak comparison, ignore W/ prefix
+            tags = [x.strip() for x in value.split(",")]
+            tags = [x[2:] if x.startswith("W/") else x for x in tags]
+            return etag in tags
+        if "if-modified-since" in headers:
+            try:
+                since = parsedate_to_datetime(headers["if-modified-since"]).timestamp()
+            except (TypeError, ValueError, IndexError):
+                return False
+            return int(mtime) <= since
+        return False
 
-    def _handleGET(self, message):
+    def _sendSTATIC(self, method, filePath, headers, fileStat, nobody=False):
+        """
+        send static file, with support of conditional and Range requests\
+        `fileStat` is the stat result of file, validators are derived from it without opening file
+        """
+        # get file size in bytes
+        fileSize = fileStat.st_size
+        etag = "\"{:x}-{:x}\"".format(fileStat.st_mtime_ns, fileSize)
+        lastModified = formatdate(timeval=fileStat.st_mtime, localtime=False, usegmt=True)
+        # get data type
+        datatype, _ = mimetypes.guess_type(filePath)
+        if not datatype:
+            # if not able to guess, set to "application/octet-stream" (default binary file type)
+            self.logger.warn("{} {} unknown mime type, set to application/octet-stream", method, filePath)
+            datatype = "application/octet-stream"
+        # text files of website are UTF-8
+        elif datatype.startswith("text/"):
+            datatype += "; charset=utf-8"
+        compressible = self.compressor is not None and self.compressor.compressible(datatype)
+        # send compressed variant of whole file if client accepts it
+        if compressible and "range" not in headers:
+            encoding = self.compressor.negotiate(headers.get("accept-encoding"))
+            variant = self._findENCODED(filePath, fileStat, encoding) if encoding else None
+            if variant is not None:
+                variantPath, variantStat = variant
+                variantEtag = etag[:-1] + "-" + encoding + "\""
+                extraHeaders = [("ETag", variantEtag), ("Last-Modified", lastModified), ("Vary", "Accept-Encoding")]
+                # client's copy is still valid
+                if self._checkNOTMODIFIED(headers, variantEtag, fileStat.st_mtime):
+                    self._sendHEADER(304, "Not Modified", None, None, extraHeaders)
+                    return
+                extraHeaders.append(("Content-Encoding", encoding))
+                # precompressed file
+                if variantPath:
+                    self._sendHEADER(200, "OK", datatype, variantStat.st_size, extraHeaders)
+                    if not nobody and not self._sendFILE(variantPath, 0, variantStat.st_size):
+                        self.logger.warn("{} {} failed to send", method, variantPath)
+                    return
+                # compressed in memory, cached with file's stat data
+                data = None
+                try:
+                    data = self.contentCache.get((filePath, encoding), fileStat)
+                    if data is None:
+                        content = self.contentCache.fetch(filePath, fileStat)
+                        if content is not None:
+                            data = self.compressor.compress(content, encoding)
+                            self.contentCache.put((filePath, encoding), fileStat, data)
+                except OSError as e:
+                    self.logger.error(e)
+                if data is not None:
+                    self._sendHEADER(200, "OK", datatype, len(data), extraHeaders)
+                    if not nobody and not self._send(data, binary=True):
+                        self.logger.warn("{} {} failed to send", method, filePath)
+                    return
+        extraHeaders = [("Accept-Ranges", "bytes"), ("ETag", etag), ("Last-Modified", lastModified)]
+        if compressible:
+            extraHeaders.append(("Vary", "Accept-Encoding"))
+        # client's copy is still valid
+        if self._checkNOTMODIFIED(headers, etag, fileStat.st_mtime):
+            self._sendHEADER(304, "Not Modified", None, None, extraHeaders[1:])
+            return
+        # small files are served from memory
+        content = None
+        if self.contentCache and not nobody:
+            try:
+                content = self.contentCache.fetch(filePath, fileStat)
+            except OSError as e:
+                self.logger.error(e)
+        ranges = None
+        if "range" in headers and self._checkIFRANGE(headers.get("if-range"), etag, lastModified):
+            ranges = self._parseRANGE(headers["range"], fileSize)
+        # send whole file
+        if ranges is None:
+            self._sendHEADER(200, "OK", datatype, fileSize, extraHeaders)
+            if not nobody and not self._sendCONTENT(filePath, content, 0, fileSize):
+                self.logger.warn("{} {} failed to send", method, filePath)
+        # no range is satisfiable
+        elif not ranges:
+            self.logger.warn("{} {} range {} not satisfiable", method, filePath, headers["range"])
+            self._handleERROR(416, "Range Not Satisfiable", nobody=nobody, extraHeaders=[("Content-Range", "bytes */{}".format(fileSize))])
+        # send single part
+        elif len(ranges) == 1:
+            first, last = ranges[0]
+            extraHeaders.append(("Content-Range", "bytes {}-{}/{}".format(first, last, fileSize)))
+            self._sendHEADER(206, "Partial Content", datatype, last - first + 1, extraHeaders)
+            if not nobody and not self._sendCONTENT(filePath, content, first, last - first + 1):
+                self.logger.warn("{} {} failed to send", method, filePath)
+        # send multiple parts
+        else:
+            boundary = binascii.hexlify(os.urandom(16)).decode("ascii")
+            partHeaders = [
+                "\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n".format(boundary, datatype, first, last, fileSize).encode("utf-8")
+                for first, last in ranges
+            ]
+            ending = "\r\n--{}--\r\n".format(boundary).encode("utf-8")
+            length = sum(len(x) for x in partHeaders) + sum(last - first + 1 for first, last in ranges) + len(ending)
+            self._sendHEADER(206, "Partial Content", "multipart/byteranges; boundary={}".format(boundary), length, extraHeaders)
+            if nobody: return
+            for partHeader, (first, last) in zip(partHeaders, ranges):
+                self.writer.write(partHeader)
+                if not self._sendCONTENT(filePath, content, first, last - first + 1):
+                    self.logger.warn("{} {} failed to send", method, filePath)
+                    return
+            self._send(ending, binary=True)
+
+    def _handleGET(self, request):
         """
         handle GET http request
         """
-        received = message.split("\n")[0]
-        #convert URL to original string
-        targetInfoParsed = urllib.parse.urlparse(received.split()[1])
-        targetInfo = urllib.parse.unquote(targetInfoParsed.path)
-        targetParams = urllib.parse.parse_qs(targetInfoParsed.query)
-        self.logger.info("GET {}".format(targetInfo))
+        headers = request.headers
+        targetInfo = request.path
+        targetParams = request.params
+        self.logger.info("GET {}", targetInfo)
         #if requested root send back index file
         if targetInfo == "/":
-            self.authHandler.mutex.acquire()
-            data = self.authHandler.handle(os.path.join(self.rootDirectory, self.indexFile), targetParams)
-            self.authHandler.mutex.release()
-            if len(data) <= 0:
-                with open(os.path.join(self.rootDirectory, self.indexFile), "r") as inputFile:
-                    data = inputFile.read()
-                self._sendHEADER(200, "OK", "text/html; charset=utf-8", len(data))
-                self._send(data)
-            elif len(data) == 1:
-                self._send(data[0] + "\r\n\r\n")
+            filePath = os.path.join(self.rootDirectory, self.indexFile)
+            with self._phase("handler"):
+                data = self.authHandler.handle(filePath, targetParams, token=self._sessionTOKEN(request))
+            if data is None:
+                fileStat = self.statCache.stat(filePath)
+                if fileStat is None:
+                    self.logger.warn("GET {} is not a path", filePath)
+                    self._handleERROR(404, "File Not Found")
+                else:
+                    self._sendSTATIC("GET", filePath, headers, fileStat)
             else:
-                self._send(data[0] + "\r\n\r\n")
-                self._send(data[1])
+                self._sendHANDLED(data, headers=headers)
         #else try to recognize target file
         else:
             # convert to relative target path
             targetInfo = "." + targetInfo
             #get abosolute filepath
             filePath = os.path.join(self.rootDirectory, targetInfo)
+            fileStat = self.statCache.stat(filePath)
             # if path not exist, send 404 error
-            if not os.path.exists(filePath):
-                self.logger.warn("GET {} is not a path".format(filePath))
+            if fileStat is None:
+                self.logger.warn("GET {} is not a path", filePath)
                 self._handleERROR(404, "File Not Found")
             # if request target is not a file, send 404 error.
-            elif not os.path.isfile(filePath):
-                self.logger.warn("GET {} is not a file".format(filePath))
+            elif not stat.S_ISREG(fileStat.st_mode):
+                self.logger.warn("GET {} is not a file", filePath)
                 self._handleERROR(404, "File Not Found")
             #if requested file is out of the root directory, send permission denied. 
             elif os.path.commonpath([self.rootDirectory]) != os.path.commonpath([self.rootDirectory, filePath]):
-                self.logger.warn("GET {} not in root directory".format(filePath))
+                self.logger.warn("GET {} not in root directory", filePath)
                 self._handleERROR(403, "Permission Denied")
             # else send back requested file
             else:
-                self.authHandler.mutex.acquire()
-                authorized = self.authHandler.auth(filePath, self.connSocketAddress)
-                self.authHandler.mutex.release()
+                with self._phase("auth"):
+                    authorized = self.authHandler.auth(filePath, self._sessionTOKEN(request))
                 # if not authorized
                 if not authorized:
-                    self.logger.warn("GET {} not authorized".format(filePath))
+                    self.logger.warn("GET {} not authorized", filePath)
                     self._handleERROR(403, "Permission Denied")
                     return
-                self.authHandler.mutex.acquire()
-                data = self.authHandler.handle(filePath, targetParams)
-                self.authHandler.mutex.release()
-                if len(data) <= 0:
-                    # get file size in bytes
-                    fileSize = os.path.getsize(filePath)
-                    # get data type
-                    datatype, _ = mimetypes.guess_type(filePath)
-                    if not datatype:
-                        # if not able to guess, set to "application/octet-stream" (default binary file type)
-                        self.logger.warn("GET {} unknown mime type, set to application/octet-stream".format(filePath))
-                        datatype = "application/octet-stream"
-                    # send header and data
-                    self._sendHEADER(200, "OK", datatype, fileSize)
-                    with open(filePath, "rb") as inputFile:
-                        while True:
-                            # read every 2048 bytes
-                            data = inputFile.read(2048)
-                            # if no more data, stop
-                            if not data: break
-                            # if send data failed, break
-                            if not self._send(data, binary=True):
-                                self.logger.warn("GET {} failed to send".format(filePath))
-                                break
-                elif len(data) == 1:
-                    self._send(data[0] + "\r\n\r\n")
+                with self._phase("handler"):
+                    data = self.authHandler.handle(filePath, targetParams, token=self._sessionTOKEN(request))
+                if data is None:
+                    self._sendSTATIC("GET", filePath, headers, fileStat)
                 else:
-                    self._send(data[0] + "\r\n\r\n")
-                    self._send(data[1])
+                    self._sendHANDLED(data, headers=headers)
 
-    def _handleHEAD(self, message):
+    def _handleHEAD(self, request):
         """
         handle HEAD http request
         """
-        received = message.split("\n")[0]
-        #convert URL to original string
-        targetInfoParsed = urllib.parse.urlparse(received.split()[1])
-        targetInfo = urllib.parse.unquote(targetInfoParsed.path)
-        targetParams = urllib.parse.parse_qs(targetInfoParsed.query)
-        self.logger.info("HEAD {}".format(targetInfo))
+        headers = request.headers
+        targetInfo = request.path
+        targetParams = request.params
+        self.logger.info("HEAD {}", targetInfo)
         #if requested root send back index file header
         if targetInfo == "/" :
-            self.authHandler.mutex.acquire()
-            data = self.authHandler.handle(os.path.join(self.rootDirectory, self.indexFile), targetParams)
-            self.authHandler.mutex.release()
-            if len(data) <= 0:
-                with open(os.path.join(self.rootDirectory, self.indexFile), "r") as inputFile:
-                    data = inputFile.read()
-                self._sendHEADER(200, "OK", "text/html; charset=utf-8", len(data))
-            elif len(data) == 1:
-                self._send(data[0] + "\r\n\r\n")
+            filePath = os.path.join(self.rootDirectory, self.indexFile)
+            with self._phase("handler"):
+                data = self.authHandler.handle(filePath, targetParams, token=self._sessionTOKEN(request))
+            if data is None:
+                fileStat = self.statCache.stat(filePath)
+                if fileStat is None:
+                    self.logger.warn("HEAD {} is not a path", filePath)
+                    self._handleERROR(404, "File Not Found", nobody=True)
+                else:
+                    self._sendSTATIC("HEAD", filePath, headers, fileStat, nobody=True)
             else:
-                self._send(data[0] + "\r\n\r\n") # first is header information
+                self._sendHANDLED(data, nobody=True, headers=headers)
         else:
             # convert to relative target path
             targetInfo = "." + targetInfo
             #get abosolute filepath
             filePath = os.path.join(self.rootDirectory, targetInfo)
+            fileStat = self.statCache.stat(filePath)
             # if path not exist, send 404 error
-            if not os.path.exists(filePath):
-                self.logger.warn("HEAD {} is not a path".format(filePath))
+            if fileStat is None:
+                self.logger.warn("HEAD {} is not a path", filePath)
                 self._handleERROR(404, "File Not Found", nobody=True)
             # if request target is not a file, send 404 error.
-            elif not os.path.isfile(filePath):
-                self.logger.warn("HEAD {} is not a file".format(filePath))
+            elif not stat.S_ISREG(fileStat.st_mode):
+                self.logger.warn("HEAD {} is not a file", filePath)
                 self._handleERROR(404, "File Not Found", nobody=True)
             #if requested file is out of the root directory, send permission denied. 
             elif os.path.commonpath([self.rootDirectory]) != os.path.commonpath([self.rootDirectory, filePath]):
-                self.logger.warn("HEAD {} not in root directory".format(filePath))
+                self.logger.warn("HEAD {} not in root directory", filePath)
                 self._handleERROR(403, "Permission Denied", nobody=True)
             # else send back requested file
             else:
-                self.authHandler.mutex.acquire()
-                authorized = self.authHandler.auth(filePath, self.connSocketAddress)
-                self.authHandler.mutex.release()
+                with self._phase("auth"):
+                    authorized = self.authHandler.auth(filePath, self._sessionTOKEN(request))
                 # if not authorized
                 if not authorized:
-                    self.logger.warn("GET {} not authorized".format(filePath))
+                    self.logger.warn("GET {} not authorized", filePath)
                     self._handleERROR(403, "Permission Denied", nobody=True)
                     return
-                self.authHandler.mutex.acquire()
-                data = self.authHandler.handle(filePath, targetParams)
-                self.authHandler.mutex.release()
-                if len(data) <= 0:
-                    # get file size in bytes
-                    fileSize = os.path.getsize(filePath)
-                    # get data type
-                    datatype, _ = mimetypes.guess_type(filePath)
-                    if not datatype:
-                        # if not able to guess, set to "application/octet-stream" (default binary file type)
-                        self.logger.warn("HEAD {} unknown mime type, set to application/octet-stream".format(filePath))
-                        datatype = "application/octet-stream"
-                        # send header 
-                    self._sendHEADER(200, "OK", datatype, fileSize)
-                elif len(data) == 1:
-                    self._send(data[0] + "\r\n\r\n")
+                with self._phase("handler"):
+                    data = self.authHandler.handle(filePath, targetParams, token=self._sessionTOKEN(request))
+                if data is None:
+                    self._sendSTATIC("HEAD", filePath, headers, fileStat, nobody=True)
                 else:
-                    self._send(data[0] + "\r\n\r\n")
-
-    def _handlePOST(self, message):
-        """
-        handle POST http request
-        """
-        # get target info and parameters
-        targetInfoParsed = urllib.parse.urlparse(message.split("\n")[0].split()[1])
-        targetInfo = urllib.parse.unquote(targetInfoParsed.path)
-        targetParams = urllib.parse.parse_qs(message.split("\r\n\r\n")[-1])
-        #convert URL to original string
-        targetInfo = urllib.parse.unquote(targetInfo)
-        self.logger.info("POST {}".format(targetInfo))
-        # handle parameters
-        self.authHandler.mutex.acquire()
-        data = self.authHandler.handle(os.path.join(self.rootDirectory, targetInfo), targetParams)
-        self.authHandler.mutex.release()
-        if len(data) <= 0:
-            self.logger.warn("POST {} is not handled".format(targetInfo))
+                    self._sendHANDLED(data, nobody=True, headers=headers)
+
+    def _handlePOST(self, request):
+        """
+        handle POST and PUT http request, body is passed to handler as parsed form and as stream
+        """
+        headers = request.headers
+        method = request.method
+        # get target info and parameters from form body
+        targetInfo = request.path
+        try:
+            with self._phase("form"):
+                targetParams = self.formParser.parse(headers, request.body)
+        except HttpParseError as e:
+            self.logger.warn("{} {} bad form body: {}", method, targetInfo, e)
+            self._handleERROR(e.code, e.message)
+            return
+        if request.body is not None:
+            # let handler read raw body from start
+            request.body.seek(0)
+        self.logger.info("{} {}", method, targetInfo)
+        try:
+            # handle parameters
+            with self._phase("handler"):
+                data = self.authHandler.handle(os.path.join(self.rootDirectory, targetInfo), targetParams, request)
+        finally:
+            self.formParser.close(targetParams)
+        if data is None:
+            self.logger.warn("{} {} is not handled", method, targetInfo)
             self._handleERROR(501, "Not Supported")
-        elif len(data) == 1:
+        elif method != "POST":
+            self._sendHANDLED(data, headers=headers)
+        elif not data[1]:
+            extraHeaders = None
             #if is login page, do authentication as well
             if (targetInfo.lower() == "/login.html") and "username" in targetParams.keys():
-                # specific case, len(data) == 1 means login success
+                # specific case, empty body means login success
                 self.logger.info("login successful")
-                self.authHandler.mutex.acquire()
-                self.authHandler.updateUserSession(self.connSocketAddress, targetParams["username"][0])
-                self.authHandler.mutex.release()
-            self._send(data[0] + "\r\n\r\n")
+                # always start a new session, so that a token known before login is never trusted
+                token = self._sessionTOKEN(request)
+                if token: self.authHandler.logout(token)
+                token = self.authHandler.login(targetParams["username"][0])
+                extraHeaders = [("Set-Cookie", self._sessionCOOKIE(token, self.authHandler.sessions.maxAge))]
+            self._sendHANDLED(data, headers=headers, extraHeaders=extraHeaders)
         else:
+            extraHeaders = None
             if targetInfo.lower() == "/login.html":
                 self.logger.warn("login not successful")
-                self.authHandler.mutex.acquire()
-                self.authHandler.updateUserSession(self.connSocketAddress, None)
-                self.authHandler.mutex.release()
-            self._send(data[0] + "\r\n\r\n")
-            self._send(data[1])
+                token = self._sessionTOKEN(request)
+                if token:
+                    self.authHandler.logout(token)
+                    extraHeaders = [("Set-Cookie", self._sessionCOOKIE("", 0))]
+            self._sendHANDLED(data, headers=headers, extraHeaders=extraHeaders)
+
+    def _sessionTOKEN(self, request):
+        """
+        Get session token from Cookie header of request, `None` if not found
+        """
+        cookies = request.headers.get("cookie")
+        if not cookies: return None
+        for cookie in cookies.split(";"):
+            name, sep, value = cookie.partition("=")
+            if sep and name.strip() == SESSION_COOKIE:
+                return value.strip().strip("\"") or None
+        return None
+
+    def _sessionCOOKIE(self, token, maxAge):
+        """
+        Get Set-Cookie header value for session token, `maxAge` 0 removes cookie
+        """
+        cookie = "{}={}; Path=/; Max-Age={}; HttpOnly; SameSite=Lax".format(SESSION_COOKIE, token, int(maxAge))
+        if isinstance(self.connSocket, ssl.SSLSocket):
+            cookie += "; Secure"
+        return cookie
+
+    def _handleMETRICS(self, request):
+        """
+        handle request for metrics in Prometheus text format
+        """
+        body = self.metrics.render().encode("utf-8")
+        self._sendHEADER(200, "OK", "text/plain; version=0.0.4; charset=utf-8", len(body))
+        if request.method == "GET":
+            self._send(body, binary=True)
+
+    def _handleFAILURE(self):
+        """
+        answer 500 to request which failed unexpectedly if none of its response was sent, and close connection
+        """
+        self.closing = True
+        if self.sentBytes: return
+        # drop header held for a response which was not completed
+        self.writer.discard()
+        self._handleERROR(500, "Internal Server Error", nobody=self.request is not None and self.request.method == "HEAD")
+        self._flush()
 
-    def _handleERROR(self, errorCode, errorMessage, nobody=False):
+    def _handleERROR(self, errorCode, errorMessage, nobody=False, extraHeaders=None):
         """
         handle http request ERROR
         """
-        #create each line for the response html
-        body = [
-            "<!DOCTYPE html>\r\n",
-            "<html>\r\n",
-            "<head>\r\n",
-            "<title>{}</title>\r\n",
-            "</head>\r\n",
-            "<body>\r\n",
-            "<h1>HTTP Error {}: {}</h1>\r\n"
-            "</body>\r\n",
-            "</html>\r\n",
-        ]
-        #convert body to a single string
-        body = "".join(body).format(errorMessage, errorCode, errorMessage)
+        # error pages are encoded once
+        body = errorPAGE(errorCode, errorMessage)
         #send header
-        self._sendHEADER(errorCode, errorMessage, "text/html; charset=utf-8", len(body))
+        self._sendHEADER(errorCode, errorMessage, "text/html; charset=utf-8", len(body), extraHeaders)
         if not nobody:
             #send body
-            self._send(body)
+            self._send(body, binary=True)
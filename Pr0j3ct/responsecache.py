@@ -0,0 +1,108 @@
+# responsecache.py
+# implements cache of page handler responses, with single-flight coalescing of identical requests
+
+import time
+import threading
+import collections
+
+
+"""
+This class is a handler run being computed, which identical requests wait for instead of running the handler again.
+"""
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+"""
+This class caches responses of one page handler for `ttl` seconds, keyed by normalized parameters (only `params` names
+if given) and by user if `perUser`. At most `maxEntries` responses and `maxBytes` bytes are kept, least recently used
+are evicted first.
+While a response is being computed, identical requests wait for it and share its result, so N simultaneous identical
+requests run the handler once. Responses `None` (not handled) are shared but not cached. A request waiting longer than
+`waitTimeout` seconds computes the response itself, without caching it, so a stuck handler run does not hold every waiter.
+Only the request computing a response holds its flight.
+"""
+class ResponseCache:
+    def __init__(self, ttl, maxEntries=256, maxBytes=16*1024*1024, perUser=False, params=None, waitTimeout=10):
+        self.ttl = ttl
+        self.waitTimeout = waitTimeout # max seconds to wait for a response computed by another request
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.perUser = perUser
+        self.params = frozenset(params) if params is not None else None # parameter names in key, None for all
+        self.entries = collections.OrderedDict() # key -> (expires, response, size), least recently used first
+        self.size = 0
+        self.flights = {} # key -> _Flight being computed
+        self.mutex = threading.Lock()
+        self.counts = {"hit": 0, "miss": 0, "coalesced": 0, "timeout": 0, "evictions": 0}
+
+    def key(self, params, user=None):
+        """
+        Get cache key of request parameters (name -> list of values) and user
+        """
+        items = tuple(sorted((name, tuple(values)) for name, values in params.items() if self.params is None or name in self.params))
+        return (items, user) if self.perUser else items
+
+    def get(self, key, compute):
+        """
+        Get cached response of key, or compute it with `compute()` once for all requests waiting for it\\
+        Return `(response, outcome)`, outcome is "hit", "miss" (computed by this call), "coalesced" (computed by another call)
+        or "timeout" (computed by this call after waiting `waitTimeout` for another call, not cached)
+        """
+        with self.mutex:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.counts["hit"] += 1
+                    return entry[1], "hit"
+                del self.entries[key]
+                self.size -= entry[2]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.counts["miss"] += 1
+            else:
+                self.counts["coalesced"] += 1
+        if not leader:
+            if flight.done.wait(self.waitTimeout):
+                return flight.result, "coalesced"
+            with self.mutex:
+                self.counts["coalesced"] -= 1
+                self.counts["timeout"] += 1
+            return compute(), "timeout"
+        try:
+            flight.result = compute()
+        finally:
+            with self.mutex:
+                del self.flights[key]
+                if flight.result is not None:
+                    self._put(key, flight.result)
+            flight.done.set()
+        return flight.result, "miss"
+
+    def _put(self, key, response):
+        """
+        Store (header, body) response and evict least recently used ones over limits, called with mutex held
+        """
+        size = len(response[0]) + len(response[1])
+        if size > self.maxBytes: return
+        self.entries[key] = (time.monotonic() + self.ttl, response, size)
+        self.size += size
+        while len(self.entries) > self.maxEntries or self.size > self.maxBytes:
+            _, (_, _, evictedSize) = self.entries.popitem(last=False)
+            self.size -= evictedSize
+            self.counts["evictions"] += 1
+
+    def stats(self):
+        """
+        Get cached entries and bytes, with counts of hits, misses, coalesced and timed out requests and evictions
+        """
+        with self.mutex:
+            stats = dict(self.counts)
+            stats["entries"] = len(self.entries)
+            stats["bytes"] = self.size
+        return stats
@@ -0,0 +1,269 @@
+# responsewriter.py
+# implements bytes response header templates and ResponseWriter class coalescing response parts into few sends
+
+import os
+import ssl
+import time
+import socket
+import threading
+from email.utils import formatdate
+
+# buffer size for sending files over TLS, where zero-copy sendfile is not possible
+SEND_BUFFER_SIZE = 256 * 1024
+
+# bytes of body joined with header into one TLS write, the rest of a larger body is sent on its own
+COALESCE_SIZE = 64 * 1024
+
+# max number of buffers given to one sendmsg call
+MAX_PARTS = 64
+
+# bytes of a response over which the minimum send rate is enforced
+SEND_WINDOW = 256 * 1024
+
+SERVER_LINE = b"Server: Pr0j3ct\r\n"
+
+# flag asking kernel to hold a partial packet until the next send (Linux), 0 if not available
+_MSG_MORE = getattr(socket, "MSG_MORE", 0)
+
+# send buffer of each worker thread, reused by all responses sent on the thread
+_threadBuffers = threading.local()
+
+# pre-encoded status lines and error pages, by (code, message)
+_statusLines = {}
+_errorPages = {}
+
+# Date header line of current second, as (second, line)
+_dateLine = (0, b"")
+
+
+def dateLINE():
+    """
+    Get Date header line of current time, formatted at most once per second
+    """
+    global _dateLine
+    now = int(time.time())
+    second, line = _dateLine
+    if second != now:
+        line = "Date: {}\r\n".format(formatdate(timeval=now, localtime=False, usegmt=True)).encode("latin-1")
+        _dateLine = (now, line)
+    return line
+
+
+def statusLINE(code, message):
+    """
+    Get encoded status line of response
+    """
+    line = _statusLines.get((code, message))
+    if line is None:
+        line = _statusLines[(code, message)] = "HTTP/1.1 {} {}\r\n".format(code, message).encode("latin-1")
+    return line
+
+
+def errorPAGE(code, message):
+    """
+    Get encoded HTML body of error response
+    """
+    page = _errorPages.get((code, message))
+    if page is None:
+        page = "".join([
+            "<!DOCTYPE html>\r\n",
+            "<html>\r\n",
+            "<head>\r\n",
+            "<title>{}</title>\r\n",
+            "</head>\r\n",
+            "<body>\r\n",
+            "<h1>HTTP Error {}: {}</h1>\r\n"
+            "</body>\r\n",
+            "</html>\r\n",
+        ]).format(message, code, message).encode("utf-8")
+        _errorPages[(code, message)] = page
+    return page
+
+
+def buildHEADER(code, message, contentType=None, length=None, extraHeaders=None):
+    """
+    Build response header in bytes, ending with empty line\\
+    `extraHeaders` is a list of (name, value), `contentType` and `length` are skipped if `None`
+    """
+    header = [statusLINE(code, message), dateLINE(), SERVER_LINE]
+    if length is not None:
+        header.append(b"Content-Length: %d\r\n" % length)
+    if contentType is not None:
+        header.append(b"Content-Type: " + contentType.encode("latin-1") + b"\r\n")
+    if extraHeaders:
+        header.append("".join("{}: {}\r\n".format(name, value) for name, value in extraHeaders).encode("latin-1"))
+    header.append(b"\r\n")
+    return b"".join(header)
+
+
+"""
+This class writes responses to a client socket with as few system calls and packets as possible.
+Headers (and other small parts) given to `write` are held until the body is sent, then all parts go out together:
+with one scatter-gather `sendmsg` on plain sockets, or joined into one write on TLS sockets.
+File bodies are sent with zero-copy `sendfile` after pending parts flagged with MSG_MORE, so that a small file and its
+header share a packet. Parts still held at the end of a response are sent by `flush`.
+Nagle's algorithm is disabled on the socket, since responses are never written in small pieces.
+With `sendTimeout`, each window of `SEND_WINDOW` bytes must be taken by the client within `sendTimeout` seconds plus
+its time at `minSendRate` bytes per second, else `socket.timeout` is raised, so a client reading slowly or not at all
+does not hold a worker.
+"""
+class ResponseWriter:
+    def __init__(self, connSocket, sendTimeout=None, minSendRate=0):
+        self.connSocket = connSocket
+        self.sendTimeout = sendTimeout # seconds allowed for a window on top of its time at minimum rate, None to wait forever
+        self.minSendRate = minSendRate # bytes per second
+        self.pending = [] # parts waiting for next send
+        self.pendingBytes = 0
+        try:
+            connSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass # not a TCP socket
+        self.tls = isinstance(connSocket, ssl.SSLSocket)
+
+    def write(self, data):
+        """
+        Hold part of response until next send
+        """
+        if data:
+            self.pending.append(data)
+            self.pendingBytes += len(data)
+
+    def send(self, data=b""):
+        """
+        Send pending parts followed by `data`, socket should be blocking\\
+        Return number of bytes sent
+        """
+        parts = self.pending
+        if data: parts.append(data)
+        total = self.pendingBytes + len(data)
+        self.pending = []
+        self.pendingBytes = 0
+        if not parts: return 0
+        if len(parts) == 1:
+            self._sendALL(parts[0])
+        elif self.tls or not hasattr(self.connSocket, "sendmsg"):
+            # header goes out with start of body, a large body is not copied whole
+            head = b"".join(parts[:-1])
+            body = memoryview(parts[-1])
+            self._sendALL(head + body[:COALESCE_SIZE])
+            if len(body) > COALESCE_SIZE:
+                self._sendALL(body[COALESCE_SIZE:])
+        else:
+            self._sendPARTS(parts)
+        return total
+
+    def discard(self):
+        """
+        Drop parts held and not sent yet
+        """
+        self.pending = []
+        self.pendingBytes = 0
+
+    def flush(self):
+        """
+        Send parts still held\\
+        Return number of bytes sent
+        """
+        return self.send()
+
+    def sendFile(self, inputFile, offset=0, count=None):
+        """
+        Send pending parts, then file content from `offset` and at most `count` bytes (to end of file if `None`)\\
+        Return number of bytes sent
+        """
+        if self.tls:
+            return self._sendBUFFERED(inputFile, offset, count)
+        total = 0
+        if self.pending:
+            parts = self.pending
+            self.pending = []
+            total = self.pendingBytes
+            self.pendingBytes = 0
+            # kernel holds last partial packet for the file content
+            self._arm(total)
+            self.connSocket.sendall(b"".join(parts), _MSG_MORE if count else 0)
+        if self.sendTimeout is None:
+            return total + self.connSocket.sendfile(inputFile, offset, count)
+        # file is sent window by window, each checked against its deadline
+        if count is None:
+            count = os.fstat(inputFile.fileno()).st_size - offset
+        while count > 0:
+            size = min(SEND_WINDOW, count)
+            allowed = self._arm(size)
+            start = time.monotonic()
+            sent = self.connSocket.sendfile(inputFile, offset, size)
+            if time.monotonic() - start > allowed:
+                raise socket.timeout("client reads slower than {} bytes per second".format(self.minSendRate))
+            if not sent: break
+            total += sent
+            offset += sent
+            count -= sent
+        return total
+
+    def _arm(self, size):
+        """
+        Set socket timeout for sending `size` bytes, does nothing without `sendTimeout`\
+        Return seconds allowed
+        """
+        if self.sendTimeout is None: return None
+        allowed = self.sendTimeout + (size / self.minSendRate if self.minSendRate else 0)
+        self.connSocket.settimeout(allowed)
+        return allowed
+
+    def _sendALL(self, data):
+        """
+        Send all bytes of `data`, window by window if send deadlines are enforced
+        """
+        if self.sendTimeout is None or len(data) <= SEND_WINDOW:
+            self._arm(len(data))
+            self.connSocket.sendall(data)
+            return
+        view = memoryview(data)
+        for i in range(0, len(view), SEND_WINDOW):
+            window = view[i:i + SEND_WINDOW]
+            # sendall waits at most the socket timeout in total
+            self._arm(len(window))
+            self.connSocket.sendall(window)
+
+    def _sendPARTS(self, parts):
+        """
+        Send all parts with scatter-gather sendmsg, sending again what the socket did not take
+        """
+        views = [memoryview(x) for x in parts]
+        while views:
+            self._arm(min(SEND_WINDOW, sum(len(x) for x in views[:MAX_PARTS])))
+            sent = self.connSocket.sendmsg(views[:MAX_PARTS])
+            while sent:
+                if sent >= len(views[0]):
+                    sent -= len(views[0])
+                    views.pop(0)
+                else:
+                    views[0] = views[0][sent:]
+                    sent = 0
+            while views and not len(views[0]):
+                views.pop(0)
+
+    def _sendBUFFERED(self, inputFile, offset, count):
+        """
+        Send pending parts and file content by reading into a reused buffer, without allocating for each chunk\\
+        Pending parts are written with the first chunk\\
+        Return number of bytes sent
+        """
+        view = getattr(_threadBuffers, "view", None)
+        if view is None:
+            view = _threadBuffers.view = memoryview(bytearray(SEND_BUFFER_SIZE))
+        inputFile.seek(offset)
+        remaining = count
+        total = 0
+        while remaining is None or remaining > 0:
+            size = SEND_BUFFER_SIZE if remaining is None else min(SEND_BUFFER_SIZE, remaining)
+            read = inputFile.readinto(view[:size])
+            if not read: break
+            if self.pending:
+                total += self.send(view[:read])
+            else:
+                self._sendALL(view[:read])
+                total += read
+            if remaining is not None: remaining -= read
+        total += self.flush()
+        return total
@@ -0,0 +1,203 @@
+# rulematcher.py
+# implements compiled path rule matcher for authentication
+
+import os
+import re
+
+
+"""
+This class compiles glob-style path rules (as written in rules.json) into regular expressions once,
+so that a path can be checked against them without any filesystem access.
+Matching follows the same rules as glob.glob: wildcards never cross a path separator and
+wildcard segments do not match hidden names (starting with '.') unless the segment itself starts with '.'.
+"""
+class RuleMatcher:
+    def __init__(self, rootDirectory, allow, forbidden, exceptions):
+        """
+        `allow` and `forbidden` are lists of patterns,
+        `exceptions` maps a username to its list of patterns
+        """
+        self.rootDirectory = os.path.normcase(os.path.normpath(rootDirectory))
+        self.allowPatterns = self._translateAll(allow)
+        self.exceptionPatterns = {user: self._translateAll(patterns) for user, patterns in exceptions.items()}
+        self.allow = self._join(self.allowPatterns)
+        self.forbidden = self._join(self._translateAll(forbidden))
+        self.exceptions = {user: self._join(patterns) for user, patterns in self.exceptionPatterns.items()}
+
+    def match(self, path, user=None):
+        """
+        Match a path against compiled rules\\
+        Return `True` if path is allowed (by user exception or allowed paths)\\
+        Return `False` if path is forbidden\\
+        Return `None` if path is not mentioned in rules
+        """
+        relativePath = self.relative(path)
+        if relativePath is None: return None
+        if user in self.exceptions and self._search(self.exceptions[user], relativePath):
+            return True
+        if self._search(self.allow, relativePath):
+            return True
+        if self._search(self.forbidden, relativePath):
+            return False
+        return None
+
+    def permissions(self, user=None):
+        """
+        Compile permissions of a user: user exceptions and allowed paths in one expression, and forbidden paths\
+        Return `(allowed, forbidden)` compiled expressions, each `None` if empty
+        """
+        return self._join(self.exceptionPatterns.get(user, []) + self.allowPatterns), self.forbidden
+
+    def relative(self, path):
+        """
+        Convert absolute path to a '/' separated path relative to root directory\\
+        Return `None` if path is not under root directory
+        """
+        path = os.path.normcase(os.path.normpath(path))
+        prefix = os.path.join(self.rootDirectory, "")
+        if not path.startswith(prefix): return None
+        return path[len(prefix):].replace(os.sep, "/")
+
+    def _search(self, compiled, relativePath):
+        """
+        Check relative path against one compiled rule list
+        """
+        return compiled is not None and compiled.fullmatch(relativePath) is not None
+
+    def _translateAll(self, patterns):
+        """
+        Translate a list of glob patterns to regular expressions, patterns which never match are skipped
+        """
+        translated = [self._translate(pattern) for pattern in patterns]
+        return [x for x in translated if x is not None]
+
+    def _join(self, translated):
+        """
+        Compile translated patterns into a single regular expression, `None` if empty
+        """
+        if not translated: return None
+        return re.compile("|".join("(?:{})".format(x) for x in translated), re.DOTALL)
+
+    def _translate(self, pattern):
+        """
+        Translate one glob pattern to regular expression, segment by segment
+        """
+        pattern = os.path.normcase(os.path.normpath(pattern)).replace(os.sep, "/")
+        if os.path.isabs(pattern) or pattern.startswith(".."):
+            # patterns out of root directory never match a served path
+            return None
+        return "/".join(self._translateSegment(segment) for segment in pattern.split("/"))
+
+    def _translateSegment(self, segment):
+        """
+        Translate one path segment of glob pattern to regular expression
+        """
+        if not re.search(r"[*?[]", segment):
+            return re.escape(segment)
+        # glob does not match hidden names with wildcards
+        result = "" if segment.startswith(".") else r"(?!\.)"
+        i, n = 0, len(segment)
+        while i < n:
+            c = segment[i]
+            i += 1
+            if c == "*":
+                result += "[^/]*"
+            elif c == "?":
+                result += "[^/]"
+            elif c == "[":
+                j = i
+                if j < n and segment[j] == "!": j += 1
+                if j < n and segment[j] == "]": j += 1
+                while j < n and segment[j] != "]": j += 1
+                if j >= n:
+                    # no closing bracket, treat as literal
+                    result += re.escape(c)
+                else:
+                    content = segment[i:j].replace("\\", "\\\\")
+                    # escape set operations to avoid nested set warnings
+                    content = re.sub(r"([&~|[])", r"\\\1", content)
+                    i = j + 1
+                    if content.startswith("!"):
+                        content = "^/" + content[1:]
+                    elif content.startswith("^"):
+                        content = "\\" + content
+                    result += "[{}]".format(content) if content != "^/" else "[^/]"
+            else:
+                result += re.escape(c)
+        return result
+
+
+"""
+This class is the compiled permission set of one user (or of anonymous clients) for one rules snapshot.
+Allowed paths and the user's exceptions are one expression, and decisions are cached by path,
+so that checking a path already seen is a single dictionary lookup.
+"""
+class PermissionSet:
+    def __init__(self, matcher, user=None, maxCacheSize=4096):
+        self.matcher = matcher
+        self.user = user
+        self.allowed, self.forbidden = matcher.permissions(user)
+        self.maxCacheSize = maxCacheSize
+        self.decisionCache = {} # path -> decision
+
+    def decide(self, path):
+        """
+        Match a path against permissions\\
+        Return `True`, `False` or `None` as `RuleMatcher.match`
+        """
+        try:
+            return self.decisionCache[path]
+        except KeyError:
+            pass
+        relativePath = self.matcher.relative(path)
+        if relativePath is None:
+            decision = None
+        elif self.allowed is not None and self.allowed.fullmatch(relativePath) is not None:
+            decision = True
+        elif self.forbidden is not None and self.forbidden.fullmatch(relativePath) is not None:
+            decision = False
+        else:
+            decision = None
+        if len(self.decisionCache) >= self.maxCacheSize:
+            # drop oldest decision, may race with other threads doing the same
+            try:
+                self.decisionCache.pop(next(iter(self.decisionCache)), None)
+            except (RuntimeError, StopIteration):
+                pass
+        self.decisionCache[path] = decision
+        return decision
+
+
+"""
+This class is an immutable snapshot of loaded rules, with compiled matcher and permission sets built from it.
+A new snapshot is created on every reload and swapped in at once, so readers never need a lock,
+and permission sets built for previous rules are dropped with their snapshot.
+Users without exceptions share the permission set of anonymous clients.
+"""
+class RuleSet:
+    def __init__(self, rules, matcher, databasePath, handlers, maxCacheSize=4096, caches=None):
+        self.rules = rules
+        self.matcher = matcher
+        self.databasePath = databasePath
+        self.handlers = handlers # page filename -> handler script path
+        self.caches = caches or {} # page filename -> ResponseCache of its handler
+        self.maxCacheSize = maxCacheSize
+        self.permissionSets = {None: PermissionSet(matcher, None, maxCacheSize)} # user -> PermissionSet
+
+    def permissions(self, user=None):
+        """
+        Get permission set of user, built on first use
+        """
+        if user not in self.matcher.exceptions: user = None
+        permissionSet = self.permissionSets.get(user)
+        if permissionSet is None:
+            # may be built twice by racing threads, both are equal
+            permissionSet = self.permissionSets[user] = PermissionSet(self.matcher, user, self.maxCacheSize)
+        return permissionSet
+
+    def decide(self, path, user=None):
+        """
+        Match a path against rules for given user\\
+        Return `True`, `False` or `None` as `RuleMatcher.match`
+        """
+        return self.permissions(user).decide(path)
@@ -3,52 +3,134 @@
 
 from Pr0j3ct.logging import Logger
 
+import time
+import queue
+import threading
+
 """
-This class manages multiple threads for the server.
+This class manages a fixed pool of worker threads for the server.
+Runnables (objects with `run` and `stop`) are put in a bounded queue with the time they are queued,
+and picked up by the first free worker, which sets the time waited in queue as `queueWait` of the runnable.
+When the queue is full, new runnables are rejected, or the caller waits for a free slot if `reject_policy` is "block".
 """
 
 class Scheduler:
-    def __init__(self, max_threads=50):
+    def __init__(self, max_threads=50, max_queue=100, reject_policy="reject", metrics=None):
+        if reject_policy not in ("reject", "block"):
+            raise ValueError("reject_policy: {} should be 'reject' or 'block'".format(reject_policy))
         self.max_threads = max_threads
-        self.tasks = []
+        self.max_queue = max_queue
+        self.reject_policy = reject_policy
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.tasks = {} # runnables being run, by worker thread (a runnable may be queued again before its last run returned)
+        self.mutex = threading.Lock() # lock for tasks and counters
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queueWait = None
+        if metrics is not None:
+            self.queueWait = metrics.histogram("pr0j3ct_scheduler_queue_wait_seconds", "Time tasks wait in queue for a free worker")
+            metrics.gauge("pr0j3ct_scheduler_threads", "Worker threads", lambda: self.max_threads)
+            metrics.gauge("pr0j3ct_scheduler_active", "Worker threads running a task", lambda: self.active)
+            metrics.gauge("pr0j3ct_scheduler_queued", "Tasks waiting for a free worker", self.queue.qsize)
+            metrics.gauge("pr0j3ct_scheduler_completed_total", "Tasks completed", lambda: self.completed, kind="counter")
+            metrics.gauge("pr0j3ct_scheduler_rejected_total", "Tasks rejected because queue was full", lambda: self.rejected, kind="counter")
         self.logger = Logger(self.__class__.__name__)
+        self.workers = []
+        for i in range(max_threads):
+            worker = threading.Thread(target=self._work, name="SchedulerWorker-{}".format(i), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.logger.info("{} worker threads started", max_threads)
 
     def add(self, runnable):
         """
-        Add runnable class object to thread queue
-        """
-        self.logger.info("New thread {} added".format(runnable.connSocketAddress))
-        self.tasks.append(runnable)
-        self._update()
-
-    def _update(self):
-        """
-        Update thread pool
-        1. Check for dead threads and remove them
-        2. Start running new threads that are waiting
-        """
-        # get dead threads
-        to_delete = []
-        for runnable in self.tasks:
-            if not runnable.keep_alive:
-                to_delete.append(runnable)
-                self.logger.info("Dead thread {} removed".format(runnable.connSocketAddress))
-        # remove dead threads
-        for task in to_delete:
-            self.tasks.remove(task)
-        # start waiting threads, at most max_threads
-        for runnable in self.tasks[:self.max_threads]:
-            if not runnable.is_alive():
-                runnable.start()
-                self.logger.info("Thread {} started".format(runnable.connSocketAddress))
+        Add runnable class object to thread queue\\
+        Return `True` if added\\
+        Return `False` if rejected because queue is full
+        """
+        try:
+            self.queue.put((runnable, time.perf_counter()), block=(self.reject_policy == "block"))
+        except queue.Full:
+            with self.mutex:
+                self.rejected += 1
+            self.logger.warn("Queue is full, {} rejected", runnable.connSocketAddress)
+            return False
+        self.logger.info("New task {} queued", runnable.connSocketAddress)
+        return True
+
+    def backlog(self):
+        """
+        Get number of tasks beyond what free workers can start now, counting busy workers and queue together
+        """
+        with self.mutex:
+            return max(0, self.active + self.queue.qsize() - self.max_threads)
+
+    def saturated(self):
+        """
+        Check if no worker is free for a new task
+        """
+        return self.active + self.queue.qsize() >= self.max_threads
+
+    def status(self):
+        """
+        Get live counters of worker pool
+        """
+        with self.mutex:
+            return {
+                "threads": self.max_threads,
+                "active": self.active,
+                "queued": self.queue.qsize(),
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def _work(self):
+        """
+        Worker thread loop, run runnables from queue until a `None` is received
+        """
+        while True:
+            item = self.queue.get()
+            if item is None: break
+            runnable, queuedAt = item
+            waited = time.perf_counter() - queuedAt
+            runnable.queueWait = waited
+            if self.queueWait is not None:
+                self.queueWait.observe(waited)
+            with self.mutex:
+                self.active += 1
+                self.tasks[threading.get_ident()] = runnable
+            try:
+                runnable.run()
+            except Exception as e:
+                self.logger.error("Task {} failed: {}", runnable.connSocketAddress, e)
+            finally:
+                with self.mutex:
+                    self.active -= 1
+                    self.completed += 1
+                    self.tasks.pop(threading.get_ident(), None)
 
     def shutdown(self):
         """
-        Shutdown all running threads
+        Shutdown all running and queued tasks, then stop worker threads
         """
-        for runnable in self.tasks:
-            if runnable.is_alive():
-                runnable.stop()
-                runnable.join()
-                self.logger.info("Thread {} stopped".format(runnable.connSocketAddress))
-        self.logger.close()
\ No newline at end of file
+        # drop queued tasks
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None: item[0].stop()
+        # stop running tasks
+        with self.mutex:
+            running = list(self.tasks.values())
+        for runnable in running:
+            runnable.stop()
+            self.logger.info("Task {} stopped", runnable.connSocketAddress)
+        # stop workers
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.logger.info("Scheduler stopped: {}", self.status())
+        self.logger.close()
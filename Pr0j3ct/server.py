@@ -2,20 +2,39 @@
 # implements HTTP Server class
 
 from Pr0j3ct.requests import RequestProcessor
-from Pr0j3ct.logging import Logger
+from Pr0j3ct.logging import Logger, backend as logBackend
 from Pr0j3ct.scheduler import Scheduler
 from Pr0j3ct.authhandler import AuthHandler
+from Pr0j3ct.sessionstore import SessionStore, SqliteSessionStore
+from Pr0j3ct.eventloop import EventLoop
+from Pr0j3ct.connectionwatcher import ConnectionWatcher
+from Pr0j3ct.statcache import StatCache
+from Pr0j3ct.contentcache import ContentCache
+from Pr0j3ct.compression import Compressor
+from Pr0j3ct.metrics import MetricsRegistry, MetricsServer, SharedMetrics
+from Pr0j3ct.tracing import RequestTracer
+from Pr0j3ct.tls import TLSHandshaker, createServerContext
+from Pr0j3ct.admission import AdmissionController
 
 import os
 import ssl
+import signal
 import socket
+import threading
 
 
 """
-This class starts a server socket and listen for any connections and start threads for these connections.
+This class starts a server socket and listens for any connections and hands these connections to a pool of worker threads.
+In thread mode a worker runs a connection only while it has requests to handle, idle connections are watched by a `ConnectionWatcher`.
 """
 class Server:
-    def __init__(self, rootDirectory, port, indexFile="index.html", enableSSL=False):
+    def __init__(self, rootDirectory, port, indexFile="index.html", enableSSL=False, mode="thread", maxThreads=50, maxQueue=100, cacheBytes=64*1024*1024, cacheEntryBytes=1024*1024, enableCompression=True,
+                 keepAliveTimeout=15, maxRequests=100, maxBodySize=4*1024*1024*1024, metricsPath=None, metricsPort=None, metricsHost="127.0.0.1",
+                 enableTracing=False, slowRequestSeconds=1.0, slowStackSeconds=5.0, serverTiming=False,
+                 handshakeTimeout=10, sessionIdleTimeout=1800, sessionMaxAge=86400, sessionPath=None,
+                 maxConnections=0, maxConnectionsPerClient=0, shedQueue=None, retryAfter=5, listenBacklog=socket.SOMAXCONN,
+                 headerTimeout=10, requestTimeout=300, minRecvRate=500, sendTimeout=30, minSendRate=1024,
+                 metricsDirectory=None, workerName=None):
         # check arguments
         if not os.path.exists(rootDirectory):
             raise ValueError("rootDirectory: {} not found".format(rootDirectory))
@@ -26,56 +45,153 @@ class Server:
         if not os.path.isfile(os.path.join(self.rootDirectory, indexFile)):
             raise ValueError("indexFile: {} is not found under {}".format(indexFile, self.rootDirectory))
         self.indexFile = indexFile
+        if mode not in ("thread", "eventloop"):
+            raise ValueError("mode: {} should be 'thread' or 'eventloop'".format(mode))
+        self.mode = mode
+        self.keepAliveTimeout = keepAliveTimeout
+        self.maxRequests = maxRequests
+        self.maxBodySize = maxBodySize
+        # deadlines of slow clients, see RequestProcessor
+        self.deadlines = dict(headerTimeout=headerTimeout, requestTimeout=requestTimeout, minRecvRate=minRecvRate,
+                              sendTimeout=sendTimeout, minSendRate=minSendRate)
+        if metricsPort is not None and (metricsPort > 65535 or metricsPort < 0 or metricsPort == port):
+            raise ValueError("metricsPort: {} should be in [0,65535] and differ from port".format(metricsPort))
         # initialize variables
-        self.scheduler = Scheduler()
+        self.metrics = MetricsRegistry()
+        # in a worker process, metrics are shared with other workers through snapshot files
+        self.sharedMetrics = SharedMetrics(self.metrics, metricsDirectory, workerName or "worker") if metricsDirectory else None
+        # metrics are served on their own port if given, else on a path of website if given, to any client
+        self.metricsServer = MetricsServer(self.metrics, metricsPort, metricsPath or "/metrics", metricsHost) if metricsPort is not None else None
+        self.metricsPath = metricsPath if metricsPort is None else None
+        self.connectionsTotal = self.metrics.counter("pr0j3ct_connections_total", "Client connections accepted")
+        connectionsClosed = self.metrics.counter("pr0j3ct_connections_closed_total", "Client connections closed")
+        self.metrics.gauge("pr0j3ct_connections_open", "Client connections open", lambda: self.connectionsTotal.value() - connectionsClosed.value())
+        self.scheduler = Scheduler(max_threads=maxThreads, max_queue=maxQueue, metrics=self.metrics)
+        # by default, load is shed once scheduler queue is full
+        self.admission = AdmissionController(maxConnections, maxConnectionsPerClient, maxQueue if shedQueue is None else shedQueue,
+                                             retryAfter, metrics=self.metrics)
+        # connections waiting for their next request in thread mode
+        self.watcher = None
+        if self.mode == "thread":
+            self.watcher = ConnectionWatcher(self.scheduler, self.admission)
+            self.metrics.gauge("pr0j3ct_connections_parked", "Idle connections of thread mode watched without a worker", lambda: len(self.watcher.parked))
+        self.listenBacklog = listenBacklog
+        self.statCache = StatCache()
+        self.contentCache = ContentCache(maxBytes=cacheBytes, maxEntrySize=cacheEntryBytes) if cacheBytes > 0 else None
+        self.compressor = Compressor() if enableCompression else None
+        if self.contentCache:
+            self.metrics.gauge("pr0j3ct_content_cache_entries", "Files in content cache", lambda: self.contentCache.stats()["entries"])
+            self.metrics.gauge("pr0j3ct_content_cache_bytes", "Bytes of files in content cache", lambda: self.contentCache.stats()["bytes"])
+            for name in ("hits", "misses", "evictions"):
+                self.metrics.gauge("pr0j3ct_content_cache_{}_total".format(name), "Content cache {}".format(name),
+                                   lambda name=name: self.contentCache.stats()[name], kind="counter")
+        self.metrics.gauge("pr0j3ct_stat_cache_entries", "Paths in stat cache", lambda: len(self.statCache.entries))
+        self.tracer = RequestTracer(enableTracing, slowRequestSeconds, slowStackSeconds, serverTiming, metrics=self.metrics)
         self.logger = Logger(self.__class__.__name__)
         # log information
-        self.logger.info("Server port: {}".format(self.port))
-        self.logger.info("Server document root: {}".format(self.rootDirectory))
+        self.logger.info("Server port: {}", self.port)
+        self.logger.info("Server document root: {}", self.rootDirectory)
+        self.logger.info("Server mode: {}", self.mode)
         # load authentication handler
-        self.authHandler = AuthHandler(self.rootDirectory)
+        # sessions are kept in memory, or in a database file shared by worker processes
+        if sessionPath:
+            sessionStore = SqliteSessionStore(sessionPath, idleTimeout=sessionIdleTimeout, maxAge=sessionMaxAge)
+        else:
+            sessionStore = SessionStore(idleTimeout=sessionIdleTimeout, maxAge=sessionMaxAge)
+        self.authHandler = AuthHandler(self.rootDirectory, metrics=self.metrics, sessionStore=sessionStore)
         # try to load SSL certificate
         self.SSL_cert_file = os.path.join("certificates", "signed.crt")
         self.SSL_key_file = os.path.join("certificates", "signed.private.key")
         if os.path.isfile(self.SSL_cert_file) and os.path.isfile(self.SSL_key_file) and enableSSL:
-            self.SSL_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            self.SSL_context.load_cert_chain(self.SSL_cert_file, self.SSL_key_file)
+            self.SSL_context = createServerContext(self.SSL_cert_file, self.SSL_key_file)
+            self.handshaker = TLSHandshaker(self.SSL_context, handshakeTimeout, metrics=self.metrics)
             self.SSL_enabled = True
             self.logger.info("Server SSL enabled")
         else:
             self.SSL_context = None
+            self.handshaker = None
             self.SSL_cert_file = ""
             self.SSL_key_file = ""
             self.SSL_enabled = False
         
         if self.SSL_enabled:
-            self.logger.info("Website address is: https://{}:{}".format("localhost", self.port))
+            self.logger.info("Website address is: https://{}:{}", "localhost", self.port)
         else:
-            self.logger.info("Website address is: http://{}:{}".format("localhost", self.port))
+            self.logger.info("Website address is: http://{}:{}", "localhost", self.port)
 
 
-    def start(self):
+    def start(self, serversocket=None, reusePort=False):
+        """
+        Serve until interrupted, on given listening socket (inherited from supervisor process) or on a new one\
+        With `reusePort`, the new socket shares the port with sockets of other worker processes (SO_REUSEPORT)
+        """
         # create server socket
         try:
-            serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            serversocket.bind(("", self.port))
-            serversocket.listen(5)
+            if serversocket is None:
+                serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                if reusePort:
+                    serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                serversocket.bind(("", self.port))
+                serversocket.listen(self.listenBacklog)
             serversocket.settimeout(1)
         except socket.error as e:
-            self.logger.error("{}".format(e))
+            self.logger.error("{}", e)
             return
         self.logger.info("Server started")
+        if self.sharedMetrics:
+            self.sharedMetrics.start()
+        if self.metricsServer:
+            try:
+                self.metricsServer.start()
+            except OSError as e:
+                self.logger.error("Failed to start metrics server: {}", e)
+                self.metricsServer = None
+        elif self.metricsPath:
+            self.logger.info("Metrics served at {}", self.metricsPath)
+        # switch request tracing on and off at runtime: kill -USR2 <pid>
+        # signal handlers can only be set by main thread, a server started by another thread is not toggled by signal
+        if hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.tracer.toggle())
+        if self.mode == "eventloop":
+            self._startEventLoop(serversocket)
+        else:
+            self._startThreads(serversocket)
+
+    def _createProcessor(self, clientsocket, clientaddress):
+        """
+        Create request processor for a client connection
+        """
+        self.connectionsTotal.inc()
+        return RequestProcessor(self.rootDirectory, self.indexFile, clientsocket, clientaddress, self.authHandler, self.statCache, self.contentCache, self.compressor,
+                                self.keepAliveTimeout, self.maxRequests, self.maxBodySize, self.metrics, self.metricsPath, self.tracer,
+                                self.handshaker, self.admission, watcher=self.watcher, **self.deadlines)
+
+    def _startThreads(self, serversocket):
+        """
+        Accept connections and queue each connection as a task for the worker thread pool\
+        A connection waiting for its next request is parked in watcher and queued again once data arrives
+        """
+        self.watcher.start()
         # start listening
         try:
             while True:
                 try:
                     clientsocket, clientaddress = serversocket.accept()
                     clientaddress = "{}:{}".format(clientaddress[0], clientaddress[1])
+                    # each connection is a task, so shed new connections once busy workers and queue hold too many
+                    reason = self.admission.admit(clientaddress, self.scheduler.backlog())
+                    if reason:
+                        self.admission.shed(clientsocket, clientaddress, reason)
+                        continue
                     if self.SSL_enabled:
-                        clientsocket = self.SSL_context.wrap_socket(clientsocket, server_side=True)
-                    self.logger.info("Client connected: {}".format(clientaddress))
-                    processor = RequestProcessor(self.rootDirectory, self.indexFile, clientsocket, clientaddress, self.authHandler)
-                    self.scheduler.add(processor)
+                        # handshake is done by worker thread
+                        clientsocket = self.handshaker.wrap(clientsocket)
+                    self.logger.info("Client connected: {}", clientaddress)
+                    processor = self._createProcessor(clientsocket, clientaddress)
+                    if not self.scheduler.add(processor):
+                        # scheduler queue is full
+                        self.admission.shed(clientsocket, clientaddress, "queue")
+                        processor.stop()
                 except socket.timeout: pass
                 except ssl.SSLError as e:
                     # ignore HTTP request error in HTTPS mode
@@ -85,7 +201,41 @@ class Server:
         except KeyboardInterrupt:
             # on keyboard interrupt, close server and all running sub-threads
             self.logger.info("Server stopped")
+            self.watcher.stop()
+            self.scheduler.shutdown()
+            self._shutdown(serversocket)
+
+    def _startEventLoop(self, serversocket):
+        """
+        Serve all connections with a single-threaded event loop and a pool of worker threads
+        """
+        eventLoop = EventLoop(serversocket, self._createProcessor, self.scheduler, self.handshaker, self.admission)
+        self.metrics.gauge("pr0j3ct_eventloop_pending", "Requests received by event loop, waiting to be handed to scheduler", lambda: len(eventLoop.pending))
+        try:
+            eventLoop.run()
+        except KeyboardInterrupt:
+            # on keyboard interrupt, close server and all connections
+            self.logger.info("Server stopped")
+            eventLoop.stop()
             self.scheduler.shutdown()
-            self.authHandler.shutdown()
-            self.logger.close()
-            serversocket.close()
\ No newline at end of file
+            self._shutdown(serversocket)
+
+    def _shutdown(self, serversocket):
+        """
+        Save information and close server socket
+        """
+        if self.metricsServer:
+            self.metricsServer.stop()
+        if self.sharedMetrics:
+            self.sharedMetrics.stop()
+        self.tracer.stop()
+        if self.contentCache:
+            self.logger.info("Content cache: {}", self.contentCache.stats())
+        if self.handshaker:
+            self.logger.info("TLS handshakes: {}", self.handshaker.stats())
+        self.logger.info("Admission: {}", self.admission.stats())
+        self.authHandler.shutdown()
+        self.logger.close()
+        serversocket.close()
+        # write all queued log messages
+        logBackend.flush()
@@ -0,0 +1,158 @@
+# sessionstore.py
+# implements concurrent stores for user sessions, in memory or shared by processes
+
+import json
+import time
+import sqlite3
+import secrets
+import threading
+
+
+def newToken():
+    """
+    Generate a random session token for a cookie
+    """
+    return secrets.token_urlsafe(32)
+
+
+"""
+This class stores user sessions by token in several stripes, each guarded by its own lock.
+A session expires when not used for `idleTimeout` seconds, or `maxAge` seconds after it is created.
+Reads never take a lock, writes only lock the stripe of the given key.
+Expired sessions are dropped when read, and one stripe is swept on every write, so eviction cost is spread over writes.
+"""
+class SessionStore:
+    def __init__(self, stripes=16, idleTimeout=1800, maxAge=86400):
+        self.stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        self.idleTimeout = idleTimeout
+        self.maxAge = maxAge
+        self.nextSweep = 0 # index of stripe swept on next write
+
+    def _stripe(self, key):
+        """
+        Get (dictionary, lock) stripe of key
+        """
+        return self.stripes[hash(key) % len(self.stripes)]
+
+    def _expired(self, entry, now):
+        """
+        Check if [value, created, lastSeen] entry is expired
+        """
+        return now - entry[2] > self.idleTimeout or now - entry[1] > self.maxAge
+
+    def get(self, key, default=None):
+        """
+        Get session value of key, and mark session as used
+        """
+        sessions, lock = self._stripe(key)
+        entry = sessions.get(key)
+        if entry is None: return default
+        now = time.monotonic()
+        if self._expired(entry, now):
+            with lock:
+                if sessions.get(key) is entry: del sessions[key]
+            return default
+        entry[2] = now
+        return entry[0]
+
+    def set(self, key, value):
+        """
+        Set session value of key, as a new session
+        """
+        now = time.monotonic()
+        sessions, lock = self._stripe(key)
+        with lock:
+            sessions[key] = [value, now, now]
+        self._sweep(now)
+
+    def delete(self, key):
+        """
+        Remove session of key
+        """
+        sessions, lock = self._stripe(key)
+        with lock:
+            sessions.pop(key, None)
+
+    def _sweep(self, now):
+        """
+        Drop expired sessions of next stripe
+        """
+        index = self.nextSweep
+        self.nextSweep = (index + 1) % len(self.stripes)
+        sessions, lock = self.stripes[index]
+        with lock:
+            for key in [key for key, entry in sessions.items() if self._expired(entry, now)]:
+                del sessions[key]
+
+    def __len__(self):
+        return sum(len(sessions) for sessions, _ in self.stripes)
+
+
+"""
+This class stores user sessions by token in a SQLite database file, shared by all worker processes of the server so
+that a login on one process is seen by all others. Sessions expire like in `SessionStore`.
+Each thread uses its own connection, the database is in WAL mode so reads never wait for writes.
+Last use of a session is only written when it changed noticeably, and expired sessions are deleted at most once per
+`sweepInterval` seconds, on write.
+Sessions are not kept across server restarts, the file only needs to outlive worker processes.
+"""
+class SqliteSessionStore:
+    def __init__(self, path, idleTimeout=1800, maxAge=86400, sweepInterval=60):
+        self.path = path
+        self.idleTimeout = idleTimeout
+        self.maxAge = maxAge
+        self.sweepInterval = sweepInterval
+        self.lastSweep = 0
+        self.local = threading.local()
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, value TEXT, created REAL, lastSeen REAL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS sessions_lastSeen ON sessions (lastSeen)")
+
+    def _connection(self):
+        """
+        Get database connection of current thread
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # sessions do not need to survive a power loss
+            connection.execute("PRAGMA synchronous=OFF")
+        return connection
+
+    def get(self, key, default=None):
+        """
+        Get session value of key, and mark session as used
+        """
+        # wall clock time, as sessions are shared by processes
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute("SELECT value, lastSeen FROM sessions WHERE key = ? AND lastSeen >= ? AND created >= ?",
+                                 (str(key), now - self.idleTimeout, now - self.maxAge)).fetchone()
+        if row is None: return default
+        if now - row[1] > min(60, self.idleTimeout / 10):
+            connection.execute("UPDATE sessions SET lastSeen = ? WHERE key = ?", (now, str(key)))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Set session value of key, as a new session
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO sessions (key, value, created, lastSeen) VALUES (?, ?, ?, ?)",
+                           (str(key), json.dumps(value), now, now))
+        if now - self.lastSweep > self.sweepInterval:
+            self.lastSweep = now
+            connection.execute("DELETE FROM sessions WHERE lastSeen < ? OR created < ?", (now - self.idleTimeout, now - self.maxAge))
+
+    def delete(self, key):
+        """
+        Remove session of key
+        """
+        self._connection().execute("DELETE FROM sessions WHERE key = ?", (str(key),))
+
+    def __len__(self):
+        now = time.time()
+        return self._connection().execute("SELECT COUNT(*) FROM sessions WHERE lastSeen >= ? AND created >= ?",
+                                          (now - self.idleTimeout, now - self.maxAge)).fetchone()[0]
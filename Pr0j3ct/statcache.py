@@ -0,0 +1,43 @@
+# statcache.py
+# implements short-lived cache of file stat results
+
+import os
+import time
+
+
+"""
+This class caches `os.stat` results of files for a short time, shared by all request processors.
+Validators (ETag, Last-Modified) and existence checks of hot files are then answered without disk access.
+"""
+class StatCache:
+    def __init__(self, ttl=1.0, maxEntries=4096):
+        self.ttl = ttl # seconds a stat result is trusted
+        self.maxEntries = maxEntries
+        self.entries = {} # path -> (expire time, stat result or None if not found)
+
+    def stat(self, path):
+        """
+        Get stat result of path\\
+        Return `None` if path does not exist
+        """
+        now = time.monotonic()
+        entry = self.entries.get(path)
+        if entry and entry[0] > now: return entry[1]
+        try:
+            result = os.stat(path)
+        except OSError:
+            result = None
+        if len(self.entries) >= self.maxEntries:
+            # drop oldest entry, may race with other threads doing the same
+            try:
+                self.entries.pop(next(iter(self.entries)), None)
+            except (RuntimeError, StopIteration):
+                pass
+        self.entries[path] = (now + self.ttl, result)
+        return result
+
+    def invalidate(self, path):
+        """
+        Remove cached stat result of path
+        """
+        self.entries.pop(path, None)
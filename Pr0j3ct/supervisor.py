@@ -0,0 +1,248 @@
+# supervisor.py
+# implements pre-fork Supervisor class running the server in several worker processes
+
+from Pr0j3ct.server import Server
+from Pr0j3ct.logging import Logger, FORWARD_DATAGRAM_SIZE, backend as logBackend
+from Pr0j3ct.metrics import MetricsRegistry, MetricsServer, SharedMetrics
+
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import traceback
+
+
+"""
+This class starts `workers` processes each running a complete `Server`, so that requests are served by all CPU cores.
+Workers share the listening port with SO_REUSEPORT (each has its own socket, connections are balanced by the kernel),
+or accept from one socket inherited from the supervisor where SO_REUSEPORT is not available.
+Crashed workers are restarted, with a growing delay if they keep crashing right after start.
+Workers share user sessions in a SQLite file, send their log lines to the supervisor which writes the single log file,
+and share metrics through snapshot files so that any worker (and the supervisor on `metricsPort`) serves the totals.
+"""
+class Supervisor:
+    def __init__(self, workers, serverOptions, metricsPort=None, metricsHost="127.0.0.1"):
+        """
+        `serverOptions` are keyword arguments of `Server` for each worker
+        """
+        if workers < 1:
+            raise ValueError("workers: {} should be at least 1".format(workers))
+        if not hasattr(os, "fork"):
+            raise ValueError("workers: multiple worker processes are not supported on this platform")
+        self.workers = workers
+        self.serverOptions = serverOptions
+        self.port = serverOptions["port"]
+        self.metricsPort = metricsPort
+        self.metricsHost = metricsHost
+        self.reusePort = hasattr(socket, "SO_REUSEPORT")
+        self.children = {} # pid -> worker index
+        self.startedAt = {} # worker index -> time started
+        self.restartAt = {} # worker index -> time to restart crashed worker
+        self.backoff = {} # worker index -> delay before next restart
+        self.running = False
+        self.serverSocket = None
+        self.metricsServer = None
+        self.logger = Logger(self.__class__.__name__)
+
+    def run(self):
+        """
+        Start workers and supervise them until interrupted
+        """
+        self.stateDirectory = tempfile.mkdtemp(prefix="pr0j3ct-")
+        self.sessionPath = os.path.join(self.stateDirectory, "sessions.sqlite")
+        self.metricsDirectory = os.path.join(self.stateDirectory, "metrics")
+        os.makedirs(self.metricsDirectory)
+        if not self.reusePort:
+            try:
+                self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.serverSocket.bind(("", self.port))
+                self.serverSocket.listen(self.serverOptions.get("listenBacklog", socket.SOMAXCONN))
+            except socket.error as e:
+                self.logger.error("{}", e)
+                shutil.rmtree(self.stateDirectory, ignore_errors=True)
+                return
+        # workers send log lines to this socket
+        self.logReader, self.logWriter = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.logReader.settimeout(0.5)
+        # supervisor metrics, merged with those of workers
+        self.metrics = MetricsRegistry()
+        self.restarts = self.metrics.counter("pr0j3ct_worker_restarts_total", "Worker processes restarted after exiting")
+        self.metrics.gauge("pr0j3ct_workers", "Worker processes running", lambda: len(self.children))
+        self.sharedMetrics = SharedMetrics(self.metrics, self.metricsDirectory, "supervisor")
+        self.sharedMetrics.start()
+        self.running = True
+        receiver = threading.Thread(target=self._receiveLOGS, name="LogReceiver", daemon=True)
+        receiver.start()
+        signal.signal(signal.SIGTERM, self._interrupt)
+        if hasattr(signal, "SIGUSR2"):
+            # forward tracing toggle to workers
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self._signalWORKERS(signal.SIGUSR2))
+        self.logger.info("Starting {} worker processes on port {} ({})", self.workers, self.port,
+                         "SO_REUSEPORT" if self.reusePort else "shared socket")
+        for i in range(self.workers):
+            self._spawn(i)
+        if self.metricsPort is not None:
+            try:
+                self.metricsServer = MetricsServer(self.metrics, self.metricsPort, self.serverOptions.get("metricsPath") or "/metrics", self.metricsHost)
+                self.metricsServer.start()
+            except OSError as e:
+                self.logger.error("Failed to start metrics server: {}", e)
+                self.metricsServer = None
+        try:
+            while True:
+                self._reap()
+                self._restart()
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            self.logger.info("Supervisor stopping")
+            self._shutdown()
+            receiver.join(5)
+            self.logReader.close()
+            self.logWriter.close()
+            shutil.rmtree(self.stateDirectory, ignore_errors=True)
+            logBackend.flush()
+
+    def _interrupt(self, signum, frame):
+        """
+        Stop on SIGTERM like on keyboard interrupt
+        """
+        raise KeyboardInterrupt()
+
+    def _spawn(self, index):
+        """
+        Fork worker process of given index
+        """
+        name = "worker-{}".format(index)
+        try:
+            pid = os.fork()
+        except OSError as e:
+            self.logger.error("Failed to start {}: {}", name, e)
+            self.restartAt[index] = time.monotonic() + self._nextBACKOFF(index)
+            return
+        if pid:
+            self.children[pid] = index
+            self.startedAt[index] = time.monotonic()
+            self.logger.info("Worker {} started, pid {}", name, pid)
+            return
+        # worker process, never returns
+        code = 1
+        try:
+            # keyboard interrupts only reach supervisor, which stops workers one by one
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # threads of supervisor do not exist here
+            logBackend.reset()
+            logBackend.configure(name=name, forward=self.logWriter)
+            self.logReader.close()
+            if self.metricsServer and self.metricsServer.httpServer:
+                self.metricsServer.httpServer.socket.close()
+            server = Server(**self.serverOptions, sessionPath=self.sessionPath, metricsDirectory=self.metricsDirectory, workerName=name)
+            server.start(self.serverSocket, reusePort=self.reusePort)
+            code = 0
+        except KeyboardInterrupt:
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                logBackend.shutdown()
+                sys.stdout.flush()
+            finally:
+                os._exit(code)
+
+    def _nextBACKOFF(self, index):
+        """
+        Get delay before restarting a worker, doubled while it keeps crashing within 10 seconds after start
+        """
+        delay = self.backoff.get(index, 0.5)
+        if time.monotonic() - self.startedAt.get(index, 0) < 10:
+            delay = min(delay * 2, 30)
+        else:
+            delay = 1
+        self.backoff[index] = delay
+        return delay
+
+    def _reap(self):
+        """
+        Collect exited workers and schedule their restart
+        """
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0: return
+            index = self.children.pop(pid, None)
+            if index is None: continue
+            if os.WIFSIGNALED(status):
+                reason = "killed by signal {}".format(os.WTERMSIG(status))
+            else:
+                reason = "exited with code {}".format(os.WEXITSTATUS(status))
+            if not self.running: continue
+            delay = self._nextBACKOFF(index)
+            self.logger.warn("Worker worker-{} (pid {}) {}, restarting in {:.1f}s", index, pid, reason, delay)
+            self.restartAt[index] = time.monotonic() + delay
+
+    def _restart(self):
+        """
+        Restart crashed workers whose delay is over
+        """
+        now = time.monotonic()
+        for index, restartAt in list(self.restartAt.items()):
+            if now < restartAt: continue
+            del self.restartAt[index]
+            self.restarts.inc()
+            self._spawn(index)
+
+    def _signalWORKERS(self, signum):
+        """
+        Send signal to all workers
+        """
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _shutdown(self, timeout=15):
+        """
+        Stop workers gracefully, kill those still running after timeout
+        """
+        self.running = False
+        self._signalWORKERS(signal.SIGINT)
+        deadline = time.monotonic() + timeout
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        if self.children:
+            self.logger.warn("Workers {} did not stop, killed", list(self.children))
+            self._signalWORKERS(signal.SIGKILL)
+            while self.children:
+                self._reap()
+                time.sleep(0.1)
+        if self.metricsServer:
+            self.metricsServer.stop()
+        self.sharedMetrics.stop()
+        if self.serverSocket is not None:
+            self.serverSocket.close()
+        self.logger.info("Supervisor stopped")
+
+    def _receiveLOGS(self):
+        """
+        Log receiver thread loop, pass lines of workers to log backend until supervisor stops
+        """
+        while True:
+            try:
+                data = self.logReader.recv(FORWARD_DATAGRAM_SIZE)
+            except socket.timeout:
+                # stop once all lines of stopped workers are read
+                if not (self.running or self.children): break
+                continue
+            except OSError:
+                break
+            logBackend.putLINES(data.decode("utf-8", errors="replace"))
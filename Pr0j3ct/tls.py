@@ -0,0 +1,107 @@
+# tls.py
+# implements TLS context configuration and handshakes of client connections
+
+from Pr0j3ct.logging import Logger
+
+import ssl
+import time
+import socket
+
+
+# TLS 1.2 cipher suites, forward secret AEAD only (TLS 1.3 suites are always modern)
+CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20:DHE+AESGCM:DHE+CHACHA20:!aNULL:!eNULL:!MD5:!DSS"
+
+# number of TLS 1.3 session tickets sent after a full handshake
+SESSION_TICKETS = 2
+
+
+def createServerContext(certFile, keyFile):
+    """
+    Create server TLS context: TLS 1.2 or newer, forward secret ciphers chosen by server,
+    and session resumption by session cache and tickets so that returning clients skip the full handshake
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(CIPHERS)
+    context.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_SINGLE_ECDH_USE
+    # session tickets are on unless disabled
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = SESSION_TICKETS
+    context.load_cert_chain(certFile, keyFile)
+    return context
+
+
+"""
+This class does TLS handshakes of accepted connections outside of the accept loop, with a timeout,
+and counts full, resumed and failed handshakes with their duration.
+Sockets are wrapped without any I/O by `wrap`, then the handshake is done by a worker thread (`handshake`)
+or step by step by the event loop, which reports the result with `done` or `failed`.
+"""
+class TLSHandshaker:
+    def __init__(self, context, timeout=10, metrics=None):
+        self.context = context
+        self.timeout = timeout # max seconds to wait for client during handshake
+        self.counts = {"full": 0, "resumed": 0, "failed": 0, "timeout": 0}
+        self.metrics = metrics
+        if metrics is not None:
+            self.handshakes = metrics.counter("pr0j3ct_tls_handshakes_total", "TLS handshakes, by result (full, resumed, failed, timeout)", ("result",))
+            self.handshakeDuration = metrics.histogram("pr0j3ct_tls_handshake_duration_seconds", "Time of successful TLS handshakes", ("result",))
+        self.logger = Logger(self.__class__.__name__)
+
+    def wrap(self, connSocket):
+        """
+        Wrap accepted socket, handshake is not started
+        """
+        return self.context.wrap_socket(connSocket, server_side=True, do_handshake_on_connect=False)
+
+    def handshake(self, connSocket, connSocketAddress):
+        """
+        Do handshake on blocking socket, waiting at most `timeout` seconds for each step\\
+        Return `True` if success\\
+        Return `False` if handshake failed or timed out
+        """
+        start = time.perf_counter()
+        try:
+            connSocket.settimeout(self.timeout)
+            connSocket.do_handshake()
+        except socket.timeout:
+            self.failed(connSocketAddress, start, "timeout")
+            return False
+        except (ssl.SSLError, OSError) as e:
+            self.failed(connSocketAddress, start, "failed", e)
+            return False
+        self.done(connSocket, connSocketAddress, start)
+        return True
+
+    def done(self, connSocket, connSocketAddress, start):
+        """
+        Record successful handshake started at `start` (`time.perf_counter`)
+        """
+        result = "resumed" if connSocket.session_reused else "full"
+        self.counts[result] += 1
+        if self.metrics is not None:
+            self.handshakes.inc(1, (result,))
+            self.handshakeDuration.observe(time.perf_counter() - start, (result,))
+        self.logger.debug("Handshake with {} {} in {:.1f}ms: {} {}", connSocketAddress, result, (time.perf_counter() - start) * 1000,
+                          connSocket.version(), connSocket.cipher()[0])
+
+    def failed(self, connSocketAddress, start, result, error=None):
+        """
+        Record failed handshake, `result` is "failed" or "timeout"
+        """
+        self.counts[result] += 1
+        if self.metrics is not None:
+            self.handshakes.inc(1, (result,))
+        if result == "timeout":
+            self.logger.warn("Handshake with {} timed out after {:.1f}s", connSocketAddress, time.perf_counter() - start)
+        else:
+            self.logger.warn("Handshake with {} failed: {}", connSocketAddress, error)
+
+    def stats(self):
+        """
+        Get handshake counts and rate of resumed sessions among successful handshakes
+        """
+        stats = dict(self.counts)
+        succeeded = stats["full"] + stats["resumed"]
+        stats["resumption_rate"] = round(stats["resumed"] / succeeded, 3) if succeeded else 0.0
+        return stats
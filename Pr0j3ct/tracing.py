@@ -0,0 +1,185 @@
+# tracing.py
+# implements per-request phase timing and slow request tracing
+
+from Pr0j3ct.logging import Logger
+
+import sys
+import time
+import threading
+import traceback
+import contextlib
+
+
+# phases of a request, in the order they are reported
+PHASES = ("queue", "parse", "auth", "form", "handler", "send")
+
+# context used for phases of requests which are not traced, so that instrumented code costs nearly nothing
+NO_PHASE = contextlib.nullcontext()
+
+
+"""
+This class measures the time of one phase of a traced request, used as a context manager.
+"""
+class _Phase:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+
+
+"""
+This class records the time spent in each phase of one request, from monotonic timestamps.
+Time not spent in a measured phase (checking files, building headers...) is reported as "other".
+"""
+class RequestTrace:
+    __slots__ = ("method", "target", "client", "thread", "threadName", "start", "phases", "stackLogged")
+
+    def __init__(self, method, target, client):
+        self.method = method
+        self.target = target
+        self.client = client
+        self.thread = threading.get_ident()
+        self.threadName = threading.current_thread().name
+        self.start = time.perf_counter()
+        self.phases = {} # phase name -> seconds
+        self.stackLogged = False
+
+    def add(self, name, duration):
+        """
+        Add time spent in a phase
+        """
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def phase(self, name):
+        """
+        Get context measuring time spent in a phase
+        """
+        return _Phase(self, name)
+
+    def elapsed(self):
+        """
+        Get seconds since request handling started, time waited in queue and parsing not included
+        """
+        return time.perf_counter() - self.start
+
+    def breakdown(self):
+        """
+        Return list of (phase, seconds) including "other" and "total", total includes time waited in queue
+        """
+        elapsed = self.elapsed()
+        queued = self.phases.get("queue", 0.0) + self.phases.get("parse", 0.0)
+        items = [(name, self.phases[name]) for name in PHASES if name in self.phases]
+        measured = sum(value for name, value in items if name not in ("queue", "parse"))
+        items.append(("other", max(0.0, elapsed - measured)))
+        items.append(("total", elapsed + queued))
+        return items
+
+    def serverTiming(self):
+        """
+        Get Server-Timing header value of phases finished so far, durations in milliseconds
+        """
+        return ", ".join("{};dur={:.3f}".format(name, value * 1000) for name, value in self.breakdown())
+
+
+"""
+This class traces requests when enabled: phases of each request are timed, requests slower than `slowThreshold` seconds
+are logged with their phase breakdown, and a watchdog thread logs the stack of the thread handling a request which runs
+for longer than `stackThreshold` seconds, while it is still running.
+Tracing is switched on and off at runtime with `toggle`, when disabled requests are not traced at all.
+"""
+class RequestTracer:
+    def __init__(self, enabled=False, slowThreshold=1.0, stackThreshold=5.0, serverTiming=False, metrics=None):
+        self.enabled = False
+        self.slowThreshold = slowThreshold
+        self.stackThreshold = stackThreshold # 0 to never capture stacks
+        self.serverTiming = serverTiming # add Server-Timing header to traced responses
+        self.active = {} # thread id -> trace of request being handled
+        self.mutex = threading.Lock() # lock for active traces
+        self.watchdog = None
+        self.stopEvent = threading.Event()
+        self.metrics = metrics
+        if metrics is not None:
+            self.phaseDuration = metrics.histogram("pr0j3ct_request_phase_seconds", "Time spent in each phase of traced requests", ("phase",))
+            self.slowRequests = metrics.counter("pr0j3ct_slow_requests_total", "Traced requests slower than slow request threshold")
+        self.logger = Logger(self.__class__.__name__)
+        if enabled: self.enable(True)
+
+    def enable(self, enabled):
+        """
+        Switch tracing on or off, watchdog is started the first time tracing is enabled
+        """
+        self.enabled = enabled
+        if enabled and self.stackThreshold and self.watchdog is None:
+            self.watchdog = threading.Thread(target=self._watch, name="RequestWatchdog", daemon=True)
+            self.watchdog.start()
+        self.logger.info("Request tracing {}", "enabled" if enabled else "disabled")
+
+    def toggle(self):
+        """
+        Switch tracing on if off, off if on (called on SIGUSR2)
+        """
+        self.enable(not self.enabled)
+
+    def begin(self, method, target, client):
+        """
+        Start tracing a request handled by current thread\\
+        Return `RequestTrace`, or `None` if tracing is disabled
+        """
+        if not self.enabled: return None
+        trace = RequestTrace(method, target, client)
+        with self.mutex:
+            self.active[trace.thread] = trace
+        return trace
+
+    def finish(self, trace):
+        """
+        Stop tracing a request, log it if slow
+        """
+        with self.mutex:
+            if self.active.get(trace.thread) is trace: del self.active[trace.thread]
+        breakdown = trace.breakdown()
+        total = breakdown[-1][1]
+        if self.metrics is not None:
+            for name, value in breakdown:
+                self.phaseDuration.observe(value, (name,))
+        if total < self.slowThreshold: return
+        if self.metrics is not None: self.slowRequests.inc()
+        self.logger.warn("Slow request {} {} from {}: {}", trace.method, trace.target, trace.client,
+                         ", ".join("{} {:.1f}ms".format(name, value * 1000) for name, value in breakdown))
+
+    def stop(self):
+        """
+        Stop watchdog thread
+        """
+        self.stopEvent.set()
+        if self.watchdog is not None:
+            self.watchdog.join(5)
+            self.watchdog = None
+
+    def _watch(self):
+        """
+        Watchdog thread loop, log stack of threads handling a request for longer than `stackThreshold`
+        """
+        interval = min(1.0, self.stackThreshold / 2)
+        while not self.stopEvent.wait(interval):
+            if not self.enabled: continue
+            with self.mutex:
+                traces = [x for x in self.active.values() if not x.stackLogged and x.elapsed() >= self.stackThreshold]
+            if not traces: continue
+            frames = sys._current_frames()
+            for trace in traces:
+                trace.stackLogged = True
+                frame = frames.get(trace.thread)
+                if frame is None: continue
+                self.logger.warn("Request {} {} from {} running for {:.1f}s, phases so far: {}\nStack of {}:\n{}",
+                                 trace.method, trace.target, trace.client, trace.elapsed(),
+                                 ", ".join("{} {:.1f}ms".format(name, value * 1000) for name, value in trace.phases.items()),
+                                 trace.threadName, "".join(traceback.format_stack(frame)).rstrip())
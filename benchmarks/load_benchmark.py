@@ -0,0 +1,414 @@
+# This file runs end-to-end load scenarios against the server and reports throughput and latency as JSON
+# a document root is generated in a temporary directory, and for each scenario the server is started
+# as a subprocess (main.py) on localhost and loaded by asyncio clients running in several processes
+#
+# run from repository root:
+#   python benchmarks/load_benchmark.py [--duration 10] [--scenarios small-get-10,head-10] [--output result.json]
+#   python benchmarks/load_benchmark.py --list
+# TLS scenarios need certificates/signed.crt and certificates/signed.private.key (see gencert.py),
+# or the openssl command to create a temporary self-signed certificate, they are skipped otherwise.
+
+import os
+import sys
+import ssl
+import json
+import time
+import shutil
+import socket
+import signal
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SSL_CERT_FILE = os.path.join("certificates", "signed.crt")
+SSL_KEY_FILE = os.path.join("certificates", "signed.private.key")
+
+SMALL_FILES = 100 # number of small files in generated root
+RULE_DIRECTORIES = 500 # directories with one rule each in rule-heavy rules.json
+RULE_FILES = 4 # files in each directory of rule-heavy root
+
+# scenarios, `rules` is "simple" or "heavy", `paths` is the kind of paths requested in turn
+SCENARIOS = [
+    {"name": "small-get-10", "method": "GET", "paths": "small", "clients": 10},
+    {"name": "small-get-1000", "method": "GET", "paths": "small", "clients": 1000},
+    {"name": "head-10", "method": "HEAD", "paths": "small", "clients": 10},
+    {"name": "login-post-10", "method": "POST", "paths": "login", "clients": 10},
+    {"name": "rules-heavy-get-10", "method": "GET", "paths": "rules", "clients": 10, "rules": "heavy"},
+    {"name": "big-get-1", "method": "GET", "paths": "big", "clients": 1},
+    {"name": "small-get-10-tls", "method": "GET", "paths": "small", "clients": 10, "tls": True},
+    {"name": "small-get-1000-tls", "method": "GET", "paths": "small", "clients": 1000, "tls": True},
+    {"name": "big-get-1-tls", "method": "GET", "paths": "big", "clients": 1, "tls": True},
+]
+
+LOGIN_BODY = b"username=admin&password=12345"
+
+
+def create_root(rootDirectory, bigSizeMB):
+    """
+    Generate document root: index, small files, a big file, login page with its handler, rule-heavy directories
+    """
+    os.makedirs(os.path.join(rootDirectory, ".meta"))
+    with open(os.path.join(rootDirectory, "index.html"), "w") as outFile:
+        outFile.write("<!DOCTYPE html>\n<html><body><h1>benchmark</h1></body></html>\n")
+    for i in range(SMALL_FILES):
+        with open(os.path.join(rootDirectory, "small{}.html".format(i)), "w") as outFile:
+            outFile.write("<p>{}</p>\n".format("x" * (1024 * (1 + i % 16))))
+    # sparse file, reading it costs no disk space
+    with open(os.path.join(rootDirectory, "big.bin"), "wb") as outFile:
+        outFile.truncate(bigSizeMB * 1024 * 1024)
+    shutil.copy(os.path.join(REPOSITORY, "website", "login.html"), rootDirectory)
+    shutil.copy(os.path.join(REPOSITORY, "website", ".meta", "login.html.py"), os.path.join(rootDirectory, ".meta"))
+    shutil.copy(os.path.join(REPOSITORY, "website", ".meta", "login.html.rejected.html"), os.path.join(rootDirectory, ".meta"))
+    with open(os.path.join(rootDirectory, ".meta", "users.keys"), "w") as outFile:
+        outFile.write("admin\n12345\n")
+    for i in range(RULE_DIRECTORIES):
+        directory = os.path.join(rootDirectory, "dir{}".format(i))
+        os.makedirs(directory)
+        for j in range(RULE_FILES):
+            with open(os.path.join(directory, "page{}.html".format(j)), "w") as outFile:
+                outFile.write("<p>{} {}</p>\n".format(i, j))
+
+
+def write_rules(rootDirectory, kind):
+    """
+    Write rules.json, "heavy" rules have one allow pattern per directory and user exceptions
+    """
+    rules = {
+        "Allow": ["index.html", "login.html", "small*.html", "big.bin"],
+        "Forbidden": ["*", ".meta/*"],
+        "Exception": [],
+        "Database": ".meta/users.keys",
+        "Handler": {"login.html": ".meta/login.html.py"},
+    }
+    if kind == "heavy":
+        rules["Allow"] += ["dir{}/page[0-9].html".format(i) for i in range(RULE_DIRECTORIES)]
+        rules["Forbidden"] += ["dir{}/*".format(i) for i in range(RULE_DIRECTORIES)]
+        rules["Exception"] = [{"Username": "user{}".format(i), "Files": ["dir{}/*".format(i)]} for i in range(100)]
+    with open(os.path.join(rootDirectory, "rules.json"), "w") as outFile:
+        json.dump(rules, outFile, indent=4)
+
+
+def request_paths(kind):
+    """
+    Get list of paths requested in turn by clients
+    """
+    if kind == "small": return ["/small{}.html".format(i) for i in range(SMALL_FILES)]
+    if kind == "login": return ["/login.html"]
+    if kind == "big": return ["/big.bin"]
+    return ["/dir{}/page{}.html".format(i, i % RULE_FILES) for i in range(0, RULE_DIRECTORIES, 7)]
+
+
+def prepare_certificates(workDirectory):
+    """
+    Put a certificate in work directory for TLS scenarios\\
+    Return `True` if available
+    """
+    target = os.path.join(workDirectory, "certificates")
+    os.makedirs(target, exist_ok=True)
+    if os.path.isfile(SSL_CERT_FILE) and os.path.isfile(SSL_KEY_FILE):
+        shutil.copy(SSL_CERT_FILE, target)
+        shutil.copy(SSL_KEY_FILE, target)
+        return True
+    if shutil.which("openssl") is None: return False
+    result = subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                             "-keyout", os.path.join(target, "signed.private.key"), "-out", os.path.join(target, "signed.crt")],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+
+def free_port():
+    """
+    Get a free TCP port on localhost
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(workDirectory, rootDirectory, port, tls, serverArgs):
+    """
+    Start server subprocess and wait until it accepts connections
+    """
+    # server enables TLS when certificates are found in its working directory
+    certificates = os.path.join(workDirectory, "certificates")
+    disabled = os.path.join(workDirectory, "certificates.disabled")
+    if tls and os.path.isdir(disabled): os.replace(disabled, certificates)
+    if not tls and os.path.isdir(certificates): os.replace(certificates, disabled)
+    command = [sys.executable, os.path.join(REPOSITORY, "main.py"), rootDirectory, str(port), "--quiet"] + serverArgs
+    process = subprocess.Popen(command, cwd=workDirectory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited with code {}".format(process.returncode))
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+def stop_server(process):
+    """
+    Stop server subprocess with keyboard interrupt, kill it if it does not stop
+    """
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def read_response(reader, nobody):
+    """
+    Read one response, return (status code, body length, connection closed by server)\
+    Raise `ValueError` if response is not framed (no Content-Length or chunked body on a kept alive connection)
+    """
+    header = await reader.readuntil(b"\r\n\r\n")
+    lines = header.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    length = None
+    chunked = False
+    close = False
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        name = name.strip().lower()
+        if name == "content-length": length = int(value)
+        elif name == "transfer-encoding": chunked = value.strip().lower() == "chunked"
+        elif name == "connection": close = value.strip().lower() == "close"
+    if nobody or status in (204, 304) or 100 <= status < 200:
+        return status, length or 0, close
+    if chunked:
+        length = 0
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            length += size
+            if not size: return status, length, close
+    if length is None:
+        # body ends when server closes connection, a kept alive connection would wait forever
+        if not close: raise ValueError("response without Content-Length")
+        length = len(await reader.read())
+        return status, length, True
+    remaining = length
+    while remaining > 0:
+        data = await reader.read(min(remaining, 1024 * 1024))
+        if not data: raise ConnectionError("connection closed in body")
+        remaining -= len(data)
+    return status, length, close
+
+
+async def run_client(port, sslContext, scenario, paths, offset, deadline, result):
+    """
+    One client, sending requests one after another on a keep-alive connection until deadline
+    """
+    method = scenario["method"]
+    reader = writer = None
+    index = offset
+    done = 0
+    while time.perf_counter() < deadline or done == 0:
+        if writer is None:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port, ssl=sslContext), 10)
+            except (OSError, asyncio.TimeoutError, ssl.SSLError):
+                result["errors"] += 1
+                if time.perf_counter() >= deadline: break
+                await asyncio.sleep(0.1)
+                continue
+        path = paths[index % len(paths)]
+        index += 1
+        if method == "POST":
+            request = "POST {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/x-www-form-urlencoded\r\nContent-Length: {}\r\n\r\n".format(path, len(LOGIN_BODY)).encode("ascii") + LOGIN_BODY
+        else:
+            request = "{} {} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(method, path).encode("ascii")
+        start = time.perf_counter()
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, length, close = await asyncio.wait_for(read_response(reader, method == "HEAD"), scenario.get("timeout", 300))
+        except (OSError, EOFError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError, ssl.SSLError):
+            result["errors"] += 1
+            writer.close()
+            writer = None
+            done += 1
+            continue
+        result["latencies"].append(time.perf_counter() - start)
+        result["status"][str(status)] = result["status"].get(str(status), 0) + 1
+        if method != "HEAD": result["bytes"] += length
+        done += 1
+        if close:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+def run_clients(args):
+    """
+    Run a group of clients in one process, return raw results
+    """
+    port, tls, scenario, paths, clients, firstClient, startAt, duration = args
+    sslContext = None
+    if tls:
+        sslContext = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+        sslContext.check_hostname = False
+        sslContext.verify_mode = ssl.CERT_NONE
+    result = {"latencies": [], "errors": 0, "bytes": 0, "status": {}}
+
+    async def main():
+        # all processes start sending at the same time
+        await asyncio.sleep(max(0, startAt - time.time()))
+        start = time.perf_counter()
+        await asyncio.gather(*[run_client(port, sslContext, scenario, paths, firstClient + i, start + duration, result) for i in range(clients)])
+        result["elapsed"] = time.perf_counter() - start
+
+    asyncio.run(main())
+    return result
+
+
+def percentile(sortedValues, fraction):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not sortedValues: return None
+    index = max(0, min(len(sortedValues) - 1, int(round(fraction * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[index]
+
+
+def run_scenario(scenario, port, duration, processes):
+    """
+    Load server with scenario clients, return summary
+    """
+    paths = request_paths(scenario["paths"])
+    clients = scenario["clients"]
+    processes = max(1, min(processes, clients))
+    groups = []
+    first = 0
+    startAt = time.time() + 1
+    for i in range(processes):
+        count = clients // processes + (1 if i < clients % processes else 0)
+        groups.append((port, scenario.get("tls", False), scenario, paths, count, first, startAt, duration))
+        first += count
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(run_clients, groups)
+    elapsed = max(result["elapsed"] for result in results)
+    latencies = sorted(x for result in results for x in result["latencies"])
+    status = {}
+    for result in results:
+        for code, count in result["status"].items():
+            status[code] = status.get(code, 0) + count
+    totalBytes = sum(result["bytes"] for result in results)
+    return {
+        "name": scenario["name"],
+        "method": scenario["method"],
+        "clients": clients,
+        "tls": scenario.get("tls", False),
+        "rules": scenario.get("rules", "simple"),
+        "requests": len(latencies),
+        "errors": sum(result["errors"] for result in results),
+        "status": status,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "throughput_MBps": round(totalBytes / elapsed / 1024 / 1024, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            "p95": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "max": round(latencies[-1] * 1000, 3) if latencies else None,
+        },
+    }
+
+
+def git_revision():
+    """
+    Get current git commit of repository, `None` if unknown
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPOSITORY, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True).stdout.decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def raise_file_limit():
+    """
+    Allow many open sockets for 1000 clients, inherited by server subprocess
+    """
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = 65536 if hard == resource.RLIM_INFINITY else min(hard, 65536)
+        if soft < target: resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Pr0j3ct end-to-end load benchmark")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load for each scenario")
+    parser.add_argument("--scenarios", default="", help="comma separated scenario names, all if empty")
+    parser.add_argument("--big-size", type=int, default=1024, help="size of big file in MB")
+    parser.add_argument("--processes", type=int, default=min(4, os.cpu_count() or 1), help="client processes")
+    parser.add_argument("--server-args", default="", help="extra arguments for main.py, e.g. \"--mode eventloop\"")
+    parser.add_argument("--output", default="", help="write JSON result to file instead of printing it")
+    parser.add_argument("--list", action="store_true", help="list scenarios and exit")
+    args = parser.parse_args()
+    if args.list:
+        for scenario in SCENARIOS: print(scenario["name"])
+        sys.exit(0)
+    selected = [x for x in args.scenarios.split(",") if x]
+    unknown = set(selected) - {x["name"] for x in SCENARIOS}
+    if unknown:
+        parser.error("unknown scenarios: {}".format(", ".join(sorted(unknown))))
+    scenarios = [x for x in SCENARIOS if not selected or x["name"] in selected]
+    serverArgs = args.server_args.split()
+    raise_file_limit()
+    workDirectory = tempfile.mkdtemp(prefix="pr0j3ct-benchmark-")
+    rootDirectory = os.path.join(workDirectory, "root")
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "duration_s": args.duration,
+            "big_size_MB": args.big_size,
+            "client_processes": args.processes,
+            "server_args": serverArgs,
+        },
+        "scenarios": [],
+    }
+    try:
+        create_root(rootDirectory, args.big_size)
+        tlsAvailable = prepare_certificates(workDirectory)
+        for scenario in scenarios:
+            tls = scenario.get("tls", False)
+            if tls and not tlsAvailable:
+                print("{}: skipped, no certificate".format(scenario["name"]), file=sys.stderr)
+                report["scenarios"].append({"name": scenario["name"], "skipped": "no certificate"})
+                continue
+            write_rules(rootDirectory, scenario.get("rules", "simple"))
+            port = free_port()
+            server = start_server(workDirectory, rootDirectory, port, tls, serverArgs)
+            try:
+                summary = run_scenario(scenario, port, args.duration, args.processes)
+            finally:
+                stop_server(server)
+            print("{}: {} req/s, p50 {} ms, p99 {} ms, {} errors".format(summary["name"], summary["throughput_rps"],
+                  summary["latency_ms"]["p50"], summary["latency_ms"]["p99"], summary["errors"]), file=sys.stderr)
+            report["scenarios"].append(summary)
+    finally:
+        shutil.rmtree(workDirectory, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as outFile:
+            json.dump(report, outFile, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
@@ -0,0 +1,318 @@
+# This file measures the cost of individual hot paths of the server with fixed synthetic fixtures,
+# and compares results with a stored baseline to catch regressions
+#
+# run from repository root:
+#   python benchmarks/micro_benchmark.py run [--output result.json] [--only auth,parse]
+#   python benchmarks/micro_benchmark.py compare [--baseline benchmarks/micro_baseline.json] [--current result.json] [--threshold 0.2]
+#   python benchmarks/micro_benchmark.py baseline    (overwrite stored baseline with a new run)
+# compare runs the suite if no current result is given, and exits with code 1 if any benchmark is slower than
+# baseline by more than threshold (0.2 = 20%)
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Pr0j3ct.logging import Logger, backend as logBackend
+from Pr0j3ct.authhandler import AuthHandler
+from Pr0j3ct.rulematcher import RuleMatcher
+from Pr0j3ct.httpparser import HttpParser
+from Pr0j3ct.formparser import FormParser
+from Pr0j3ct.requests import RequestProcessor
+from Pr0j3ct.scheduler import Scheduler
+from Pr0j3ct.compression import Compressor
+from Pr0j3ct.metrics import MetricsRegistry
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+
+RULE_COUNT = 500 # number of allow and forbidden patterns in fixture rules.json
+FILE_COUNT = 2000 # number of files in fixture root
+REPEAT = 5 # measurements of each benchmark, best and median are reported
+TARGET_SECONDS = 0.2 # time of one measurement
+
+GET_REQUEST = (b"GET /dir12/page3.html?lang=en&id=42 HTTP/1.1\r\n"
+               b"Host: localhost:8080\r\n"
+               b"User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36\r\n"
+               b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+               b"Accept-Encoding: gzip, deflate, br\r\n"
+               b"Accept-Language: en-US,en;q=0.5\r\n"
+               b"Connection: keep-alive\r\n"
+               b"If-None-Match: \"17a3c5e2f0-1f40\"\r\n\r\n")
+
+
+"""
+This class stands in for a client socket, dropping all data sent.
+"""
+class _NullSocket:
+    def settimeout(self, timeout): pass
+    def setblocking(self, flag): pass
+    def sendall(self, data): pass
+    def send(self, data): return len(data)
+    def close(self): pass
+
+
+"""
+This class is a runnable doing nothing, for measuring scheduler dispatch cost.
+"""
+class _NullTask:
+    connSocketAddress = "benchmark:0"
+
+    def __init__(self, done):
+        self.done = done
+
+    def run(self):
+        self.done()
+
+    def stop(self): pass
+
+
+def create_fixture(rootDirectory):
+    """
+    Create root with `FILE_COUNT` files in directories and a rules.json with `RULE_COUNT` patterns
+    """
+    directories = FILE_COUNT // 10
+    for i in range(directories):
+        os.makedirs(os.path.join(rootDirectory, "dir{}".format(i)))
+        for j in range(10):
+            open(os.path.join(rootDirectory, "dir{}".format(i), "page{}.html".format(j)), "w").close()
+    open(os.path.join(rootDirectory, "index.html"), "w").close()
+    rules = {
+        "Allow": ["index.html"] + ["dir{}/page[0-4].html".format(i) for i in range(RULE_COUNT // 2)],
+        "Forbidden": ["*"] + ["dir{}/*".format(i) for i in range(RULE_COUNT // 2)],
+        "Exception": [{"Username": "user{}".format(i), "Files": ["dir{}/*".format(i)]} for i in range(50)],
+        "Database": "",
+        "Handler": {},
+    }
+    with open(os.path.join(rootDirectory, "rules.json"), "w") as outFile:
+        json.dump(rules, outFile)
+    return rules
+
+
+def measure(function):
+    """
+    Measure `function(n)` which runs an operation n times\\
+    Return (best, median) time of one operation in nanoseconds, and n
+    """
+    # calibrate number of operations for one measurement
+    n = 1
+    while True:
+        start = time.perf_counter()
+        function(n)
+        elapsed = time.perf_counter() - start
+        if elapsed >= TARGET_SECONDS / 10 or n >= 10 ** 7: break
+        n *= 10
+    n = max(1, int(n * TARGET_SECONDS / max(elapsed, 1e-9)))
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(n)
+        samples.append((time.perf_counter() - start) / n * 1e9)
+    return min(samples), statistics.median(samples), n
+
+
+def benchmarks(workDirectory):
+    """
+    Build fixtures, return dictionary of benchmark name -> function(n)
+    """
+    rootDirectory = os.path.join(workDirectory, "root")
+    os.makedirs(rootDirectory)
+    rules = create_fixture(rootDirectory)
+    authHandler = AuthHandler(rootDirectory)
+    matcher = RuleMatcher(rootDirectory, rules["Allow"], rules["Forbidden"], {})
+    paths = [os.path.join(rootDirectory, "dir{}".format(i % (FILE_COUNT // 10)), "page{}.html".format(i % 10)) for i in range(0, 997, 7)]
+    processor = RequestProcessor(rootDirectory, "index.html", _NullSocket(), "benchmark:0", authHandler)
+    extraHeaders = [("Accept-Ranges", "bytes"), ("ETag", "\"17a3c5e2f0-1f40\""), ("Last-Modified", "Sun, 18 Oct 2026 12:00:00 GMT")]
+    pipelined = GET_REQUEST * 10
+    formBody = b"&".join("field{}=value%20{}".format(i, i).encode("ascii") for i in range(50))
+    multipartBody = (b"--XYZ\r\nContent-Disposition: form-data; name=\"a\"\r\n\r\nhello\r\n"
+                     b"--XYZ\r\nContent-Disposition: form-data; name=\"f\"; filename=\"f.bin\"\r\n\r\n" + bytes(256 * 1024) + b"\r\n--XYZ--\r\n")
+    formParser = FormParser()
+    compressor = Compressor()
+    registry = MetricsRegistry()
+    counter = registry.counter("benchmark_total", "benchmark", ("method", "code"))
+    histogram = registry.histogram("benchmark_seconds", "benchmark", ("method",))
+    logger = Logger("Benchmark")
+
+    token = authHandler.login("user1")
+
+    def auth_cached(n):
+        # logged in user with session token
+        for i in range(n):
+            authHandler.auth(paths[i % len(paths)], token)
+
+    def auth_uncached(n):
+        # compiled rules without decision cache
+        for i in range(n):
+            matcher.match(paths[i % len(paths)], None)
+
+    def parse_request(n):
+        for _ in range(n):
+            parser = HttpParser()
+            parser.feed(GET_REQUEST)
+            parser.next()
+
+    def parse_pipelined_10(n):
+        for _ in range(n):
+            parser = HttpParser()
+            parser.feed(pipelined)
+            while parser.next(): pass
+
+    def send_header(n):
+        for _ in range(n):
+            processor._sendHEADER(200, "OK", "text/html", 8000, extraHeaders)
+            processor._flush()
+
+    def logger_info_suppressed(n):
+        logBackend.level = 30
+        for i in range(n):
+            logger.info("GET {} from {}", paths[0], i)
+        logBackend.level = 20
+
+    def logger_info_written(n):
+        # includes background formatting and writing until flushed
+        for i in range(n):
+            logger.info("GET {} from {}", paths[0], i)
+        logBackend.flush()
+
+    def scheduler_dispatch(n):
+        scheduler = Scheduler(max_threads=4, max_queue=1024, reject_policy="block")
+        remaining = [n]
+        lock = threading.Lock()
+        finished = threading.Event()
+        def done():
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0: finished.set()
+        for _ in range(n):
+            scheduler.add(_NullTask(done))
+        finished.wait()
+        scheduler.shutdown()
+
+    def form_urlencoded_50(n):
+        for _ in range(n):
+            formParser.parse({}, io.BytesIO(formBody))
+
+    def form_multipart_256k(n):
+        for _ in range(n):
+            formParser.close(formParser.parse({"content-type": "multipart/form-data; boundary=XYZ"}, io.BytesIO(multipartBody)))
+
+    def negotiate_encoding(n):
+        for _ in range(n):
+            compressor.negotiate("gzip, deflate, br;q=0.9, *;q=0.1")
+
+    def metrics_record(n):
+        for _ in range(n):
+            counter.inc(1, ("GET", "200"))
+            histogram.observe(0.003, ("GET",))
+
+    return {
+        "auth_cached": auth_cached,
+        "auth_uncached": auth_uncached,
+        "parse_request": parse_request,
+        "parse_pipelined_10": parse_pipelined_10,
+        "send_header": send_header,
+        "logger_info_suppressed": logger_info_suppressed,
+        "logger_info_written": logger_info_written,
+        "scheduler_dispatch": scheduler_dispatch,
+        "form_urlencoded_50": form_urlencoded_50,
+        "form_multipart_256k": form_multipart_256k,
+        "negotiate_encoding": negotiate_encoding,
+        "metrics_record": metrics_record,
+    }
+
+
+def run(only):
+    """
+    Run benchmarks whose name starts with one of `only` (all if empty), return report
+    """
+    workDirectory = tempfile.mkdtemp(prefix="pr0j3ct-micro-")
+    # keep log output of measured components away from terminal and repository
+    logBackend.configure(console=False, directory=os.path.join(workDirectory, "log"), maxBytes=0)
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rules": RULE_COUNT,
+            "files": FILE_COUNT,
+        },
+        "results": {},
+    }
+    try:
+        for name, function in benchmarks(workDirectory).items():
+            if only and not any(name.startswith(x) for x in only): continue
+            best, median, n = measure(function)
+            report["results"][name] = {"best_ns": round(best, 1), "median_ns": round(median, 1), "iterations": n}
+            print("{:<26} {:>12.1f} ns  (median {:.1f} ns, {} ops)".format(name, best, median, n), file=sys.stderr)
+    finally:
+        logBackend.shutdown()
+        shutil.rmtree(workDirectory, ignore_errors=True)
+    return report
+
+
+def compare(baseline, current, threshold):
+    """
+    Print comparison of best times, return names of benchmarks slower than baseline by more than threshold
+    """
+    regressions = []
+    print("{:<26} {:>12} {:>12} {:>8}".format("benchmark", "baseline ns", "current ns", "change"))
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print("{:<26} {:>12} {:>12.1f} {:>8}".format(name, "-", result["best_ns"], "new"))
+            continue
+        change = result["best_ns"] / base["best_ns"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("{:<26} {:>12.1f} {:>12.1f} {:>+7.1f}%{}".format(name, base["best_ns"], result["best_ns"], change * 100, flag))
+    return regressions
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Pr0j3ct micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    runParser = subparsers.add_parser("run", help="run benchmarks")
+    runParser.add_argument("--output", default="", help="write JSON result to file instead of printing it")
+    runParser.add_argument("--only", default="", help="comma separated name prefixes of benchmarks to run")
+    baselineParser = subparsers.add_parser("baseline", help="run benchmarks and store result as baseline")
+    baselineParser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    compareParser = subparsers.add_parser("compare", help="compare result with baseline, exit code 1 on regression")
+    compareParser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    compareParser.add_argument("--current", default="", help="result file to compare, run benchmarks if empty")
+    compareParser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    compareParser.add_argument("--only", default="", help="comma separated name prefixes of benchmarks to run")
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run([x for x in args.only.split(",") if x])
+        if args.output:
+            with open(args.output, "w") as outFile:
+                json.dump(report, outFile, indent=4)
+        else:
+            print(json.dumps(report, indent=4))
+    elif args.command == "baseline":
+        report = run([])
+        with open(args.baseline, "w") as outFile:
+            json.dump(report, outFile, indent=4)
+    else:
+        with open(args.baseline) as inFile:
+            baseline = json.load(inFile)
+        if args.current:
+            with open(args.current) as inFile:
+                current = json.load(inFile)
+        else:
+            current = run([x for x in args.only.split(",") if x])
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print("{} benchmark(s) regressed more than {:.0f}%: {}".format(len(regressions), args.threshold * 100, ", ".join(regressions)))
+            sys.exit(1)
+        print("no regression beyond {:.0f}%".format(args.threshold * 100))
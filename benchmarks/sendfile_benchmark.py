@@ -0,0 +1,116 @@
+# This file benchmarks static file sending throughput of RequestProcessor
+# compares the old 2048 bytes read/send loop with sendfile (plain socket) and buffered send (TLS socket)
+#
+# run from repository root:
+#   python benchmarks/sendfile_benchmark.py [size in MB]
+# TLS cases are run only if certificates/signed.crt and certificates/signed.private.key exist (see gencert.py)
+
+import os
+import sys
+import ssl
+import time
+import socket
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Pr0j3ct.requests import RequestProcessor
+
+SSL_CERT_FILE = os.path.join("certificates", "signed.crt")
+SSL_KEY_FILE = os.path.join("certificates", "signed.private.key")
+
+def create_file(sizeMB):
+    """
+    Create a temporary file of given size in MB
+    """
+    outFile = tempfile.NamedTemporaryFile(delete=False)
+    block = os.urandom(1024 * 1024)
+    for _ in range(sizeMB):
+        outFile.write(block)
+    outFile.close()
+    return outFile.name
+
+def receive_all(connSocket, expected):
+    """
+    Receive and drop data until expected number of bytes is received
+    """
+    received = 0
+    while received < expected:
+        data = connSocket.recv(1024 * 1024)
+        if not data: break
+        received += len(data)
+    return received
+
+def connect(useSSL):
+    """
+    Create a connected pair of (server side, client side) sockets over localhost
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    if not useSSL:
+        return server, client
+    serverContext = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    serverContext.load_cert_chain(SSL_CERT_FILE, SSL_KEY_FILE)
+    clientContext = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    clientContext.check_hostname = False
+    clientContext.verify_mode = ssl.CERT_NONE
+    result = {}
+    def handshake():
+        result["client"] = clientContext.wrap_socket(client)
+    thread = threading.Thread(target=handshake)
+    thread.start()
+    server = serverContext.wrap_socket(server, server_side=True)
+    thread.join()
+    return server, result["client"]
+
+def send_legacy(processor, filePath):
+    """
+    The old way of sending file, read and send every 2048 bytes
+    """
+    with open(filePath, "rb") as inputFile:
+        while True:
+            data = inputFile.read(2048)
+            if not data: break
+            if not processor._send(data, binary=True): break
+
+def send_current(processor, filePath):
+    """
+    The current way of sending file
+    """
+    processor._sendFILE(filePath)
+
+def run(name, sendFunction, filePath, useSSL):
+    """
+    Run one benchmark case and print throughput
+    """
+    fileSize = os.path.getsize(filePath)
+    server, client = connect(useSSL)
+    processor = RequestProcessor(os.path.dirname(filePath), "", server, "benchmark:0", None)
+    result = {}
+    receiver = threading.Thread(target=lambda: result.setdefault("received", receive_all(client, fileSize)))
+    receiver.start()
+    start = time.perf_counter()
+    sendFunction(processor, filePath)
+    receiver.join()
+    elapsed = time.perf_counter() - start
+    processor.stop()
+    client.close()
+    print("{:<24} {:>8.1f} MB/s  ({:.3f}s, {} bytes)".format(name, fileSize / elapsed / 1024 / 1024, elapsed, result["received"]))
+
+if __name__=="__main__":
+    sizeMB = int(sys.argv[1]) if len(sys.argv) >= 2 else 256
+    filePath = create_file(sizeMB)
+    try:
+        run("plain legacy loop", send_legacy, filePath, False)
+        run("plain sendfile", send_current, filePath, False)
+        if os.path.isfile(SSL_CERT_FILE) and os.path.isfile(SSL_KEY_FILE):
+            run("TLS legacy loop", send_legacy, filePath, True)
+            run("TLS buffered", send_current, filePath, True)
+        else:
+            print("certificates not found, TLS cases skipped")
+    finally:
+        os.remove(filePath)
@@ -0,0 +1,39 @@
+# This file converts plaintext passwords of a users database (alternating username and password lines) into salted hashes
+# usage: python convertkeys.py website/.meta/users.keys [--output FILE] [--iterations N]
+
+import os
+import shutil
+import argparse
+from Pr0j3ct.credentialstore import hashPassword, isHashed, HASH_ITERATIONS
+
+def convert_keys(inPath, outPath, iterations):
+    with open(inPath, "r", encoding="utf-8") as inFile:
+        data = inFile.read().splitlines()
+    lines = []
+    converted = 0
+    for u, p in zip(data[0::2], data[1::2]):
+        username, password = u.strip(), p.strip()
+        if not username: continue
+        # passwords already hashed are kept
+        if not isHashed(password):
+            password = hashPassword(password, iterations)
+            converted += 1
+        lines.append("{}\n{}\n".format(username, password))
+    if outPath == inPath:
+        # keep plaintext original as backup
+        shutil.copy2(inPath, inPath + ".bak")
+        print("original database kept as {}".format(inPath + ".bak"))
+    # write to a temporary file first, so that the server never reads a partly written database
+    temporaryPath = "{}.{}.tmp".format(outPath, os.getpid())
+    with open(temporaryPath, "w", encoding="utf-8") as outFile:
+        outFile.writelines(lines)
+    os.replace(temporaryPath, outPath)
+    print("{} users written to {}, {} passwords hashed".format(len(lines), outPath, converted))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Hash plaintext passwords of a Pr0j3ct users database")
+    parser.add_argument("database", help="users database file, alternating username and password lines")
+    parser.add_argument("--output", default=None, help="converted database file, database is replaced if not given")
+    parser.add_argument("--iterations", type=int, default=HASH_ITERATIONS, help="PBKDF2 iterations of new hashes")
+    args = parser.parse_args()
+    convert_keys(args.database, args.output or args.database, args.iterations)
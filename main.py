@@ -1,16 +1,74 @@
-import sys
+import socket
+import argparse
 from Pr0j3ct.server import Server
+from Pr0j3ct.supervisor import Supervisor
+from Pr0j3ct.logging import backend as logBackend
 
 
 if __name__=="__main__":
-    if len(sys.argv) < 3:
-        print("Please run: main.py <RootDirectory> <Port>")
-        sys.exit(1)
     """
     The first argument is the root directory, the second argument is the port.
     """
-    root = sys.argv[1]
-    port = int(sys.argv[2])
+    parser = argparse.ArgumentParser(description="Pr0j3ct HTTP server")
+    parser.add_argument("root", help="website root directory")
+    parser.add_argument("port", type=int, help="server port")
+    parser.add_argument("--mode", choices=["thread", "eventloop"], default="thread",
+                        help="receive requests on worker threads of the pool, which give idle connections to a watcher thread once no worker is free, or receive all requests with a single event loop handing them to the pool")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes sharing the port, each with its own threads")
+    parser.add_argument("--threads", type=int, default=50, help="number of worker threads")
+    parser.add_argument("--queue", type=int, default=100, help="max number of tasks waiting for a worker thread")
+    parser.add_argument("--cache-size", type=int, default=64, help="memory for caching static files in MB, 0 to disable")
+    parser.add_argument("--cache-entry-size", type=int, default=1024, help="max size of a cached file in KB")
+    parser.add_argument("--no-compression", action="store_true", help="never compress response bodies")
+    parser.add_argument("--max-connections", type=int, default=0, help="max open client connections of a worker process, 0 for no limit")
+    parser.add_argument("--max-connections-per-ip", type=int, default=0, help="max open connections of one client IP address, 0 for no limit")
+    parser.add_argument("--shed-queue", type=int, default=None, help="answer 503 once this many tasks wait for a worker thread, 0 to never shed (default: --queue)")
+    parser.add_argument("--retry-after", type=int, default=5, help="seconds in Retry-After header of 503 responses when shedding load")
+    parser.add_argument("--backlog", type=int, default=socket.SOMAXCONN, help="listen backlog of connections waiting to be accepted")
+    parser.add_argument("--keep-alive-timeout", type=float, default=15, help="seconds an idle connection is kept open")
+    parser.add_argument("--header-timeout", type=float, default=10, help="seconds a client may take to send a request header, and its first request")
+    parser.add_argument("--request-timeout", type=float, default=300, help="seconds a client may take to send a whole request (a body arriving at --min-recv-rate is not limited), 0 for no limit")
+    parser.add_argument("--min-recv-rate", type=int, default=500, help="min bytes per second of a request still being received after 5 seconds, 0 for no limit")
+    parser.add_argument("--send-timeout", type=float, default=30, help="seconds a client may take to read each 256KB of a response, on top of its time at --min-send-rate, 0 for no limit")
+    parser.add_argument("--min-send-rate", type=int, default=1024, help="min bytes per second a client must read of a response")
+    parser.add_argument("--max-requests", type=int, default=100, help="max number of requests served on one connection")
+    parser.add_argument("--max-body-size", type=int, default=4096, help="max size of a request body in MB")
+    parser.add_argument("--metrics-path", default="", help="path of website serving metrics to any client without authorization, disabled if empty")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve metrics on this port instead of website port")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="address the metrics port is bound to, empty for all interfaces")
+    parser.add_argument("--session-idle-timeout", type=float, default=1800, help="seconds a login session is kept without requests")
+    parser.add_argument("--session-max-age", type=float, default=86400, help="seconds a login session is kept after login")
+    parser.add_argument("--handshake-timeout", type=float, default=10, help="seconds a client may take for each step of TLS handshake")
+    parser.add_argument("--trace", action="store_true", help="time phases of requests and log slow requests, toggled at runtime with SIGUSR2")
+    parser.add_argument("--slow-request-ms", type=float, default=1000, help="log traced requests slower than this, in milliseconds")
+    parser.add_argument("--slow-stack-ms", type=float, default=5000, help="log stack of a traced request running longer than this, in milliseconds, 0 to disable")
+    parser.add_argument("--server-timing", action="store_true", help="add Server-Timing header to traced responses")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARN", "ERROR"], default="INFO", help="lowest level of logged messages")
+    parser.add_argument("--quiet", action="store_true", help="do not print log messages in terminal")
+    parser.add_argument("--log-max-size", type=int, default=10, help="rotate log file when it exceeds this size in MB, 0 to disable")
+    parser.add_argument("--log-rotate-interval", type=int, default=0, help="rotate log file every given seconds, 0 to disable")
+    parser.add_argument("--log-backups", type=int, default=5, help="number of rotated log files kept")
+    parser.add_argument("--no-log-compression", action="store_true", help="do not gzip rotated log files")
+    args = parser.parse_args()
+    logBackend.configure(level=args.log_level, console=not args.quiet, maxBytes=args.log_max_size*1024*1024,
+                         rotateInterval=args.log_rotate_interval, backupCount=args.log_backups,
+                         compress=not args.no_log_compression)
     # try to enable SSL for https
-    myServer = Server(root, port, enableSSL=True)
-    myServer.start()
\ No newline at end of file
+    options = dict(rootDirectory=args.root, port=args.port, enableSSL=True, mode=args.mode, maxThreads=args.threads, maxQueue=args.queue,
+                   cacheBytes=args.cache_size*1024*1024, cacheEntryBytes=args.cache_entry_size*1024,
+                   enableCompression=not args.no_compression,
+                   keepAliveTimeout=args.keep_alive_timeout, maxRequests=args.max_requests,
+                   maxBodySize=args.max_body_size*1024*1024, metricsPath=args.metrics_path or None,
+                   enableTracing=args.trace, slowRequestSeconds=args.slow_request_ms/1000, slowStackSeconds=args.slow_stack_ms/1000,
+                   serverTiming=args.server_timing, handshakeTimeout=args.handshake_timeout,
+                   sessionIdleTimeout=args.session_idle_timeout, sessionMaxAge=args.session_max_age,
+                   maxConnections=args.max_connections, maxConnectionsPerClient=args.max_connections_per_ip,
+                   shedQueue=args.shed_queue, retryAfter=args.retry_after, listenBacklog=args.backlog,
+                   headerTimeout=args.header_timeout, requestTimeout=args.request_timeout, minRecvRate=args.min_recv_rate,
+                   sendTimeout=args.send_timeout, minSendRate=args.min_send_rate)
+    if args.workers > 1:
+        # metrics port is served by supervisor with totals of all workers
+        Supervisor(args.workers, options, metricsPort=args.metrics_port, metricsHost=args.metrics_host).run()
+    else:
+        myServer = Server(metricsPort=args.metrics_port, metricsHost=args.metrics_host, **options)
+        myServer.start()
@@ -0,0 +1,8 @@
+# tests/__init__.py
+# unit tests of Pr0j3ct modules, run with `python -m pytest` or `python -m unittest` from repository root
+
+import tempfile
+from Pr0j3ct.logging import backend
+
+# log messages of components under test are kept out of terminal and repository
+backend.configure(console=False, directory=tempfile.mkdtemp(prefix="pr0j3ct-tests-"))
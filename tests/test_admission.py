@@ -0,0 +1,91 @@
+# test_admission.py
+# tests connection limits and 503 shedding of AdmissionController, and the scheduler backlog it is given
+
+import socket
+import threading
+import unittest
+
+from Pr0j3ct.admission import AdmissionController, clientHOST
+from Pr0j3ct.scheduler import Scheduler
+
+
+"""
+This class is a scheduler task which runs until released.
+"""
+class _Blocking:
+    def __init__(self, release):
+        self.release = release
+        self.started = threading.Event()
+        self.connSocketAddress = "127.0.0.1:1"
+
+    def run(self):
+        self.started.set()
+        self.release.wait(5)
+
+    def stop(self):
+        self.release.set()
+
+
+class AdmissionTest(unittest.TestCase):
+    def test_client_host(self):
+        self.assertEqual(clientHOST("127.0.0.1:80"), "127.0.0.1")
+        self.assertEqual(clientHOST("::1:80"), "::1")
+
+    def test_connection_limits(self):
+        admission = AdmissionController(maxConnections=3, maxPerClient=2)
+        self.assertIsNone(admission.admit("10.0.0.1:1"))
+        self.assertIsNone(admission.admit("10.0.0.1:2"))
+        self.assertEqual(admission.admit("10.0.0.1:3"), "client")
+        self.assertIsNone(admission.admit("10.0.0.2:1"))
+        self.assertEqual(admission.admit("10.0.0.3:1"), "connections")
+        admission.release("10.0.0.1:1")
+        self.assertIsNone(admission.admit("10.0.0.1:4"))
+        # releasing an address never admitted changes nothing
+        admission.release("10.0.0.9:1")
+        self.assertEqual(admission.stats()["open"], 3)
+
+    def test_queue(self):
+        admission = AdmissionController(shedQueue=2)
+        self.assertIsNone(admission.admit("10.0.0.1:1", 1))
+        self.assertEqual(admission.admit("10.0.0.1:2", 2), "queue")
+        self.assertIsNone(admission.admit("10.0.0.1:3"))
+        self.assertFalse(AdmissionController().overloaded(1000))
+
+    def test_shed(self):
+        admission = AdmissionController(retryAfter=7)
+        client, server = socket.socketpair()
+        client.settimeout(5)
+        client.sendall(b"GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+        admission.shed(server, "127.0.0.1:1", "queue")
+        response = b""
+        while True:
+            data = client.recv(65536)
+            if not data: break
+            response += data
+        client.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        self.assertTrue(head.startswith(b"HTTP/1.1 503 Service Unavailable\r\n"))
+        self.assertIn(b"\r\nRetry-After: 7\r\n", head)
+        self.assertIn(b"\r\nConnection: close", head)
+        self.assertIn("Content-Length: {}\r\n".format(len(body)).encode("ascii"), head + b"\r\n")
+        self.assertEqual(admission.stats()["queue"], 1)
+        self.assertEqual(server.fileno(), -1)
+
+    def test_scheduler_backlog(self):
+        scheduler = Scheduler(max_threads=2, max_queue=4)
+        release = threading.Event()
+        try:
+            tasks = [_Blocking(release) for _ in range(5)]
+            for task in tasks[:2]: scheduler.add(task)
+            for task in tasks[:2]: self.assertTrue(task.started.wait(5))
+            # busy workers alone leave no backlog
+            self.assertEqual(scheduler.backlog(), 0)
+            for task in tasks[2:]: scheduler.add(task)
+            self.assertEqual(scheduler.backlog(), 3)
+        finally:
+            release.set()
+            scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# test_connectionwatcher.py
+# tests that thread mode workers give idle connections to ConnectionWatcher and take them back on data
+
+import os
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from Pr0j3ct.connectionwatcher import ConnectionWatcher
+from Pr0j3ct.requests import RequestProcessor
+from Pr0j3ct.scheduler import Scheduler
+from Pr0j3ct.admission import AdmissionController
+from tests.test_requests import _AllowAll
+from tests.test_admission import _Blocking
+
+
+REQUEST = b"GET /index.html HTTP/1.1\r\nHost: x\r\n\r\n"
+
+
+def waitFor(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline: return False
+        time.sleep(0.01)
+    return True
+
+
+class ConnectionWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, "index.html"), "w") as outFile:
+            outFile.write("<html></html>")
+        self.scheduler = Scheduler(max_threads=1, max_queue=1)
+        self.admission = AdmissionController()
+        self.watcher = ConnectionWatcher(self.scheduler, self.admission)
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.scheduler.shutdown()
+        shutil.rmtree(self.root)
+
+    def connect(self, **options):
+        client, server = socket.socketpair()
+        client.settimeout(5)
+        processor = RequestProcessor(self.root, "index.html", server, "127.0.0.1:1", _AllowAll(), watcher=self.watcher, **options)
+        return client, processor
+
+    def receive(self, client):
+        data = b""
+        while not data.endswith(b"</html>"):
+            received = client.recv(65536)
+            if not received: break
+            data += received
+        return data
+
+    def test_idle_connection_gives_worker_back(self):
+        client, processor = self.connect()
+        client.sendall(REQUEST)
+        self.scheduler.add(processor)
+        self.assertTrue(self.receive(client).startswith(b"HTTP/1.1 200 OK"))
+        self.assertTrue(waitFor(lambda: processor in self.watcher.parked))
+        self.assertEqual(self.scheduler.status()["active"], 0)
+        # a second idle connection is served by the only worker
+        other, otherProcessor = self.connect()
+        other.sendall(REQUEST)
+        self.scheduler.add(otherProcessor)
+        self.assertTrue(self.receive(other).startswith(b"HTTP/1.1 200 OK"))
+        # parked connection is run again once its next request arrives
+        client.sendall(REQUEST)
+        self.assertTrue(self.receive(client).startswith(b"HTTP/1.1 200 OK"))
+        self.assertTrue(waitFor(lambda: processor in self.watcher.parked))
+        self.assertEqual(processor.requestCount, 2)
+        client.close()
+        self.assertTrue(waitFor(lambda: processor.stopped))
+        other.close()
+
+    def test_idle_timeout(self):
+        client, processor = self.connect(keepAliveTimeout=0.5)
+        client.sendall(REQUEST)
+        self.scheduler.add(processor)
+        self.receive(client)
+        self.assertTrue(waitFor(lambda: processor.stopped))
+        self.assertEqual(client.recv(10), b"")
+        self.assertNotIn(processor, self.watcher.parked)
+
+    def test_shed_when_scheduler_is_full(self):
+        client, processor = self.connect()
+        client.sendall(REQUEST)
+        self.scheduler.add(processor)
+        self.receive(client)
+        self.assertTrue(waitFor(lambda: processor in self.watcher.parked))
+        release = threading.Event()
+        busy = _Blocking(release)
+        self.scheduler.add(busy)
+        self.assertTrue(busy.started.wait(5))
+        self.scheduler.add(_Blocking(release))
+        try:
+            client.sendall(REQUEST)
+            self.assertTrue(self.receive(client).startswith(b"HTTP/1.1 503 Service Unavailable"))
+            self.assertTrue(waitFor(lambda: processor.stopped))
+            self.assertEqual(self.admission.stats()["queue"], 1)
+        finally:
+            release.set()
+
+    def test_stop_closes_parked(self):
+        client, processor = self.connect()
+        client.sendall(REQUEST)
+        self.scheduler.add(processor)
+        self.receive(client)
+        self.assertTrue(waitFor(lambda: processor in self.watcher.parked))
+        self.watcher.stop()
+        self.assertTrue(processor.stopped)
+        # a connection parked after stop is closed at once
+        client, processor = self.connect()
+        self.watcher.park(processor)
+        self.assertTrue(processor.stopped)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# test_credentialstore.py
+# tests password hashes and reloading of CredentialStore
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Pr0j3ct.credentialstore import CredentialStore, hashPassword, isHashed, checkPassword
+
+
+class CredentialStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "users.keys")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data, mode="w"):
+        with open(self.path, mode) as outFile:
+            outFile.write(data)
+
+    def reload(self, store):
+        # make change visible even within the timestamp resolution of file system
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+        store._check(force=True)
+
+    def test_hash(self):
+        stored = hashPassword("secret", iterations=1000)
+        self.assertTrue(isHashed(stored))
+        self.assertTrue(checkPassword("secret", stored))
+        self.assertFalse(checkPassword("other", stored))
+        self.assertTrue(checkPassword("plain", "plain"))
+        self.assertFalse(checkPassword("x", "pbkdf2_sha256$broken"))
+
+    def test_verify(self):
+        self.write("alice\n{}\nbob\nbobpass\n".format(hashPassword("alicepass", iterations=1000)))
+        store = CredentialStore(self.path)
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store.verify("alice", "alicepass"))
+        self.assertFalse(store.verify("alice", "bobpass"))
+        self.assertTrue(store.verify("bob", "bobpass"))
+        self.assertFalse(store.verify("carol", "bobpass"))
+
+    def test_append_is_incremental(self):
+        self.write("alice\na1\n")
+        store = CredentialStore(self.path)
+        self.write("bob\nb1\n", "a")
+        self.reload(store)
+        self.assertTrue(store.verify("alice", "a1"))
+        self.assertTrue(store.verify("bob", "b1"))
+
+    def test_username_without_password(self):
+        self.write("alice\na1\nbob\n")
+        store = CredentialStore(self.path)
+        self.assertNotIn("bob", store)
+        self.write("b1\n", "a")
+        self.reload(store)
+        self.assertTrue(store.verify("bob", "b1"))
+
+    def test_password_rotated_in_place(self):
+        # hashes have a fixed length, so the file keeps its size
+        users = ["user{}\n{}\n".format(i, hashPassword("old{}".format(i), iterations=1000)) for i in range(100)]
+        self.write("".join(users))
+        store = CredentialStore(self.path)
+        self.assertTrue(store.verify("user0", "old0"))
+        size = os.path.getsize(self.path)
+        users[0] = "user0\n{}\n".format(hashPassword("new0", iterations=1000))
+        self.write("".join(users))
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.reload(store)
+        self.assertFalse(store.verify("user0", "old0"))
+        self.assertTrue(store.verify("user0", "new0"))
+
+    def test_user_removed(self):
+        self.write("alice\na1\nbob\nb1\n")
+        store = CredentialStore(self.path)
+        self.write("alice\na2\nbob\nb1\n")
+        self.reload(store)
+        self.assertFalse(store.verify("alice", "a1"))
+        self.write("xxxxx\nxx\nbob\nb1\n")
+        self.reload(store)
+        self.assertNotIn("alice", store)
+        self.assertTrue(store.verify("bob", "b1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
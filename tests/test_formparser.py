@@ -0,0 +1,80 @@
+# test_formparser.py
+# tests streaming parsing of urlencoded and multipart/form-data bodies by FormParser
+
+import io
+import unittest
+
+from Pr0j3ct.formparser import FormParser, UploadedFile
+from Pr0j3ct.httpparser import HttpParseError
+
+
+def multipart(boundary, *parts):
+    """
+    Build multipart body of (disposition, content) parts
+    """
+    body = b"preamble"
+    for disposition, content in parts:
+        body += b"\r\n--" + boundary + b"\r\nContent-Disposition: form-data; " + disposition + b"\r\n\r\n" + content
+    return body + b"\r\n--" + boundary + b"--\r\nepilogue"
+
+
+class FormParserTest(unittest.TestCase):
+    def setUp(self):
+        # small chunks, so that delimiters and fields are split over reads
+        self.parser = FormParser(spoolSize=16, maxFieldSize=64, chunkSize=7)
+
+    def parse(self, contentType, body):
+        return self.parser.parse({"content-type": contentType}, io.BytesIO(body))
+
+    def test_urlencoded(self):
+        result = self.parse("application/x-www-form-urlencoded", b"username=admin&password=a%26b&empty=&username=x+y")
+        self.assertEqual(result, {"username": ["admin", "x y"], "password": ["a&b"], "empty": [""]})
+        self.assertEqual(self.parser.parse({}, io.BytesIO(b"a=1")), {"a": ["1"]})
+        self.assertEqual(self.parse("text/plain", b"a=1"), {})
+        self.assertEqual(self.parser.parse({}, None), {})
+
+    def test_urlencoded_field_too_large(self):
+        with self.assertRaises(HttpParseError) as context:
+            self.parse("application/x-www-form-urlencoded", b"a=" + b"x" * 100)
+        self.assertEqual(context.exception.code, 413)
+
+    def test_multipart(self):
+        content = bytes(range(256)) + b"\r\n--notboundary\r\n"
+        body = multipart(b"b0und",
+                         (b'name="title"', b"hello \xc3\xa9"),
+                         (b'name="file"; filename="data.bin"\r\nContent-Type: application/x-test', content))
+        result = self.parse("multipart/form-data; boundary=\"b0und\"", body)
+        self.assertEqual(result["title"], ["hello é"])
+        uploaded = result["file"][0]
+        self.assertIsInstance(uploaded, UploadedFile)
+        self.assertEqual((uploaded.filename, uploaded.contentType, str(uploaded)), ("data.bin", "application/x-test", "data.bin"))
+        self.assertEqual(uploaded.read(), content)
+        self.parser.close(result)
+        self.assertTrue(uploaded.file.closed)
+
+    def test_boundary(self):
+        body = multipart(b"a b", (b'name="x"', b"1"))
+        self.assertEqual(self.parse("multipart/form-data; boundary=\"a b\"", body), {"x": ["1"]})
+        for boundary in ("", "a" * 71, "ends with space ", "bad\"quote", "semi;colon"):
+            with self.assertRaises(HttpParseError, msg=boundary) as context:
+                self.parse("multipart/form-data; boundary=\"{}\"".format(boundary), body)
+            self.assertEqual(context.exception.code, 400)
+        with self.assertRaises(HttpParseError):
+            self.parse("multipart/form-data", body)
+
+    def test_malformed_multipart(self):
+        valid = multipart(b"xyz", (b'name="f"; filename="f.txt"', b"content"))
+        for body in (b"no delimiter at all", valid[:-20], valid.replace(b"\r\n\r\ncontent", b"content")):
+            with self.assertRaises(HttpParseError, msg=body) as context:
+                self.parse("multipart/form-data; boundary=xyz", body)
+            self.assertEqual(context.exception.code, 400)
+
+    def test_multipart_field_too_large(self):
+        body = multipart(b"xyz", (b'name="f"; filename="f.txt"', b"x" * 1000), (b'name="field"', b"x" * 100))
+        with self.assertRaises(HttpParseError) as context:
+            self.parse("multipart/form-data; boundary=xyz", body)
+        self.assertEqual(context.exception.code, 413)
+
+
+if __name__ == "__main__":
+    unittest.main()
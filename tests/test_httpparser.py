@@ -0,0 +1,110 @@
+# test_httpparser.py
+# tests framing of pipelined, split and chunked requests by HttpParser, and its errors
+
+import unittest
+
+from Pr0j3ct.httpparser import HttpParser, HttpParseError
+
+
+CHUNKED = (b"POST /upload.html?a=1 HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+           b"5\r\nhello\r\n7;name=value\r\n, world\r\n0\r\nX-Trailer: 1\r\n\r\n")
+GET = b"GET /index.html HTTP/1.1\r\nHost: x\r\n\r\n"
+POST = b"POST /login.html HTTP/1.1\r\nHost: x\r\nContent-Length: 9\r\n\r\nuser=abcd"
+
+
+class HttpParserTest(unittest.TestCase):
+    def parse(self, *segments, **options):
+        """
+        Feed segments to a new parser, return parser and all requests taken from it
+        """
+        parser = HttpParser(**options)
+        requests = []
+        for segment in segments:
+            parser.feed(segment)
+            while parser.requests:
+                requests.append(parser.next())
+        return parser, requests
+
+    def body(self, request):
+        request.body.seek(0)
+        return request.body.read()
+
+    def test_request(self):
+        _, (request,) = self.parse(b"get /a%20b.html?q=1&q=2&r=x HTTP/1.0\r\nHost: x\r\nAccept: a\r\naccept: b\r\n\r\n")
+        self.assertEqual((request.method, request.path, request.version), ("GET", "/a b.html", "HTTP/1.0"))
+        self.assertEqual(request.params, {"q": ["1", "2"], "r": ["x"]})
+        self.assertEqual(request.headers["accept"], "a, b")
+        self.assertIsNone(request.body)
+        self.assertFalse(request.keepAlive)
+
+    def test_chunked_and_pipelined(self):
+        parser, requests = self.parse(GET + CHUNKED + POST + GET)
+        self.assertEqual([x.method for x in requests], ["GET", "POST", "POST", "GET"])
+        self.assertEqual(self.body(requests[1]), b"hello, world")
+        self.assertEqual(requests[1].params, {"a": ["1"]})
+        self.assertEqual(self.body(requests[2]), b"user=abcd")
+        self.assertFalse(parser.pending())
+
+    def test_split_byte_by_byte(self):
+        data = CHUNKED + POST + GET
+        parser, requests = self.parse(*(data[i:i + 1] for i in range(len(data))))
+        self.assertEqual([x.method for x in requests], ["POST", "POST", "GET"])
+        self.assertEqual(self.body(requests[0]), b"hello, world")
+        self.assertEqual(self.body(requests[1]), b"user=abcd")
+        self.assertFalse(parser.pending())
+
+    def test_pending(self):
+        parser, requests = self.parse(GET + POST[:-3])
+        self.assertEqual(len(requests), 1)
+        self.assertTrue(parser.pending())
+        self.assertFalse(parser.ready())
+        parser.feed(POST[-3:])
+        self.assertEqual(self.body(parser.next()), b"user=abcd")
+        # line breaks between requests are not a pending request
+        parser.feed(b"\r\n")
+        self.assertFalse(parser.pending())
+
+    def test_large_body_is_spooled(self):
+        body = b"x" * 5000
+        _, (request,) = self.parse(b"PUT /f HTTP/1.1\r\nContent-Length: 5000\r\n\r\n" + body, spoolSize=1024)
+        self.assertTrue(request.body._rolled)
+        self.assertEqual(self.body(request), body)
+
+    def test_requests_before_error_are_kept(self):
+        parser = HttpParser()
+        parser.feed(GET + b"BROKEN\r\n\r\n" + GET)
+        self.assertEqual(parser.next().method, "GET")
+        with self.assertRaises(HttpParseError) as context:
+            parser.next()
+        self.assertEqual(context.exception.code, 400)
+
+    def test_errors(self):
+        cases = [
+            (b"GET / HTTP/2.0\r\n\r\n", {}, 505),
+            (b"GET /\r\n\r\n", {}, 400),
+            (b"GET / HTTP/1.1\r\nHost : x\r\n\r\n", {}, 400),
+            (b"POST / HTTP/1.1\r\nContent-Length: 1\r\nContent-Length: 2\r\n\r\n", {}, 400),
+            (b"POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n", {}, 400),
+            (b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n", {}, 501),
+            (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n", {}, 400),
+            (b"POST / HTTP/1.1\r\nContent-Length: 11\r\n\r\n", {"maxBodySize": 10}, 413),
+            (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nb\r\n", {"maxBodySize": 10}, 413),
+            (b"GET / HTTP/1.1\r\nX: " + b"a" * 100, {"maxHeaderSize": 64}, 431),
+        ]
+        for data, options, code in cases:
+            parser = HttpParser(**options)
+            parser.feed(data)
+            self.assertTrue(parser.ready(), data)
+            with self.assertRaises(HttpParseError) as context:
+                parser.next()
+            self.assertEqual(context.exception.code, code, data)
+
+    def test_expect_continue(self):
+        parser = HttpParser()
+        parser.feed(b"POST / HTTP/1.1\r\nExpect: 100-continue\r\nContent-Length: 2\r\n\r\n")
+        self.assertTrue(parser.expectContinue)
+        self.assertFalse(parser.ready())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+# test_requests.py
+# tests static file responses of RequestProcessor over a socket pair: Range, If-Range and 416
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from email.utils import formatdate
+
+from Pr0j3ct.requests import RequestProcessor
+
+
+"""
+This class allows every path and handles none, so that files are served as static files.
+"""
+class _AllowAll:
+    def auth(self, path, token=None):
+        return True
+
+    def handle(self, path, params, request=None, token=None):
+        return None
+
+
+class RangeTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.content = bytes(range(256)) * 4
+        with open(os.path.join(self.root, "data.bin"), "wb") as outFile:
+            outFile.write(self.content)
+        stat = os.stat(os.path.join(self.root, "data.bin"))
+        self.etag = "\"{:x}-{:x}\"".format(stat.st_mtime_ns, stat.st_size)
+        self.lastModified = formatdate(timeval=stat.st_mtime, localtime=False, usegmt=True)
+        self.client, server = socket.socketpair()
+        self.client.settimeout(5)
+        self.received = b""
+        self.processor = RequestProcessor(self.root, "index.html", server, "127.0.0.1:1", _AllowAll())
+
+    def tearDown(self):
+        self.processor.stop()
+        self.client.close()
+        shutil.rmtree(self.root)
+
+    def get(self, *headers):
+        """
+        Send GET request of data.bin with headers, return (status code, headers, body) of response
+        """
+        request = "GET /data.bin HTTP/1.1\r\nHost: x\r\n" + "".join(x + "\r\n" for x in headers) + "\r\n"
+        self.processor.process(request.encode("latin-1"))
+        return self.response()
+
+    def response(self):
+        """
+        Read one response, return (status code, headers, body)
+        """
+        while b"\r\n\r\n" not in self.received:
+            self.received += self.client.recv(65536)
+        head, _, self.received = self.received.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        headers = dict((name.lower(), value.strip()) for name, _, value in (line.partition(":") for line in lines[1:]))
+        length = int(headers.get("content-length", 0))
+        while len(self.received) < length:
+            self.received += self.client.recv(65536)
+        body, self.received = self.received[:length], self.received[length:]
+        return int(lines[0].split()[1]), headers, body
+
+    def test_whole_file(self):
+        code, headers, body = self.get()
+        self.assertEqual(code, 200)
+        self.assertEqual(headers["accept-ranges"], "bytes")
+        self.assertEqual(headers["etag"], self.etag)
+        self.assertEqual(body, self.content)
+
+    def test_single_range(self):
+        code, headers, body = self.get("Range: bytes=10-19")
+        self.assertEqual(code, 206)
+        self.assertEqual(headers["content-range"], "bytes 10-19/1024")
+        self.assertEqual(body, self.content[10:20])
+        code, headers, body = self.get("Range: bytes=-100")
+        self.assertEqual((code, body), (206, self.content[-100:]))
+        code, headers, body = self.get("Range: bytes=1000-5000")
+        self.assertEqual((code, headers["content-range"], body), (206, "bytes 1000-1023/1024", self.content[1000:]))
+
+    def test_multiple_ranges(self):
+        code, headers, body = self.get("Range: bytes=0-4, 100-104")
+        self.assertEqual(code, 206)
+        self.assertTrue(headers["content-type"].startswith("multipart/byteranges; boundary="))
+        boundary = headers["content-type"].split("boundary=")[1].encode("ascii")
+        parts = body.split(b"--" + boundary)
+        self.assertEqual(parts[-1], b"--\r\n")
+        self.assertIn(b"Content-Range: bytes 0-4/1024\r\n\r\n" + self.content[0:5] + b"\r\n", parts[1])
+        self.assertIn(b"Content-Range: bytes 100-104/1024\r\n\r\n" + self.content[100:105] + b"\r\n", parts[2])
+
+    def test_not_satisfiable(self):
+        code, headers, _ = self.get("Range: bytes=2000-3000")
+        self.assertEqual(code, 416)
+        self.assertEqual(headers["content-range"], "bytes */1024")
+        # connection stays usable after 416
+        self.assertEqual(self.get()[0], 200)
+
+    def test_invalid_range_sends_whole_file(self):
+        for value in ("bytes=20-10", "items=0-10", "bytes=a-b", "bytes=" + ",".join("{}-{}".format(i, i) for i in range(17))):
+            code, _, body = self.get("Range: " + value)
+            self.assertEqual((code, len(body)), (200, len(self.content)), value)
+
+    def test_if_range(self):
+        self.assertEqual(self.get("Range: bytes=0-9", "If-Range: " + self.etag)[0], 206)
+        self.assertEqual(self.get("Range: bytes=0-9", "If-Range: " + self.lastModified)[0], 206)
+        # changed file, weak validator or other date send whole file
+        self.assertEqual(self.get("Range: bytes=0-9", "If-Range: \"other\"")[0], 200)
+        self.assertEqual(self.get("Range: bytes=0-9", "If-Range: W/" + self.etag)[0], 200)
+        self.assertEqual(self.get("Range: bytes=0-9", "If-Range: Thu, 01 Jan 1970 00:00:00 GMT")[0], 200)
+        # an unsatisfiable range of a changed file is not answered with 416
+        self.assertEqual(self.get("Range: bytes=2000-3000", "If-Range: \"other\"")[0], 200)
+
+    def test_not_modified(self):
+        code, headers, body = self.get("If-None-Match: " + self.etag)
+        self.assertEqual((code, body), (304, b""))
+
+    def test_pipelined(self):
+        request = "GET /data.bin HTTP/1.1\r\nHost: x\r\nRange: bytes={}\r\n\r\n"
+        self.processor.process((request.format("0-1") + request.format("2-3")).encode("latin-1"))
+        self.assertEqual(self.response()[2], self.content[0:2])
+        self.assertEqual(self.response()[2], self.content[2:4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+# test_responsecache.py
+# tests caching, eviction and single-flight coalescing of ResponseCache
+
+import time
+import threading
+import unittest
+
+from Pr0j3ct.responsecache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_key(self):
+        cache = ResponseCache(30, params=["q"])
+        self.assertEqual(cache.key({"q": ["a"], "page": ["1"]}), cache.key({"page": ["2"], "q": ["a"]}))
+        self.assertNotEqual(cache.key({"q": ["a"]}), cache.key({"q": ["b"]}))
+        perUser = ResponseCache(30, perUser=True)
+        self.assertNotEqual(perUser.key({}, "alice"), perUser.key({}, "bob"))
+
+    def test_hit_and_expiry(self):
+        cache = ResponseCache(0.05)
+        self.assertEqual(cache.get("k", lambda: (b"h", b"1")), ((b"h", b"1"), "miss"))
+        self.assertEqual(cache.get("k", lambda: (b"h", b"2")), ((b"h", b"1"), "hit"))
+        time.sleep(0.1)
+        self.assertEqual(cache.get("k", lambda: (b"h", b"3")), ((b"h", b"3"), "miss"))
+
+    def test_not_handled_is_not_cached(self):
+        cache = ResponseCache(30)
+        self.assertEqual(cache.get("k", lambda: None), (None, "miss"))
+        self.assertEqual(cache.get("k", lambda: (b"h", b"b")), ((b"h", b"b"), "miss"))
+
+    def test_eviction(self):
+        cache = ResponseCache(30, maxEntries=2, maxBytes=10)
+        cache.get("a", lambda: (b"", b"aaa"))
+        cache.get("b", lambda: (b"", b"bbb"))
+        cache.get("a", lambda: None) # "a" is now most recently used
+        cache.get("c", lambda: (b"", b"ccc"))
+        self.assertEqual(cache.get("a", lambda: None)[1], "hit")
+        self.assertEqual(cache.get("b", lambda: None)[1], "miss")
+        # too large to be cached at all
+        cache.get("big", lambda: (b"", b"x" * 11))
+        self.assertEqual(cache.get("big", lambda: None)[1], "miss")
+        self.assertLessEqual(cache.stats()["bytes"], 10)
+
+    def test_coalescing(self):
+        cache = ResponseCache(30)
+        release = threading.Event()
+        calls = []
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return (b"h", b"body")
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("k", compute))) for _ in range(8)]
+        for thread in threads: thread.start()
+        # let all requests reach the cache before the handler finishes
+        while cache.stats()["miss"] + cache.stats()["coalesced"] < 8: time.sleep(0.01)
+        release.set()
+        for thread in threads: thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(outcome for _, outcome in results), ["coalesced"] * 7 + ["miss"])
+        self.assertTrue(all(response == (b"h", b"body") for response, _ in results))
+        self.assertEqual(cache.flights, {})
+
+    def test_wait_timeout(self):
+        cache = ResponseCache(30, waitTimeout=0.05)
+        release = threading.Event()
+        def stuck():
+            release.wait(5)
+            return (b"h", b"slow")
+        leader = threading.Thread(target=cache.get, args=("k", stuck))
+        leader.start()
+        while cache.stats()["miss"] < 1: time.sleep(0.01)
+        start = time.monotonic()
+        self.assertEqual(cache.get("k", lambda: (b"h", b"own")), ((b"h", b"own"), "timeout"))
+        self.assertLess(time.monotonic() - start, 1)
+        release.set()
+        leader.join()
+        # response computed by waiter is not cached, the one of leader is
+        self.assertEqual(cache.get("k", lambda: None), ((b"h", b"slow"), "hit"))
+        self.assertEqual(cache.stats()["timeout"], 1)
+        self.assertEqual(cache.stats()["coalesced"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# test_rulematcher.py
+# tests glob matching of RuleMatcher against glob.glob, and decisions of PermissionSet and RuleSet
+
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+
+from Pr0j3ct.rulematcher import RuleMatcher, PermissionSet, RuleSet
+
+
+FILES = ["index.html", "login.html", ".hidden.html", "a.txt", "b.txt", "ab.txt", "[x].txt",
+         "sub/page.html", "sub/.secret", ".media/logo.png", ".media/README.md"]
+
+
+class RuleMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in FILES:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def test_same_as_glob(self):
+        patterns = ["*", "*.html", "*/*", "sub/*", ".*", ".media/*", "?.txt", "[ab].txt", "[!a].txt", "[x].txt",
+                    "*.md", ".*/*.md", "sub/.*", "missing/*"]
+        for pattern in patterns:
+            expected = {os.path.relpath(x, self.root).replace(os.sep, "/") for x in glob.glob(os.path.join(self.root, pattern))}
+            matcher = RuleMatcher(self.root, [pattern], [], {})
+            matched = {name for name in FILES if matcher.match(self.path(name))}
+            # directories matched by glob are never files, compare files only
+            self.assertEqual(matched, expected & set(FILES), pattern)
+
+    def test_hidden_names(self):
+        matcher = RuleMatcher(self.root, ["*"], [".*"], {})
+        self.assertTrue(matcher.match(self.path("index.html")))
+        self.assertFalse(matcher.match(self.path(".hidden.html")))
+        self.assertIsNone(RuleMatcher(self.root, ["*/*"], [], {}).match(self.path(".media/logo.png")))
+
+    def test_order_and_exceptions(self):
+        matcher = RuleMatcher(self.root, ["login.html"], ["*.html", ".media/*.md"], {"admin": ["*.html"]})
+        self.assertTrue(matcher.match(self.path("login.html")))
+        self.assertFalse(matcher.match(self.path("index.html")))
+        self.assertTrue(matcher.match(self.path("index.html"), "admin"))
+        self.assertFalse(matcher.match(self.path(".media/README.md"), "admin"))
+        self.assertIsNone(matcher.match(self.path("a.txt")))
+
+    def test_outside_root(self):
+        matcher = RuleMatcher(self.root, ["*", "../*", "/etc/*"], [], {})
+        self.assertIsNone(matcher.match(os.path.join(self.root, "..", "index.html")))
+        self.assertIsNone(matcher.match(self.root + "other/index.html"))
+
+    def test_permission_set(self):
+        matcher = RuleMatcher(self.root, ["login.html"], ["*.html"], {"admin": ["index.html"]})
+        permissions = PermissionSet(matcher, "admin", maxCacheSize=2)
+        for name in ("index.html", "login.html", "sub/page.html", "index.html"):
+            self.assertEqual(permissions.decide(self.path(name)), matcher.match(self.path(name), "admin"))
+        self.assertFalse(permissions.decide(self.path("a.html")))
+        self.assertLessEqual(len(permissions.decisionCache), 2)
+
+    def test_rule_set(self):
+        matcher = RuleMatcher(self.root, [], ["*.html"], {"admin": ["index.html"]})
+        ruleSet = RuleSet({}, matcher, None, {})
+        self.assertTrue(ruleSet.decide(self.path("index.html"), "admin"))
+        self.assertFalse(ruleSet.decide(self.path("index.html"), "bob"))
+        # users without exceptions share permissions of anonymous clients
+        self.assertIs(ruleSet.permissions("bob"), ruleSet.permissions(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
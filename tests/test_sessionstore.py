@@ -0,0 +1,95 @@
+# test_sessionstore.py
+# tests expiry of sessions in SessionStore and SqliteSessionStore, and sharing of the SQLite file
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from Pr0j3ct.sessionstore import SessionStore, SqliteSessionStore, newToken
+
+
+"""
+This class runs the same tests on both stores, subclasses set `create`.
+"""
+class _StoreTests:
+    def test_set_get_delete(self):
+        store = self.create()
+        token = newToken()
+        self.assertIsNone(store.get(token))
+        self.assertEqual(store.get(token, "none"), "none")
+        store.set(token, "alice")
+        self.assertEqual(store.get(token), "alice")
+        self.assertEqual(len(store), 1)
+        store.set(token, "bob")
+        self.assertEqual(store.get(token), "bob")
+        store.delete(token)
+        self.assertIsNone(store.get(token))
+        store.delete(token)
+        self.assertEqual(len(store), 0)
+
+    def test_idle_timeout(self):
+        store = self.create(idleTimeout=0.3)
+        store.set("used", "alice")
+        store.set("idle", "bob")
+        for _ in range(3):
+            time.sleep(0.15)
+            self.assertEqual(store.get("used"), "alice")
+        self.assertIsNone(store.get("idle"))
+
+    def test_max_age(self):
+        store = self.create(maxAge=0.2)
+        store.set("token", "alice")
+        self.assertEqual(store.get("token"), "alice")
+        time.sleep(0.3)
+        self.assertIsNone(store.get("token"))
+        self.assertEqual(len(store), 0)
+
+    def test_threads(self):
+        store = self.create()
+        def login(index):
+            for i in range(50):
+                store.set("{}-{}".format(index, i), index)
+                self.assertEqual(store.get("{}-{}".format(index, i)), index)
+        threads = [threading.Thread(target=login, args=(index,)) for index in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(len(store), 200)
+
+
+class SessionStoreTest(_StoreTests, unittest.TestCase):
+    def create(self, **options):
+        return SessionStore(stripes=4, **options)
+
+    def test_sweep_on_write(self):
+        store = self.create(maxAge=0.1)
+        for i in range(8): store.set(i, "user")
+        time.sleep(0.2)
+        # each write sweeps one stripe
+        for i in range(4): store.set("new{}".format(i), "user")
+        self.assertEqual(len(store), 4)
+
+
+class SqliteSessionStoreTest(_StoreTests, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "sessions.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create(self, **options):
+        return SqliteSessionStore(self.path, **options)
+
+    def test_shared_by_stores(self):
+        first, second = self.create(), self.create()
+        first.set("token", {"user": "alice"})
+        self.assertEqual(second.get("token"), {"user": "alice"})
+        second.delete("token")
+        self.assertIsNone(first.get("token"))
+
+
+if __name__ == "__main__":
+    unittest.main()
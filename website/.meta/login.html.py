@@ -5,40 +5,67 @@ import sys
 import argparse
 from email.utils import formatdate
 
-HEADER_Accepted = [
-    "HTTP/1.1 302 Verified\r\n",
-    "Date: {}\r\n".format(formatdate(timeval=None, localtime=False, usegmt=True)),
-    "Server: Pr0j3ct subprocess\r\n",
-    "Location: /presentation.html\r\n"
-]
+# repository root holding the server package, two levels above this script
+REPOSITORY = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+def header_accepted():
+    """
+    build accepted header
+    """
+    return [
+        "HTTP/1.1 302 Verified\r\n",
+        "Date: {}\r\n".format(formatdate(timeval=None, localtime=False, usegmt=True)),
+        "Server: Pr0j3ct handler\r\n",
+        "Location: /presentation.html\r\n"
+    ]
+
+def header_rejected(length):
+    """
+    build rejected header
+    """
+    return [
+        "HTTP/1.1 403 Rejected\r\n",
+        "Date: {}\r\n".format(formatdate(timeval=None, localtime=False, usegmt=True)),
+        "Server: Pr0j3ct handler\r\n",
+        "Content-Length: {}\r\n".format(length),
+        "Content-Type: text/html; charset=utf-8\r\n"
+    ]
 
-HEADER_Rejected = [
-    "HTTP/1.1 403 Rejected\r\n",
-    "Date: {}\r\n".format(formatdate(timeval=None, localtime=False, usegmt=True)),
-    "Server: Pr0j3ct subprocess\r\n",
-    "Content-Length: {}\r\n",
-    "Content-Type: text/html; charset=utf-8\r\n"
-]
 
 
+def verify(rootDirectory, username, password, credentials=None):
+    """
+    Verify username and password with credential store of server, or load local database if not given
+    """
+    if credentials is None:
+        from Pr0j3ct.credentialstore import CredentialStore
+        credentials = CredentialStore(os.path.join(rootDirectory, "users.keys"))
+    return credentials.verify(username, password)
+
+def rejected_page(rootDirectory):
+    """
+    load rejected html content in bytes
+    """
+    with open(os.path.join(rootDirectory, "login.html.rejected.html"), "rb") as inFile:
+        return inFile.read()
 
-def verify(rootDirectory, username, password):
+def handle(params, context):
     """
-    Load local database and verify username and password
+    handle parameters in server process, return (header, body)
     """
-    with open(os.path.join(rootDirectory, "users.keys"), "r") as inFile:
-        data = inFile.readlines()
-        for u, p in zip(data[0::2], data[1::2]):
-            if username == u.strip():
-                if password == p.strip(): return True
-                break
-    return False
+    username = params.get("username", [None])[0]
+    password = params.get("password", [None])[0]
+    if not (username and password): return None
+    if verify(context.scriptDirectory, username, password, context.credentials):
+        return "".join(header_accepted()).encode("utf-8"), b""
+    data = rejected_page(context.scriptDirectory)
+    return "".join(header_rejected(len(data))).encode("utf-8"), data
 
 def accept():
     """
     print header_accpeted
     """
-    print("".join(HEADER_Accepted), end="")
+    print("".join(header_accepted()), end="")
     print()
 
 def reject(rootDirectory):
@@ -47,7 +74,7 @@ def reject(rootDirectory):
     """
     with open(os.path.join(rootDirectory, "login.html.rejected.html"), "r") as inFile:
         data = inFile.read()
-    print("".join(HEADER_Rejected).format(len(data)), end="")
+    print("".join(header_rejected(len(data))), end="")
     print()
     print(data, end="")
     print()
@@ -58,8 +85,11 @@ if __name__=="__main__":
     parser.add_argument("--password", help="password for login")
     args, _ = parser.parse_known_args()
     if (args.username) and (args.password):
+        # server package is found from repository root, its log messages are kept out of printed response
+        if REPOSITORY not in sys.path: sys.path.insert(0, REPOSITORY)
+        from Pr0j3ct.logging import backend
+        backend.configure(level="ERROR", console=False)
         if verify(os.path.dirname(sys.argv[0]), args.username, args.password):
             accept()
         else:
             reject(os.path.dirname(sys.argv[0]))
-    
\ No newline at end of file